@@ -1,4 +1,9 @@
-TILES_INIFILENAME = "tiles.ini"
+TILES_CATALOGFILENAME = "tiles.npy"
+TILES_NPYDIRNAME = "npy" # subdirectory of the tiles directory for the memory mapped tile copies
+TILES_WINDOWSIZE = 256 # number of rows and columns of a window if the raster has no internal blocks
+TILES_INT16_SCALE = 0.01 # unit of the values for int16 tile storage (centimeters)
+TILES_INT16_NODATA = -32768 # no data value for int16 tile storage
+ROUTES_CACHE_SUFFIX = ".routes.npz" # extension of the binary cache of the routes shapefile
 
 
 
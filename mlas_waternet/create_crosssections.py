@@ -1,74 +1,218 @@
 import argparse
 import sys
+from functools import partial
 from pathlib import Path
+from typing import Callable, List, Tuple
 import shapefile
-from tqdm import tqdm
 
-from mlas.objects.points import Point2D
+from mlas.objects.crosssection import Crosssection
 
 from mlas_waternet.creators.crosssectioncreator import CrosssectionCreator
-from mlas_waternet.creators.waterbottomcreator import WaterBottomCreator
 from mlas_waternet.dataproviders.heightdataprovider import HeightDataProvider, TileType
 from mlas_waternet.settings import OUTPUT_PATHS
 from mlas_waternet.dataproviders.inputdatabase import DBInput
+from mlas_waternet.dataproviders.crosssectionstore import CrosssectionStore
+from mlas_waternet.gis.routes import Route, get_routes
+from mlas_waternet.gis.corridor import get_corridor_tileset
+from mlas_waternet.gis.ditches import get_ditch_index
+from mlas_waternet.pipeline import Pipeline, Stage
+from mlas_waternet.rendering import RenderMode, RenderService
 
 
 HEIGHT_DATA = TileType.AHN3
 WATERBOTTOM_DATA = TileType.WATERBOTTOM
 DITCHES_DATA = TileType.DITCHES
+CORRIDOR_MARGIN = 60 # distance around the levee to store in the corridor mosaics, should cover the crosssections
+PIPELINE_QUEUE_SIZE = 64 # maximum number of crosssections waiting in front of each stage
+STORE_BATCH_SIZE = 500 # crosssections per file of the crosssection store
+
+
+def serialize(store: CrosssectionStore, crosssections: List[Crosssection]) -> List[Tuple[Crosssection, str, int]]:
+    """Write a batch of crosssections to the crosssection store
+
+    Args:
+        store (CrosssectionStore): the crosssection store
+        crosssections (List[Crosssection]): the crosssections of the batch
+
+    Returns:
+        List[Tuple[Crosssection, str, int]]: per crosssection the crosssection, the store file and the row group
+    """
+    # one store file per batch instead of a json file per crosssection
+    return [(crs, storefile, rowgroup) for crs, (storefile, rowgroup) in zip(crosssections, store.write(crosssections))]
+
+
+def plot(render_service: RenderService, item: Tuple[Crosssection, str, int]) -> Tuple[Crosssection, str, int, str]:
+    """Plot a crosssection, waits until the render service has written the image
+
+    Args:
+        render_service (RenderService): the render service that plots the crosssections
+        item (Tuple[Crosssection, str, int]): the crosssection, the store file and the row group (see serialize)
+
+    Returns:
+        Tuple[Crosssection, str, int, str]: the crosssection, the store file, the row group and the filename of the image
+    """
+    crs, storefile, rowgroup = item
+    crs_imgname = render_service.render_crosssection(crs, OUTPUT_PATHS["crosssection_plots"]).result()
+    return crs, storefile, rowgroup, crs_imgname
+
+
+def get_data_providers(route: Route = None, mosaic: bool = False) -> Tuple[HeightDataProvider, HeightDataProvider, HeightDataProvider]:
+    """Get the height, ditch and waterbottom data providers
+
+    Args:
+        route (Route): the route of the levee, only needed for the mosaics
+        mosaic (bool): use (and create if necessary) corridor mosaics of the levee instead of the tile directories
+
+    Returns:
+        Tuple[HeightDataProvider, HeightDataProvider, HeightDataProvider]: the height, ditch and waterbottom data providers
+    """
+    if mosaic:
+        return tuple(
+            HeightDataProvider(
+                tile_type=tile_type,
+                tileset=get_corridor_tileset(route, tile_type, CORRIDOR_MARGIN, OUTPUT_PATHS["corridor_mosaics"])
+            )
+            for tile_type in [HEIGHT_DATA, DITCHES_DATA, WATERBOTTOM_DATA]
+        )
+    return (
+        HeightDataProvider(tile_type=HEIGHT_DATA),
+        HeightDataProvider(tile_type=DITCHES_DATA),
+        HeightDataProvider(tile_type=WATERBOTTOM_DATA),
+    )
+
+
+def create_levee_crosssections(
+    db: DBInput,
+    route: Route,
+    data_providers: Tuple[HeightDataProvider, HeightDataProvider, HeightDataProvider],
+    center_to_center: int,
+    incremental: bool = False,
+    workers: int = 1,
+    serialize_workers: int = 1,
+    plot_workers: int = 2,
+    render_mode: RenderMode = RenderMode.FIGURE,
+    select: Callable[[List[int]], List[int]] = None,
+    on_persisted: Callable[[Crosssection], None] = None,
+) -> int:
+    """Create, serialize, plot and store the crosssections of a levee
+
+    Args:
+        db (DBInput): the database
+        route (Route): the route of the levee
+        data_providers (Tuple[HeightDataProvider, HeightDataProvider, HeightDataProvider]): the height, ditch and waterbottom data providers (see get_data_providers)
+        center_to_center (int): distance between the crosssections
+        incremental (bool): only create the crosssections whose route, tiles or parameters changed since the last run
+        workers (int): number of processes to create the crosssections with
+        serialize_workers (int): number of threads that write the crosssections to the crosssection store
+        plot_workers (int): number of processes that plot the crosssections
+        render_mode (RenderMode): plot matplotlib figures or thumbnails
+        select (Callable[[List[int]], List[int]]): optional, gets the chainages that would be created and returns the chainages to create
+        on_persisted (Callable[[Crosssection], None]): optional, called with each crosssection once it is stored
+
+    Returns:
+        int: the number of created crosssections
+    """
+    ahn3hdp, ditchhdp, waterbottomhdp = data_providers
+
+    # the ditch polygons of the levee tell where the ditch tiles need to be sampled
+    ditch_index = get_ditch_index(route, ditchhdp.tileset, CORRIDOR_MARGIN, OUTPUT_PATHS["ditch_indices"])
+
+    crc = CrosssectionCreator(
+        levee_code=route.name,
+        center_to_center_distance_chainage=center_to_center,
+        height_data_provider = ahn3hdp,
+        ditch_data_provider = ditchhdp,
+        ditch_index = ditch_index,
+        waterbottom_data_provider = waterbottomhdp,
+        workers=workers
+    )
+
+    # remove the crosssections at chainages that no longer exist, for example if the route got shorter
+    chainages = [int(chainage) for chainage in crc.get_chainages()]
+    num_deleted = db.delete_crosssections(route.name, chainages)
+    if num_deleted > 0:
+        print(f"{route.name}: removed {num_deleted} crosssections outside of the route")
+
+    # the crosssections with the same manifest as in the database are up to date, the manifests
+    # are only stored by incremental runs so the first incremental run creates all crosssections
+    manifests = {}
+    if incremental:
+        manifests = crc.get_manifests(chainages)
+        previous = db.get_crosssection_manifests(route.name)
+        chainages = [chainage for chainage in chainages if previous.get(chainage) != manifests[chainage]]
+        print(f"{route.name}: {len(manifests) - len(chainages)} of {len(manifests)} crosssections are up to date")
+    if select is not None:
+        chainages = select(chainages)
+
+    def persist(item):
+        crs, storefile, rowgroup, crs_imgname = item
+        db.add_crosssection(
+            crs, jsonfile=None, imgfile=crs_imgname, manifest=manifests.get(crs.levee_chainage), storefile=storefile, rowgroup=rowgroup
+        )
+        if on_persisted is not None:
+            on_persisted(crs)
+        return crs
+
+    count = 0
+    store = CrosssectionStore(OUTPUT_PATHS["crosssections_store"])
+    if len(chainages) > 0:
+        with RenderService(workers=plot_workers, mode=render_mode) as render_service:
+            # generate -> serialize -> plot -> persist, the stages work at the same time
+            pipeline = Pipeline(
+                stages=[
+                    Stage("serialize", partial(serialize, store), workers=serialize_workers, batch_size=STORE_BATCH_SIZE),
+                    Stage("plot", partial(plot, render_service), workers=plot_workers), # the render service has the processes
+                    Stage("persist", persist), # one worker, the database session is not thread safe
+                ],
+                queue_size=PIPELINE_QUEUE_SIZE,
+            )
+            count = pipeline.run(crc.iter_execute(chainages=chainages))
+
+    # the store files whose crosssections were all written again or deleted are no longer needed
+    store.remove_unreferenced(route.name, db.get_crosssection_storefiles(route.name))
+    return count
+
 
 if __name__=="__main__":
     db = DBInput()
-    # preload the heightdataproviders saves time
-    ahn3hdp = HeightDataProvider(tile_type=HEIGHT_DATA)
-    ditchhdp = HeightDataProvider(tile_type=DITCHES_DATA)
-    waterbottomhdp = HeightDataProvider(tile_type=WATERBOTTOM_DATA)
 
     if len(sys.argv) == 1: # for debugging purposes
         args = {
             "leveecode":"P019",
-            "centertocenter":10
+            "centertocenter":10,
+            "mosaic":False,
+            "workers":1,
+            "incremental":False,
+            "serializeworkers":1,
+            "plotworkers":2,
+            "output":"figure"
         }
     else:
         argparser = argparse.ArgumentParser(description='Create crosssections for a given levee.')
         argparser.add_argument("-l", "--leveecode", required=True, help="Levee code (like A145)")
         argparser.add_argument("-c", "--centertocenter", required=False, help="Center to center distance between crosssections")
+        argparser.add_argument("-m", "--mosaic", action="store_true", help="Use (and create if necessary) corridor mosaics of the levee instead of the tile directories")
+        argparser.add_argument("-i", "--incremental", action="store_true", help="Only create the crosssections whose route, tiles or parameters changed since the last run")
+        argparser.add_argument("-w", "--workers", required=False, type=int, default=1, help="Number of processes to create the crosssections with")
+        argparser.add_argument("-s", "--serializeworkers", required=False, type=int, default=1, help="Number of threads that write the crosssections to the crosssection store")
+        argparser.add_argument("-p", "--plotworkers", required=False, type=int, default=2, help="Number of processes that plot the crosssections")
+        argparser.add_argument("-o", "--output", required=False, choices=["figure", "thumbnail"], default="figure", help="Plot the crosssections as matplotlib figures or as (much faster) small thumbnails")
 
         args = vars(argparser.parse_args())
-    
-    crc = CrosssectionCreator(
-        levee_code=args["leveecode"],
-        center_to_center_distance_chainage=int(args["centertocenter"]),
-        height_data_provider = ahn3hdp
-    )    
 
+    route = get_routes().get_by_levee_code(args["leveecode"])
+    if route is None:
+        raise ValueError(f"Unknown levee code {args['leveecode']}")
     print("Creating crosssections, this might take some time...")
-    for crs in tqdm(crc.execute()):
-        # # add ditches
-        # dtc = WaterBottomCreator(
-        #     height_data_provider = ditchhdp,
-        #     start_point = crs.startpoint,
-        #     end_point = crs.endpoint       
-        # )
-        # ditches = dtc.execute()
-
-        # for ditch in ditches:
-        #     crs.add_ditch([Point2D(x=p.l, z=p.z) for p in ditch])        
-
-        # # add waterbottom of levee
-        # wbc = WaterBottomCreator(
-        #     height_data_provider = waterbottomhdp,
-        #     start_point = crs.startpoint,
-        #     end_point = crs.endpoint       
-        # )
-        # waterbottoms = wbc.execute()
-
-        # for waterbottom in waterbottoms:
-        #     crs.add_waterbottom([Point2D(x=p.l, z=p.z) for p in waterbottom])
-
-        crs_pfilename = crs.serialize(filepath=OUTPUT_PATHS["crosssections_json"])
-        crs_pimgname = crs.plot(filepath=OUTPUT_PATHS["crosssection_plots"])
-
-        crs_filename = str(crs_pfilename.resolve())
-        crs_imgname = str(crs_pimgname.resolve())
-        db.add_crosssection(crs, jsonfile=crs_filename, imgfile=crs_imgname)
+    num_crosssections = create_levee_crosssections(
+        db,
+        route,
+        get_data_providers(route, args["mosaic"]),
+        center_to_center=int(args["centertocenter"]),
+        incremental=args["incremental"],
+        workers=args["workers"],
+        serialize_workers=args["serializeworkers"],
+        plot_workers=args["plotworkers"],
+        render_mode=RenderMode[args["output"].upper()],
+    )
+    print(f"Created {num_crosssections} crosssections")
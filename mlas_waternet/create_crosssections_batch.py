@@ -0,0 +1,249 @@
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List
+
+from mlas.objects.crosssection import Crosssection
+
+from mlas_waternet.create_crosssections import create_levee_crosssections, get_data_providers
+from mlas_waternet.dataproviders.inputdatabase import DBInput
+from mlas_waternet.gis.routes import get_routes
+from mlas_waternet.rendering import RenderMode
+from mlas_waternet.settings import OUTPUT_PATHS
+
+
+CHECKPOINT_INTERVAL = 30 # seconds between the checkpoints of a levee
+
+
+class Checkpoint:
+    """The progress of a levee in a batch run, stored as json
+
+    The crosssections are not stored in chainage order (the pipeline stages have
+    several workers) so the checkpoint keeps the last chainage up to which all
+    crosssections are stored. A run that was interrupted continues after that
+    chainage. The checkpoint is only valid for the same parameters.
+
+    Args:
+        filename (str): the json file
+        levee_code (str): code of the levee
+        parameters (dict): the parameters of the run
+        resume (bool): read the progress of the previous run, if False the levee starts from the beginning
+    """
+
+    def __init__(self, filename: str, levee_code: str, parameters: dict, resume: bool = True):
+        self.filename = Path(filename)
+        self.levee_code = levee_code
+        self.parameters = parameters
+        self.chainage = None # all crosssections up to this chainage are stored
+        self.finished = False
+        self.num_crosssections = 0
+        self.seconds = 0.0
+        self._pending: List[int] = []
+        self._index = 0
+        self._done = set()
+        self._saved = time.time()
+
+        if resume and self.filename.is_file():
+            with open(self.filename) as f:
+                data = json.load(f)
+            if data.get("parameters") == parameters:
+                self.chainage = data["chainage"]
+                self.finished = data["finished"]
+                self.num_crosssections = data["crosssections"]
+                self.seconds = data["seconds"]
+
+    def select(self, chainages: List[int]) -> List[int]:
+        """Get the chainages that were not stored in a previous run, these are the chainages of this run
+
+        Args:
+            chainages (List[int]): the chainages of the crosssections that would be created
+
+        Returns:
+            List[int]: the chainages of the crosssections to create
+        """
+        self._pending = sorted(int(chainage) for chainage in chainages if self.chainage is None or chainage > self.chainage)
+        self._index = 0
+        self._done = set()
+        return self._pending
+
+    def add(self, crosssection: Crosssection) -> None:
+        """Register a stored crosssection, the checkpoint is saved every CHECKPOINT_INTERVAL seconds"""
+        self._done.add(int(crosssection.levee_chainage))
+        self.num_crosssections += 1
+        while self._index < len(self._pending) and self._pending[self._index] in self._done:
+            self.chainage = int(self._pending[self._index])
+            self._done.discard(self.chainage)
+            self._index += 1
+        if time.time() - self._saved > CHECKPOINT_INTERVAL:
+            self.save()
+
+    def save(self) -> None:
+        """Write the checkpoint"""
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        tmpfile = self.filename.with_suffix(".tmp")
+        with open(tmpfile, "w") as f:
+            json.dump(
+                {
+                    "levee_code": self.levee_code,
+                    "parameters": self.parameters,
+                    "chainage": self.chainage,
+                    "finished": self.finished,
+                    "crosssections": self.num_crosssections,
+                    "seconds": self.seconds,
+                },
+                f,
+            )
+        os.replace(tmpfile, self.filename)
+        self._saved = time.time()
+
+
+# the data providers of a batch worker, they are created once so the tile caches stay warm between levees
+_WORKER_DATA_PROVIDERS = None
+
+
+def _initialize_worker(mosaic: bool) -> None:
+    """Initializer of the batch workers, with mosaics the data providers are created per levee"""
+    global _WORKER_DATA_PROVIDERS
+    if not mosaic:
+        _WORKER_DATA_PROVIDERS = get_data_providers()
+
+
+def _run_levee(levee_code: str, args: dict) -> dict:
+    """Create the crosssections of a levee (runs in a batch worker)
+
+    Returns:
+        dict: levee code, number of created crosssections, seconds, the error (None if successful) and 
+            whether the levee was skipped because it was finished in an earlier run
+    """
+    t = time.time()
+    parameters = {
+        "centertocenter": int(args["centertocenter"]),
+        "output": args["output"],
+        "mosaic": args["mosaic"],
+        "incremental": args["incremental"],
+    }
+    filename = Path(OUTPUT_PATHS["batch_checkpoints"]) / f"{levee_code}.json"
+    checkpoint = Checkpoint(filename, levee_code, parameters, resume=not args["restart"])
+    result = {"levee_code": levee_code, "crosssections": 0, "seconds": 0.0, "error": None, "skipped": False}
+    if checkpoint.finished:
+        if not args["incremental"]:
+            result["skipped"] = True
+            return result
+        # an incremental run checks the crosssections of a finished levee again
+        checkpoint = Checkpoint(filename, levee_code, parameters, resume=False)
+
+    num_previous = checkpoint.num_crosssections
+    try:
+        route = get_routes().get_by_levee_code(levee_code)
+        if route is None:
+            raise ValueError(f"Unknown levee code {levee_code}")
+        data_providers = get_data_providers(route, mosaic=True) if args["mosaic"] else _WORKER_DATA_PROVIDERS
+
+        db = DBInput()
+        create_levee_crosssections(
+            db,
+            route,
+            data_providers,
+            center_to_center=parameters["centertocenter"],
+            incremental=args["incremental"],
+            workers=1, # the levees are created in parallel
+            serialize_workers=args["serializeworkers"],
+            plot_workers=args["plotworkers"],
+            render_mode=RenderMode[args["output"].upper()],
+            select=checkpoint.select,
+            on_persisted=checkpoint.add,
+        )
+        checkpoint.finished = True
+    except Exception:
+        result["error"] = traceback.format_exc()
+    finally:
+        checkpoint.seconds += time.time() - t
+        checkpoint.save()
+
+    result["crosssections"] = checkpoint.num_crosssections - num_previous
+    result["seconds"] = time.time() - t
+    return result
+
+
+def print_summary(results: List[dict], seconds: float) -> None:
+    """Print the throughput per levee and of the whole run"""
+    print(f"{'levee':<10}{'crosssections':>15}{'seconds':>10}{'crs/s':>10}  status")
+    for r in sorted(results, key=lambda r: r["levee_code"]):
+        rate = r["crosssections"] / r["seconds"] if r["seconds"] > 0 else 0.0
+        status = "failed" if r["error"] is not None else "skipped" if r["skipped"] else "ok"
+        print(f"{r['levee_code']:<10}{r['crosssections']:>15}{r['seconds']:>10.1f}{rate:>10.1f}  {status}")
+
+    total = sum(r["crosssections"] for r in results)
+    failed = [r["levee_code"] for r in results if r["error"] is not None]
+    skipped = [r["levee_code"] for r in results if r["skipped"]]
+    print(
+        f"Created {total} crosssections of {len(results) - len(failed) - len(skipped)} levees in {seconds:.1f}s "
+        f"({total / max(seconds, 1e-9):.1f} crosssections/s)"
+    )
+    if len(skipped) > 0:
+        print(f"Skipped {len(skipped)} levees that were finished in an earlier run (use --restart or --incremental to check them again)")
+    if len(failed) > 0:
+        print(f"Failed levees: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1: # for debugging purposes
+        args = {
+            "leveecodes":["P019"],
+            "centertocenter":10,
+            "mosaic":False,
+            "incremental":False,
+            "restart":False,
+            "workers":1,
+            "serializeworkers":1,
+            "plotworkers":1,
+            "output":"thumbnail"
+        }
+    else:
+        argparser = argparse.ArgumentParser(description='Create crosssections for many levees, an interrupted run continues where it stopped.')
+        argparser.add_argument("-l", "--leveecodes", nargs="+", required=True, help="Levee codes (like A145 A146) or all")
+        argparser.add_argument("-c", "--centertocenter", required=False, default=10, help="Center to center distance between crosssections")
+        argparser.add_argument("-m", "--mosaic", action="store_true", help="Use (and create if necessary) corridor mosaics of the levees instead of the tile directories")
+        argparser.add_argument("-i", "--incremental", action="store_true", help="Only create the crosssections whose route, tiles or parameters changed since the last run")
+        argparser.add_argument("-r", "--restart", action="store_true", help="Ignore the checkpoints of previous runs")
+        argparser.add_argument("-w", "--workers", required=False, type=int, default=1, help="Number of levees that are created at the same time")
+        argparser.add_argument("-s", "--serializeworkers", required=False, type=int, default=1, help="Number of threads per levee that write the crosssections to the crosssection store")
+        argparser.add_argument("-p", "--plotworkers", required=False, type=int, default=1, help="Number of processes per levee that plot the crosssections")
+        argparser.add_argument("-o", "--output", required=False, choices=["figure", "thumbnail"], default="figure", help="Plot the crosssections as matplotlib figures or as (much faster) small thumbnails")
+
+        args = vars(argparser.parse_args())
+
+    routes = get_routes()
+    if args["leveecodes"] == ["all"]:
+        levee_codes = list(routes.get_levee_codes())
+    else:
+        levee_codes = args["leveecodes"]
+
+    # longest levees first so the workers finish at about the same time
+    def route_length(levee_code: str) -> float:
+        route = routes.get_by_levee_code(levee_code)
+        return route.max_chainage - route.min_chainage if route is not None else 0.0
+
+    levee_codes = sorted(levee_codes, key=route_length, reverse=True)
+
+    print(f"Creating the crosssections of {len(levee_codes)} levees, this might take some time...")
+    t = time.time()
+    results: Dict[str, dict] = {}
+    with ProcessPoolExecutor(max_workers=args["workers"], initializer=_initialize_worker, initargs=(args["mosaic"],)) as executor:
+        futures = {executor.submit(_run_levee, levee_code, args): levee_code for levee_code in levee_codes}
+        for future in as_completed(futures):
+            result = future.result()
+            results[result["levee_code"]] = result
+            if result["error"] is not None:
+                print(f"{result['levee_code']} failed\n{result['error']}")
+            elif result["skipped"]:
+                print(f"{result['levee_code']}: skipped, finished in an earlier run ({len(results)}/{len(levee_codes)})")
+            else:
+                print(f"{result['levee_code']}: {result['crosssections']} crosssections in {result['seconds']:.1f}s ({len(results)}/{len(levee_codes)})")
+
+    print_summary(list(results.values()), time.time() - t)
@@ -2,16 +2,24 @@
 import sys
 sys.path.append("/home/breinbaas/Programming/packages/mlas")
 from tqdm import tqdm
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 from pydantic import BaseModel
-from typing import List
+from typing import Dict, Iterator, List, Tuple
+import json
 import math
 import numpy as np
 
 from mlas.objects.crosssection import Crosssection
-from mlas.objects.points import Point3D, PointType
+from mlas.objects.points import Point2D, Point3D, PointType
 from mlas_waternet.dataproviders.heightdataprovider import HeightDataProvider, TileType
-from mlas_waternet.gis.routes import Routes
+from mlas_waternet.gis.routes import Route, get_routes
+from mlas_waternet.gis.corridor import CorridorTileset
+from mlas_waternet.gis.mosaic import VirtualMosaicTileset
+from mlas_waternet.gis.prefetch import TilePrefetcher
+from mlas_waternet.gis.ditches import DitchIndex
+from mlas_waternet.helpers import rdp_mask, round_values, valid_runs
 
 
 class CrosssectionCreator(BaseModel):
@@ -23,84 +31,450 @@ class CrosssectionCreator(BaseModel):
     center_to_center_distance_crosssection: float = 0.5
     rdp_epsilon: float = 0.05
     height_data_provider: HeightDataProvider
-    _routes: Routes = Routes()
+    prefetch: bool = True  # load the tiles ahead of the current chainage on a background thread
+    smooth_orientation: bool = False  # interpolate the orientation of the crosssections between the route points
+    batch_size: int = 500  # number of crosssections that are sampled and handled at once
+    workers: int = 1  # number of processes, each process handles chunks of crosssections that follow the tiles
+    ditch_data_provider: HeightDataProvider = None  # if set the ditches are added to the crosssections
+    ditch_index: DitchIndex = None  # if set the ditch_data_provider is only sampled inside the ditch polygons
+    waterbottom_data_provider: HeightDataProvider = None  # if set the waterbottoms are added to the crosssections
+
+    class Config:
+        arbitrary_types_allowed = True
 
     def execute(self) -> List[Crosssection]:        
-        if self.levee_code not in self._routes.get_levee_codes():
+        """Create all crosssections of the levee, see iter_execute"""
+        return list(self.iter_execute())
+
+    def iter_execute(self, chainages: List[int] = None) -> Iterator[Crosssection]:
+        """Create the crosssections of the levee and yield them in chainage order as soon as they are available
+
+        Only a limited number of chunks is handled at the same time so the memory
+        use does not grow with the length of the levee.
+
+        Args:
+            chainages (List[int]): only create the crosssections at these chainages, defaults to all chainages (see get_chainages)
+
+        Returns:
+            Iterator[Crosssection]: the crosssections
+        """
+        rt = self._get_route()
+        if chainages is None:
+            chainages = self.get_chainages()
+        chainages = np.sort(np.asarray(chainages, dtype=np.int64))
+
+        endpoints = self._get_endpoints(rt, chainages)
+        chunks = self._get_chunks(endpoints[0], endpoints[1])
+        arguments = ((chainages[chunk], *[a[chunk] for a in endpoints]) for chunk in chunks)
+
+        with tqdm(total=len(chainages)) as progress:
+            if self.workers > 1:
+                batches = self._iter_pool(arguments)
+            else:
+                batches = self._iter_local(rt, arguments)
+            for crosssections in batches:
+                progress.update(len(crosssections))
+                yield from crosssections
+
+    def _get_route(self) -> Route:
+        """Get the route of the levee"""
+        routes = get_routes()
+        if self.levee_code not in routes.get_levee_codes():
             raise ValueError(f"Unknown levee code '{self.levee_code}'")
+        return routes.get_by_levee_code(self.levee_code)
+
+    def get_chainages(self) -> np.ndarray:
+        """Get the chainages of the crosssections of the levee
+
+        Returns:
+            np.ndarray: the chainages
+        """
+        rt = self._get_route()
+        return np.arange(rt.min_chainage, rt.max_chainage, self.center_to_center_distance_chainage)
+
+    def get_manifests(self, chainages: List[int] = None) -> Dict[int, str]:
+        """Get the dependency manifests of the crosssections
+
+        The manifest of a crosssection describes everything the crosssection depends 
+        on; the hash of the route segment, the tile files (with modification time and 
+        size) around the crosssection, the parameters of the creator and the kind of
+        tilesets (tile directory, virtual mosaic or corridor mosaic). If the 
+        manifest of a crosssection did not change the crosssection does not need to
+        be created again.
+
+        Args:
+            chainages (List[int]): the chainages, defaults to all chainages (see get_chainages)
+
+        Returns:
+            Dict[int, str]: chainage -> manifest (json)
+        """
+        rt = self._get_route()
+        if chainages is None:
+            chainages = self.get_chainages()
+        chainages = np.asarray(chainages, dtype=np.int64)
+        if len(chainages) == 0:
+            return {}
+
+        tileset = self.height_data_provider.tileset
+        parameters = {
+            "left_from_refpoint": self.left_from_refpoint,
+            "right_from_refpoint": self.right_from_refpoint,
+            "center_to_center_distance_crosssection": self.center_to_center_distance_crosssection,
+            "rdp_epsilon": self.rdp_epsilon,
+            "smooth_orientation": self.smooth_orientation,
+            "tile_type": int(tileset.tile_type),
+            "interpolation": int(tileset.interpolation),
+            "storage": int(tileset.storage),
+            "storage_offset": tileset.storage_offset,
+        }
+
+        # the tiles of the height data and of the optional ditch and waterbottom data
+        tilesets = {"tiles": tileset}
+        if self.ditch_data_provider is not None:
+            tilesets["ditch_tiles"] = self.ditch_data_provider.tileset
+        if self.waterbottom_data_provider is not None:
+            tilesets["waterbottom_tiles"] = self.waterbottom_data_provider.tileset
 
+        # the kind of tileset is the data path of the tiles; the tile directory, one virtual raster or a corridor mosaic
+        parameters["tilesets"] = {
+            key: {
+                "kind": type(ts).__name__,
+                "virtual_mosaic": isinstance(ts, VirtualMosaicTileset),
+                "corridor_mosaic": isinstance(ts, CorridorTileset),
+            }
+            for key, ts in tilesets.items()
+        }
+
+        # interpolation can use the cells next to the crosssection
+        margins = {}
+        for key, ts in tilesets.items():
+            try:
+                margins[key] = 2 * max(ts.get_grid()[2:])
+            except IndexError:  # no tiles
+                margins[key] = 0.0
+
+        x, y, xl, yl, xr, yr = self._get_endpoints(rt, chainages)
+        result = {}
+        for chainage, route_hash, px, py in zip(
+            chainages.tolist(),
+            rt.get_segment_hashes(chainages),
+            np.stack([x, xl, xr], axis=1).tolist(),
+            np.stack([y, yl, yr], axis=1).tolist(),
+        ):
+            manifest = {"route": route_hash, "parameters": parameters}
+            for key, ts in tilesets.items():
+                margin = margins[key]
+                manifest[key] = ts.get_tile_sources(min(px) - margin, max(px) + margin, min(py) - margin, max(py) + margin)
+            result[chainage] = json.dumps(manifest, sort_keys=True)
+        return result
+
+    def _iter_local(self, rt: Route, arguments: Iterator[Tuple[np.ndarray, ...]]) -> Iterator[List[Crosssection]]:
+        """Create the crosssections of the chunks in this process, the tiles are prefetched on a background thread"""
+        prefetcher = None
+        if self.prefetch:
+            # keep the tiles of the current and the next chunk loaded
+            prefetcher = TilePrefetcher(
+                tileset=self.height_data_provider.tileset,
+                route=rt,
+                margin=max(self.left_from_refpoint, self.right_from_refpoint) + self.center_to_center_distance_crosssection,
+                lookahead=2 * self.batch_size * self.center_to_center_distance_chainage,
+            ).start()
+
+        try:
+            for args in arguments:
+                if prefetcher is not None:
+                    prefetcher.advance(args[0][0])
+                yield self._create_crosssections(*args)
+        finally:
+            if prefetcher is not None:
+                prefetcher.stop()
+
+    def _iter_pool(self, arguments: Iterator[Tuple[np.ndarray, ...]]) -> Iterator[List[Crosssection]]:
+        """Create the crosssections of the chunks in the worker processes
+
+        At most two chunks per worker are submitted ahead of the chunk that is 
+        yielded, the results are yielded in the order of the chunks.
+        """
+        with ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_initialize_worker, initargs=(self,)
+        ) as executor:
+            pending = deque()
+            try:
+                for args in arguments:
+                    pending.append(executor.submit(_create_crosssections, args))
+                    if len(pending) >= 2 * self.workers:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                # the consumer stopped early or a chunk failed
+                for future in pending:
+                    future.cancel()
+
+    def _get_chunks(self, x: np.ndarray, y: np.ndarray) -> List[slice]:
+        """Split the crosssections in contiguous chunks of at most batch_size crosssections
+
+        The chunks follow the tiles of the reference points, consecutive crosssections
+        on the same tile are kept together and a chunk only ends at the edge of a tile
+        unless the crosssections on one tile do not fit in a chunk. This way a worker
+        process mostly reads its own tiles.
+
+        Args:
+            x (np.ndarray): x coordinates of the reference points
+            y (np.ndarray): y coordinates of the reference points
+
+        Returns:
+            List[slice]: the chunks as slices of the crosssections
+        """
+        if len(x) == 0:
+            return []
+
+        tile_ids = self.height_data_provider.tileset.get_tile_ids(x, y)
+        edges = [0, *(np.flatnonzero(np.diff(tile_ids)) + 1).tolist(), len(x)]
+
+        # merge the runs of crosssections on the same tile as long as they fit in a chunk
+        merged = []
+        start, end = 0, 0
+        for run_end in edges[1:]:
+            if end > start and run_end - start > self.batch_size:
+                merged.append((start, end))
+                start = end
+            end = run_end
+        merged.append((start, end))
+
+        # split the chunks that are too large in equal parts
         result = []
-        rt = self._routes.get_by_levee_code(self.levee_code)
-
-        for chainage in tqdm(range(rt.min_chainage, rt.max_chainage, self.center_to_center_distance_chainage)):
-            x, y, alpha = rt.xya_at_chainage(chainage)
-
-            alpha_l = alpha - math.radians(90)
-            alpah_r = alpha + math.radians(90)
-            xl = round(x + self.left_from_refpoint * math.cos(alpha_l), 2)
-            yl = round(y + self.left_from_refpoint * math.sin(alpha_l), 2)
-            xr = round(x + self.right_from_refpoint * math.cos(alpah_r), 2)
-            yr = round(y + self.right_from_refpoint * math.sin(alpah_r), 2)
-
-            points = self.height_data_provider.get(
-                start=Point3D(x=xl, y=yl),
-                end=Point3D(x=xr, y=yr),
-                center_to_center_distance=self.center_to_center_distance_crosssection,
-            )
+        for start, end in merged:
+            parts = -(-(end - start) // self.batch_size)
+            edges = np.linspace(start, end, parts + 1).round().astype(int).tolist()
+            result += [slice(i, j) for i, j in zip(edges[:-1], edges[1:])]
+        return result
+
+    def _get_endpoints(self, rt: Route, chainages: np.ndarray) -> Tuple[np.ndarray, ...]:
+        """Get the reference points and the left and right points of the crosssections at the given chainages
+
+        Returns:
+            Tuple[np.ndarray, ...]: x, y of the reference points, xl, yl of the left points and xr, yr of the right points
+        """
+        x, y, alpha = rt.xya_at_chainages(chainages, smooth=self.smooth_orientation)
+
+        alpha_l = alpha - math.radians(90)
+        alpha_r = alpha + math.radians(90)
+        # math.cos and math.sin like the per-chainage implementation, np.cos and np.sin can differ in the last bit
+        cos_l = np.array([math.cos(a) for a in alpha_l.tolist()], dtype=float)
+        sin_l = np.array([math.sin(a) for a in alpha_l.tolist()], dtype=float)
+        cos_r = np.array([math.cos(a) for a in alpha_r.tolist()], dtype=float)
+        sin_r = np.array([math.sin(a) for a in alpha_r.tolist()], dtype=float)
+        xl = round_values(x + self.left_from_refpoint * cos_l, 2)
+        yl = round_values(y + self.left_from_refpoint * sin_l, 2)
+        xr = round_values(x + self.right_from_refpoint * cos_r, 2)
+        yr = round_values(y + self.right_from_refpoint * sin_r, 2)
+        return x, y, xl, yl, xr, yr
+
+    def _sample_profiles(
+        self, xl: np.ndarray, yl: np.ndarray, xr: np.ndarray, yr: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Sample the height data of all profiles from the left to the right points at once
+
+        The rows of the result are the profiles, the number of samples per profile
+        can differ so the samples after the last sample of a profile are np.nan
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: x, y, z of the samples and the number of samples per profile
+        """
+        spacing = self.center_to_center_distance_crosssection
+        dl = np.sqrt((xl - xr) ** 2 + (yl - yr) ** 2)
+        # same number of samples as np.arange(0, dl + spacing * 0.99, spacing)
+        counts = np.ceil((dl + spacing * 0.99) / spacing).astype(np.int64)
+        l = np.arange(counts.max()) * spacing
+        valid = np.arange(counts.max()) < counts[:, None]
+
+        # np.round like HeightDataProvider.sample_line
+        f = l / dl[:, None]
+        xs = np.where(valid, np.round(xl[:, None] + f * (xr - xl)[:, None], 2), np.nan)
+        ys = np.where(valid, np.round(yl[:, None] + f * (yr - yl)[:, None], 2), np.nan)
+        zs = round_values(self.height_data_provider.sample(xs, ys), 2)
+        return xs, ys, zs, counts
+
+    def _create_crosssections(
+        self,
+        chainages: np.ndarray,
+        x: np.ndarray,
+        y: np.ndarray,
+        xl: np.ndarray,
+        yl: np.ndarray,
+        xr: np.ndarray,
+        yr: np.ndarray,
+    ) -> List[Crosssection]:
+        """Create the crosssections at the given chainages with the given reference, left and right points
+
+        All profiles are handled as rows of one matrix, the Crosssection objects are
+        only created at the end.
+        """
+        n = len(chainages)
+        if n == 0:
+            return []
+        rows = np.arange(n)
+
+        xs, ys, zs, counts = self._sample_profiles(xl, yl, xr, yr)
+
+        # add l (2d representation) to the points
+        ls = round_values(np.sqrt((xs - xs[:, :1]) ** 2 + (ys - ys[:, :1]) ** 2), 2)
+
+        # the ditches and waterbottoms are sampled at the same points
+        if self.ditch_index is not None and self.ditch_data_provider is not None:
+            ditches = self._get_indexed_ditches(xs, ys, ls, counts)
+        else:
+            ditches = self._get_waterbottoms(self.ditch_data_provider, xs, ys, ls, counts)
+        waterbottoms = self._get_waterbottoms(self.waterbottom_data_provider, xs, ys, ls, counts)
+
+        # remove points too close to the refpoint and add the refpoint as the last column
+        l_ref = float(self.left_from_refpoint)
+        z_ref = round_values(self.height_data_provider.sample(x, y), 2)
+        valid = (np.arange(ls.shape[1]) < counts[:, None]) & (np.abs(ls - l_ref) > 0.1)
+        ls = np.column_stack([np.where(valid, ls, np.inf), np.full(n, l_ref)])
+        xs = np.column_stack([xs, x])
+        ys = np.column_stack([ys, y])
+        zs = np.column_stack([zs, z_ref])
+        is_ref = np.zeros(ls.shape, dtype=bool)
+        is_ref[:, -1] = True
+        valid = np.column_stack([valid, np.ones(n, dtype=bool)])
+
+        # sort on l, the removed points (l = inf) end up after the valid points
+        order = np.argsort(ls, axis=1, kind="stable")
+        ls, xs, ys, zs, is_ref, valid = [np.take_along_axis(a, order, axis=1) for a in (ls, xs, ys, zs, is_ref, valid)]
+        num_points = valid.sum(axis=1)
 
-            # add l (2d representation) to the points:
-            for i in range(len(points)):
-                points[i].l = round(
-                    math.sqrt(
-                        math.pow(points[i].x - points[0].x, 2) + math.pow(points[i].y - points[0].y, 2)
-                    ),
-                    2,
-                )
-
-            # find and set reference point
-            refpoint = Point3D(x=x, y=y, z=round(self.height_data_provider.get_z(x, y),2), l=self.left_from_refpoint, point_type=PointType.REFERENCEPOINT)
-            
-            # remove points too close to the refpoint
-            points = [p for p in points if abs(p.l - refpoint.l) > 0.1]
-            points.append(refpoint)
-            points = sorted(points, key=lambda x:x.l)
-            
-            # remove all nan's except for the start- and endpoint and the reference point
-            points_no_nan = []
-            for i in range(len(points)):
-                if i == 0 or i == len(points) - 1 or points[i].point_type == PointType.REFERENCEPOINT:
-                    points_no_nan.append(points[i])
-                elif not np.isnan(points[i].z):
-                    points_no_nan.append(points[i])
-
-            # if the leftmost / rightmost point has no valid z coordinate then copy the z of the next point
-            if np.isnan(points_no_nan[0].z):
-                points_no_nan[0].z = points_no_nan[1].z
-            if np.isnan(points_no_nan[-1].z):
-                points_no_nan[-1].z = points_no_nan[-2].z
-
-            # if the reference point has a nan value, add the interpolated value of the two consequetive points
-            for i, p in enumerate(points_no_nan):
-                if p.point_type == PointType.REFERENCEPOINT and np.isnan(p.z):
-                    if i>0 and i<len(points_no_nan)-1:
-                        p1 = points_no_nan[i-1]
-                        p2 = points_no_nan[i+1]
-                        points_no_nan[i].z = round(p1.z + (p.l - p1.l) / (p2.l - p1.l) * (p2.z - p1.z), 2)
+        # remove all nan's except for the start- and endpoint and the reference point
+        columns = np.arange(ls.shape[1])
+        keep = valid & (
+            (columns == 0) | (columns == (num_points - 1)[:, None]) | is_ref | ~np.isnan(zs)
+        )
+        order = np.argsort(~keep, axis=1, kind="stable")
+        ls, xs, ys, zs, is_ref = [np.take_along_axis(a, order, axis=1) for a in (ls, xs, ys, zs, is_ref)]
+        num_points = keep.sum(axis=1)
 
+        # if the leftmost / rightmost point has no valid z coordinate then copy the z of the next point
+        nan_first = np.isnan(zs[:, 0])
+        zs[nan_first, 0] = zs[nan_first, 1]
+        last = num_points - 1
+        nan_last = np.isnan(zs[rows, last])
+        zs[rows[nan_last], last[nan_last]] = zs[rows[nan_last], last[nan_last] - 1]
+
+        # if the reference point has a nan value, add the interpolated value of the two consequetive points
+        i_ref = np.argmax(is_ref, axis=1)
+        todo = np.isnan(zs[rows, i_ref]) & (i_ref > 0) & (i_ref < last)
+        r, i = rows[todo], i_ref[todo]
+        zs[r, i] = round_values(
+            zs[r, i - 1] + (ls[r, i] - ls[r, i - 1]) / (ls[r, i + 1] - ls[r, i - 1]) * (zs[r, i + 1] - zs[r, i - 1]),
+            2,
+        )
+
+        # simplify all profiles at once, only the points that are kept become Point3D objects
+        if self.rdp_epsilon > 0:
+            keep = rdp_mask(ls, zs, self.rdp_epsilon, num_points)
+        else:
+            keep = np.arange(ls.shape[1]) < num_points[:, None]
+
+        result = []
+        for chainage, k, j, px, py, pz, pl, crs_ditches, crs_waterbottoms in zip(
+            chainages.tolist(), keep.tolist(), i_ref.tolist(), xs.tolist(), ys.tolist(), zs.tolist(), ls.tolist(), ditches, waterbottoms
+        ):
+            refpoint = Point3D(x=px[j], y=py[j], z=pz[j], l=pl[j], point_type=PointType.REFERENCEPOINT)
+            points = [
+                refpoint if m == j else Point3D(x=px[m], y=py[m], z=pz[m], l=pl[m])
+                for m in np.flatnonzero(k).tolist()
+            ]
 
             crosssection = Crosssection(
                 levee_code = self.levee_code,
                 levee_chainage = chainage,
-                points=points_no_nan, 
+                points=points, 
                 reference_point=refpoint,                    
             )
-            
-            if self.rdp_epsilon > 0:
-                crosssection.rdp(self.rdp_epsilon)
+            for ditch in crs_ditches:
+                crosssection.add_ditch(ditch)
+            for waterbottom in crs_waterbottoms:
+                crosssection.add_waterbottom(waterbottom)
 
             result.append(crosssection)
 
         return result
 
+    def _get_indexed_ditches(
+        self,
+        xs: np.ndarray,
+        ys: np.ndarray,
+        ls: np.ndarray,
+        counts: np.ndarray,
+    ) -> List[List[List[Point2D]]]:
+        """Sample the ditch data only at the points of the profiles inside the ditch polygons
+
+        Most profiles do not cross a ditch, those are not sampled at all. The
+        result is the same as sampling the whole profiles (see _get_waterbottoms).
+
+        Returns:
+            List[List[List[Point2D]]]: per profile the ditches with (l, z) points
+        """
+        inside = np.zeros(ls.shape, dtype=bool)
+        for row, count in enumerate(counts.tolist()):
+            if count == 0:
+                continue
+            start, end = (xs[row, 0], ys[row, 0]), (xs[row, count - 1], ys[row, count - 1])
+            # the points are rounded to cm, so a point can be just outside of the line or the polygon
+            for l1, l2 in self.ditch_index.query(start, end, tolerance=0.05):
+                inside[row] |= (ls[row] >= l1) & (ls[row] <= l2)
+        zs = np.full(ls.shape, np.nan)
+        if np.any(inside):
+            zs[inside] = round_values(self.ditch_data_provider.sample(xs[inside], ys[inside]), 2)
+        return [
+            [[Point2D(x=l, z=z) for l, z in zip(pl[start:end], pz[start:end])] for start, end in runs]
+            for pl, pz, runs in zip(ls.tolist(), zs.tolist(), valid_runs(zs, counts))
+        ]
+
+    def _get_waterbottoms(
+        self,
+        height_data_provider: HeightDataProvider,
+        xs: np.ndarray,
+        ys: np.ndarray,
+        ls: np.ndarray,
+        counts: np.ndarray,
+    ) -> List[List[List[Point2D]]]:
+        """Sample the given height data at the points of the profiles and split it in the runs with data
+
+        This is the batch version of WaterBottomCreator, the profiles are sampled at
+        once and the runs of points with data are the ditches or waterbottoms.
+
+        Args:
+            height_data_provider (HeightDataProvider): the ditch or waterbottom data, no runs are returned if None
+            xs (np.ndarray): x coordinates of the points of the profiles
+            ys (np.ndarray): y coordinates of the points of the profiles
+            ls (np.ndarray): l coordinates of the points of the profiles
+            counts (np.ndarray): number of points per profile
+
+        Returns:
+            List[List[List[Point2D]]]: per profile the runs with (l, z) points
+        """
+        if height_data_provider is None:
+            return [[] for _ in range(len(xs))]
+
+        zs = round_values(height_data_provider.sample(xs, ys), 2)
+        return [
+            [[Point2D(x=l, z=z) for l, z in zip(pl[start:end], pz[start:end])] for start, end in runs]
+            for pl, pz, runs in zip(ls.tolist(), zs.tolist(), valid_runs(zs, counts))
+        ]
+
+
+# the creator of a worker process, see CrosssectionCreator.execute
+_WORKER_CREATOR: CrosssectionCreator = None
+
+
+def _initialize_worker(creator: CrosssectionCreator) -> None:
+    """Initializer of the worker processes, the tile caches of the process are kept between chunks"""
+    global _WORKER_CREATOR
+    _WORKER_CREATOR = creator
 
 
+def _create_crosssections(args: Tuple[np.ndarray, ...]) -> List[Crosssection]:
+    """Create the crosssections of a chunk in a worker process"""
+    return _WORKER_CREATOR._create_crosssections(*args)
@@ -1,5 +1,4 @@
 import numpy as np
-import math
 from pydantic import BaseModel
 from typing import List
 
@@ -7,6 +6,7 @@ from mlas.objects.points import PointType, Point3D
 
 from mlas_waternet.gis.tiles import Tileset, TileType
 from mlas_waternet.dataproviders.heightdataprovider import HeightDataProvider
+from mlas_waternet.helpers import round_values, valid_runs
 
 class WaterBottomCreator(BaseModel):
     """Algorithm to find waterbottom data for a crosssection
@@ -17,30 +17,25 @@ class WaterBottomCreator(BaseModel):
                                 will be altered if a waterbottom point has been found at this location
 
     Returns:
-        List[Point3D]: list with altered points
+        List[List[Point3D]]: the runs of consecutive points with data along the line
     """
     height_data_provider: HeightDataProvider = None
     start_point: Point3D
     end_point: Point3D
     center_to_center_distance: float = 0.5
 
-    def execute(self) -> List[Point3D]:
-        points = self.height_data_provider.get(
+    def execute(self) -> List[List[Point3D]]:
+        _, xs, ys, zs = self.height_data_provider.sample_line(
             start=self.start_point,
             end=self.end_point,
-            center_to_center_distance=self.center_to_center_distance,
+            spacing=self.center_to_center_distance,
         )
-
-        result = []
-        waterbottom = []
-        for p in points:
-            if not np.isnan(p.z): 
-                l = round(math.sqrt(math.pow(p.x - self.start_point.x, 2)+ math.pow(p.y - self.start_point.y, 2)), 2) 
-                waterbottom.append(Point3D(x=p.x, y=p.y, z=round(p.z,2), l=l))
-            else:
-                if len(waterbottom) > 0:
-                    result.append(waterbottom)
-                    waterbottom = []
-
-        return result
-
+        ls = round_values(np.sqrt((xs - self.start_point.x) ** 2 + (ys - self.start_point.y) ** 2), 2)
+
+        return [
+            [
+                Point3D(x=x, y=y, z=z, l=l)
+                for x, y, z, l in zip(*[a[start:end].tolist() for a in (xs, ys, zs, ls)])
+            ]
+            for start, end in valid_runs(zs)[0]
+        ]
@@ -0,0 +1,241 @@
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+from mlas.objects.crosssection import Crosssection
+from mlas.objects.points import Point2D, Point3D, PointType
+
+
+STORE_ROW_GROUP_SIZE = 100  # crosssections per row group, the smallest part of a store file that can be read
+
+
+def _import_pyarrow():
+    """Import pyarrow, it is only needed for the crosssection store"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("The crosssection store needs pyarrow, install it with pip install pyarrow") from e
+    return pyarrow, pyarrow.parquet
+
+
+def _get_schema():
+    pa, _ = _import_pyarrow()
+    points = pa.list_(pa.float64())
+    lines = pa.list_(pa.list_(pa.float64()))
+    return pa.schema(
+        [
+            ("levee_code", pa.string()),
+            ("chainage", pa.int32()),
+            ("l", points),
+            ("x", points),
+            ("y", points),
+            ("z", points),
+            ("point_type", pa.list_(pa.int16())),
+            ("reference_point", pa.list_(pa.float64())),  # l, x, y, z
+            ("reference_point_type", pa.int16()),
+            ("ditches_l", lines),
+            ("ditches_z", lines),
+            ("waterbottoms_l", lines),
+            ("waterbottoms_z", lines),
+        ]
+    )
+
+
+def _point_type_value(point_type) -> int:
+    """Get the stored value of a point type, -1 if the point has no type"""
+    if point_type is None:
+        return -1
+    return int(getattr(point_type, "value", point_type))
+
+
+def _point_type(value: int) -> PointType:
+    """Get the point type of a stored value (see _point_type_value)"""
+    return None if value < 0 else PointType(value)
+
+
+class CrosssectionStore:
+    """Columnar storage of the crosssections in parquet files per levee
+
+    Instead of a json file per crosssection the crosssections are stored in
+    batches, every batch is a parquet file in the directory of the levee. A
+    crosssection is a row with the point coordinates as list columns, the files
+    are split in row groups of STORE_ROW_GROUP_SIZE crosssections. Reading
+    a chainage range only reads the row groups that contain the chainages.
+
+    If a crosssection is written again the newest file has the valid version,
+    the database points to the file and row group of the valid version (see
+    DBInput.add_crosssection). Files without any valid version are removed
+    with remove_unreferenced.
+
+    Args:
+        path (str): the directory of the store
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+
+    def get_levee_path(self, levee_code: str) -> Path:
+        """Get the directory with the files of a levee
+
+        Args:
+            levee_code (str): code of the levee
+
+        Returns:
+            Path: the directory
+        """
+        return self.path / levee_code
+
+    def write(self, crosssections: List[Crosssection]) -> List[Tuple[str, int]]:
+        """Write a batch of crosssections of a levee to a new file
+
+        Args:
+            crosssections (List[Crosssection]): the crosssections, all of the same levee
+
+        Returns:
+            List[Tuple[str, int]]: the file and row group of each crosssection
+        """
+        pa, pq = _import_pyarrow()
+        if len(crosssections) == 0:
+            return []
+
+        levee_code = crosssections[0].levee_code
+        if any(crs.levee_code != levee_code for crs in crosssections):
+            raise ValueError("All crosssections of a batch should be of the same levee")
+
+        # sorted on chainage so the row group statistics of the chainage are small ranges
+        order = sorted(range(len(crosssections)), key=lambda i: crosssections[i].levee_chainage)
+        rows = [crosssections[i] for i in order]
+        columns = {
+            "levee_code": [crs.levee_code for crs in rows],
+            "chainage": [int(crs.levee_chainage) for crs in rows],
+            "l": [[p.l for p in crs.points] for crs in rows],
+            "x": [[p.x for p in crs.points] for crs in rows],
+            "y": [[p.y for p in crs.points] for crs in rows],
+            "z": [[p.z for p in crs.points] for crs in rows],
+            "point_type": [[_point_type_value(p.point_type) for p in crs.points] for crs in rows],
+            "reference_point": [
+                [crs.reference_point.l, crs.reference_point.x, crs.reference_point.y, crs.reference_point.z]
+                for crs in rows
+            ],
+            "reference_point_type": [_point_type_value(crs.reference_point.point_type) for crs in rows],
+            "ditches_l": [[[p.x for p in ditch] for ditch in crs.ditches] for crs in rows],
+            "ditches_z": [[[p.z for p in ditch] for ditch in crs.ditches] for crs in rows],
+            "waterbottoms_l": [[[p.x for p in wb] for wb in crs.waterbottoms] for crs in rows],
+            "waterbottoms_z": [[[p.z for p in wb] for wb in crs.waterbottoms] for crs in rows],
+        }
+        table = pa.Table.from_pydict(columns, schema=_get_schema())
+
+        path = self.get_levee_path(levee_code)
+        path.mkdir(parents=True, exist_ok=True)
+        # the time in the name orders the files, a newer file replaces the crosssections of older files
+        filename = path / f"{levee_code}_{time.time_ns()}_{rows[0].levee_chainage:05d}.parquet"
+        tmpfile = filename.with_suffix(".tmp")
+        pq.write_table(table, tmpfile, row_group_size=STORE_ROW_GROUP_SIZE)
+        tmpfile.replace(filename)
+
+        result = [None] * len(crosssections)
+        for row, i in enumerate(order):
+            result[i] = (str(filename.resolve()), row // STORE_ROW_GROUP_SIZE)
+        return result
+
+    def remove_unreferenced(self, levee_code: str, referenced: Iterable[str]) -> int:
+        """Remove the files of a levee that are not referenced, all their crosssections were written again or deleted
+
+        Only call this if no other process is writing crosssections of the levee.
+
+        Args:
+            levee_code (str): code of the levee
+            referenced (Iterable[str]): the files that are still in use (see DBInput.get_crosssection_storefiles)
+
+        Returns:
+            int: the number of removed files
+        """
+        path = self.get_levee_path(levee_code)
+        if not path.is_dir():
+            return 0
+
+        referenced = {str(Path(filename).resolve()) for filename in referenced if filename is not None}
+        removed = 0
+        for filename in path.glob("*.parquet"):
+            if str(filename.resolve()) not in referenced:
+                filename.unlink()
+                removed += 1
+        return removed
+
+    def read_row_groups(
+        self, filename: str, row_groups: List[int], chainage_start: float = 0, chainage_end: float = 1e9
+    ) -> List[Crosssection]:
+        """Read the crosssections in the given row groups of a file
+
+        Args:
+            filename (str): the file
+            row_groups (List[int]): the row groups
+            chainage_start (float): first chainage to read
+            chainage_end (float): last chainage to read
+
+        Returns:
+            List[Crosssection]: the crosssections
+        """
+        _, pq = _import_pyarrow()
+        table = pq.ParquetFile(filename).read_row_groups(sorted(set(row_groups)))
+        return [
+            crs for crs in _to_crosssections(table) if chainage_start <= crs.levee_chainage <= chainage_end
+        ]
+
+    def read(self, levee_code: str, chainage_start: float = 0, chainage_end: float = 1e9) -> List[Crosssection]:
+        """Read the crosssections of a levee in a chainage range
+
+        The chainage filter is pushed down to the files, row groups outside of
+        the chainage range are not read.
+
+        Args:
+            levee_code (str): code of the levee
+            chainage_start (float): first chainage to read
+            chainage_end (float): last chainage to read
+
+        Returns:
+            List[Crosssection]: the crosssections sorted on chainage
+        """
+        _, pq = _import_pyarrow()
+        path = self.get_levee_path(levee_code)
+        if not path.is_dir():
+            return []
+
+        result: Dict[int, Crosssection] = {}
+        filters = [("chainage", ">=", chainage_start), ("chainage", "<=", chainage_end)]
+        for filename in sorted(path.glob("*.parquet"), key=lambda f: int(f.stem.split("_")[-2])):
+            for crs in _to_crosssections(pq.read_table(filename, filters=filters)):
+                result[crs.levee_chainage] = crs
+        return [result[chainage] for chainage in sorted(result.keys())]
+
+
+def _to_crosssections(table) -> List[Crosssection]:
+    """Convert the rows of a store table to crosssections"""
+    columns = table.to_pydict()
+    result = []
+    for i in range(table.num_rows):
+        rl, rx, ry, rz = columns["reference_point"][i]
+        reference_point = Point3D(
+            x=rx, y=ry, z=rz, l=rl, point_type=_point_type(columns["reference_point_type"][i])
+        )
+        points = [
+            reference_point
+            if (l, x, y, z) == (rl, rx, ry, rz)
+            else Point3D(x=x, y=y, z=z, l=l, point_type=_point_type(point_type))
+            for l, x, y, z, point_type in zip(
+                columns["l"][i], columns["x"][i], columns["y"][i], columns["z"][i], columns["point_type"][i]
+            )
+        ]
+        crosssection = Crosssection(
+            levee_code=columns["levee_code"][i],
+            levee_chainage=columns["chainage"][i],
+            points=points,
+            reference_point=reference_point,
+        )
+        for ls, zs in zip(columns["ditches_l"][i], columns["ditches_z"][i]):
+            crosssection.add_ditch([Point2D(x=l, z=z) for l, z in zip(ls, zs)])
+        for ls, zs in zip(columns["waterbottoms_l"][i], columns["waterbottoms_z"][i]):
+            crosssection.add_waterbottom([Point2D(x=l, z=z) for l, z in zip(ls, zs)])
+        result.append(crosssection)
+    return result
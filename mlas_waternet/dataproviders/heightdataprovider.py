@@ -6,8 +6,10 @@ from pydantic.dataclasses import dataclass
 from typing import List, Tuple
 
 from mlas.objects.points import Point3D
-from mlas_waternet.gis.tiles import Tileset, TileType
+from mlas_waternet.gis.tiles import Tileset, TileType, TileAccessMode, TileInterpolation, TileStorage
 from mlas_waternet.gis.routes import Routes
+from mlas_waternet.gis.mosaic import VirtualMosaicTileset
+from mlas_waternet.helpers import round_values
 
 
 @dataclass
@@ -18,15 +20,62 @@ class HeightDataProvider:
 
     Args:
         tile_type (TileType): type of tiles (see mlaslib.objects.gis.tiles.TileType)
+        access_mode (TileAccessMode): the way the tiles are read (see mlaslib.objects.gis.tiles.TileAccessMode)
+        interpolation (TileInterpolation): interpolation of the height data (see mlaslib.objects.gis.tiles.TileInterpolation)
+        storage (TileStorage): data type of the tile data in memory (see mlaslib.objects.gis.tiles.TileStorage)
+        virtual_mosaic (bool): read the tiles as one raster (see mlaslib.objects.gis.mosaic.VirtualMosaicTileset)
     """
 
     tile_type: TileType
     tileset: Tileset = None
+    access_mode: TileAccessMode = TileAccessMode.FULL
+    interpolation: TileInterpolation = TileInterpolation.NEAREST
+    storage: TileStorage = TileStorage.NATIVE
+    virtual_mosaic: bool = False
 
     def __post_init_post_parse__(self):
         """Executed after pydantic validation, intializes the tileset"""
         if not self.tileset:
-            self.tileset = Tileset(tile_type=self.tile_type)
+            tileset_class = VirtualMosaicTileset if self.virtual_mosaic else Tileset
+            self.tileset = tileset_class(
+                tile_type=self.tile_type,
+                access_mode=self.access_mode,
+                interpolation=self.interpolation,
+                storage=self.storage,
+            )
+
+    def sample(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """Get the z values of the given x,y points
+
+        Args:
+            xs (np.ndarray): x coordinates of the points
+            ys (np.ndarray): y coordinates of the points
+
+        Returns:
+            np.ndarray: z values at (xs, ys), np.nan if not available
+        """
+        return self.tileset.sample(xs, ys)
+
+    def sample_line(
+        self, start: Point3D, end: Point3D, spacing: float = 0.5
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Get the height data along the line from start to end
+
+        Args:
+            start (Point3D): start of the line
+            end (Point3D): end of the line
+            spacing (float): distance between the points
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: l (distance from the start), x, y and z of the points
+        """
+        dl = math.sqrt(pow(start.x - end.x, 2) + pow(start.y - end.y, 2))
+        l = np.arange(0, dl + spacing * 0.99, spacing)
+        # x and y were numpy floats in the per-point implementation so they are rounded with np.round
+        x = np.round(start.x + (l / dl) * (end.x - start.x), 2)
+        y = np.round(start.y + (l / dl) * (end.y - start.y), 2)
+        z = round_values(self.sample(x, y), 2)
+        return l, x, y, z
 
     def get_z(self, x: float, y: float) -> float:
         """Get the z value of the given x,y point
@@ -38,7 +87,7 @@ class HeightDataProvider:
         Returns:
             float: z value at (x,y)
         """
-        return self.tileset.get_point3d(x, y).z
+        return float(self.sample(np.array([x]), np.array([y]))[0])
 
     def get(
         self, start: Point3D, end: Point3D, center_to_center_distance: float = 0.5
@@ -56,11 +105,5 @@ class HeightDataProvider:
             List[Point3D]: the generated crosssections
         """
         # get all the points even if they are nan
-        result = []
-        dl = math.sqrt(pow(start.x - end.x, 2) + pow(start.y - end.y, 2))
-        for l in np.arange(0, dl + center_to_center_distance * 0.99, center_to_center_distance):
-            xp = round(start.x + (l / dl) * (end.x - start.x), 2)
-            yp = round(start.y + (l / dl) * (end.y - start.y), 2)
-            result.append(Point3D(x=xp, y=yp, z=round(self.get_z(xp, yp), 2)))
-
-        return result
+        _, xs, ys, zs = self.sample_line(start, end, spacing=center_to_center_distance)
+        return [Point3D(x=x, y=y, z=z) for x, y, z in zip(xs.tolist(), ys.tolist(), zs.tolist())]
@@ -1,6 +1,6 @@
 from sqlalchemy import create_engine, inspect
 from sqlalchemy.ext.declarative import declarative_base  
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from sqlalchemy import Column, String, Integer, Date, Float, Boolean
 from sqlalchemy.orm import sessionmaker
 import datetime
@@ -15,7 +15,9 @@ from mlas.objects.crosssection import Crosssection
 from mlas.helpers import case_insensitive_glob
 from mlas.objects.cpt import CPT
 
-from mlas_waternet.settings import SETTINGS, LOG_FILES
+from mlas_waternet.settings import SETTINGS, LOG_FILES, OUTPUT_PATHS
+from mlas_waternet.dataproviders.crosssectionstore import CrosssectionStore
+from mlas_waternet.gis.routes import get_routes
 
 Base = declarative_base()
 
@@ -29,6 +31,9 @@ class DBCrosssectionsTable(Base):
     imgfile = Column(String)
     date = Column(Date)
     geom = Column(Geometry('LINESTRING'))
+    manifest = Column(String) # json with the inputs of the crosssection, see CrosssectionCreator.get_manifests
+    storefile = Column(String) # file of the crosssection store with the crosssection, see CrosssectionStore
+    rowgroup = Column(Integer) # row group of the storefile with the crosssection
 
 class DBCPTTable(Base):
     __tablename__ = "cpts"
@@ -55,10 +60,96 @@ class DBInput():
         self.session = Session()
 
     def get_crosssections(self, levee_code, chainage_start=0, chainage_end=1e9):
-        return [Crosssection.parse(r.jsonfile) for r in self.session.query(DBCrosssectionsTable).all()\
-             if r.leveecode==levee_code and r.chainage >= chainage_start and r.chainage <= chainage_end]
+        """Get the crosssections of a levee in a chainage range
+
+        Crosssections in the crosssection store are read per row group, older
+        crosssections are read from their json file.
+
+        Args:
+            levee_code (str): levee code
+            chainage_start (float): first chainage
+            chainage_end (float): last chainage
+
+        Returns:
+            List[Crosssection]: the crosssections sorted on chainage
+        """
+        rows = self.session.query(
+            DBCrosssectionsTable.chainage, DBCrosssectionsTable.jsonfile, DBCrosssectionsTable.storefile, DBCrosssectionsTable.rowgroup
+        ).filter(DBCrosssectionsTable.leveecode == levee_code). \
+            filter(DBCrosssectionsTable.chainage >= chainage_start). \
+            filter(DBCrosssectionsTable.chainage <= chainage_end).all()
+
+        result = {}
+        row_groups = {}
+        for chainage, jsonfile, storefile, rowgroup in rows:
+            if storefile is not None:
+                row_groups.setdefault(storefile, {})[chainage] = rowgroup
+            else:
+                result[chainage] = Crosssection.parse(jsonfile)
+
+        store = CrosssectionStore(OUTPUT_PATHS["crosssections_store"])
+        for storefile, chainages in row_groups.items():
+            for crs in store.read_row_groups(storefile, list(chainages.values()), chainage_start, chainage_end):
+                # the file can have older versions of crosssections that were written again in another file
+                if crs.levee_chainage in chainages:
+                    result[crs.levee_chainage] = crs
+        return [result[chainage] for chainage in sorted(result.keys())]
         
-    def add_crosssection(self, crosssection, jsonfile, imgfile): 
+    def get_crosssection_manifests(self, levee_code):
+        """Get the manifests of the stored crosssections of a levee
+
+        Crosssections without a manifest or without the store or json file are left out.
+
+        Args:
+            levee_code (str): levee code
+
+        Returns:
+            dict: chainage -> manifest
+        """
+        rows = self.session.query(
+            DBCrosssectionsTable.chainage, DBCrosssectionsTable.manifest, DBCrosssectionsTable.jsonfile, DBCrosssectionsTable.storefile
+        ).filter(DBCrosssectionsTable.leveecode == levee_code).all()
+        return {
+            chainage: manifest
+            for chainage, manifest, jsonfile, storefile in rows
+            if manifest is not None and (storefile or jsonfile) is not None and Path(storefile or jsonfile).is_file()
+        }
+
+    def get_crosssection_storefiles(self, levee_code):
+        """Get the files of the crosssection store that have crosssections of a levee
+
+        Args:
+            levee_code (str): levee code
+
+        Returns:
+            set: the files
+        """
+        rows = self.session.query(DBCrosssectionsTable.storefile). \
+            filter(DBCrosssectionsTable.leveecode == levee_code). \
+            filter(DBCrosssectionsTable.storefile != None).distinct().all()
+        return {storefile for storefile, in rows}
+
+    def delete_crosssections(self, levee_code, keep_chainages):
+        """Delete the crosssections of a levee that are not at one of the given chainages
+
+        Args:
+            levee_code (str): levee code
+            keep_chainages (List[int]): the chainages of the crosssections to keep
+
+        Returns:
+            int: the number of deleted crosssections
+        """
+        keep = set(int(chainage) for chainage in keep_chainages)
+        rows = self.session.query(DBCrosssectionsTable.id, DBCrosssectionsTable.chainage). \
+            filter(DBCrosssectionsTable.leveecode == levee_code).all()
+        ids = [id for id, chainage in rows if chainage not in keep]
+        if len(ids) > 0:
+            self.session.query(DBCrosssectionsTable).filter(DBCrosssectionsTable.id.in_(ids)). \
+                delete(synchronize_session=False)
+            self.session.commit()
+        return len(ids)
+
+    def add_crosssection(self, crosssection, jsonfile, imgfile, manifest=None, storefile=None, rowgroup=None): 
         # convert to database input
         geom = f"LineString({crosssection.startpoint.x} {crosssection.startpoint.y}, {crosssection.endpoint.x} {crosssection.endpoint.y})"
         row = DBCrosssectionsTable(
@@ -67,7 +158,10 @@ class DBInput():
             jsonfile=jsonfile,
             imgfile=imgfile,
             date=datetime.date.today().strftime("%Y-%m-%d"),
-            geom=geom
+            geom=geom,
+            manifest=manifest,
+            storefile=storefile,
+            rowgroup=rowgroup
         )
         
         # check if we already have a row with this levee_code and chainage
@@ -77,13 +171,16 @@ class DBInput():
             filter(DBCrosssectionsTable.chainage == crosssection.levee_chainage).first()        
 
         if check_row is not None: # update
-            self.session.query(DBCrosssectionsTable).filter(DBCrosssectionsTable==check_row.id). \
+            self.session.query(DBCrosssectionsTable).filter(DBCrosssectionsTable.id==check_row.id). \
                 update(
                     {
                         'jsonfile':jsonfile, 
                         'imgfile':imgfile, 
                         'date':datetime.date.today().strftime("%Y-%m-%d"), 
-                        'geom':geom
+                        'geom':geom,
+                        'manifest':manifest,
+                        'storefile':storefile,
+                        'rowgroup':rowgroup
                     }
                 ) 
         else: # new row
@@ -119,6 +216,28 @@ class DBInput():
 
         self.session.commit()
 
+    def locate_cpts(self, max_distance=100.0):
+        """Find the levee code, chainage and offset of all cpts in the database
+
+        Args:
+            max_distance (float): maximum distance between a cpt and the route of a levee
+
+        Returns:
+            dict: filename -> (levee code, chainage, offset), levee code is None if no levee is found
+        """
+        rows = self.session.query(
+            DBCPTTable.filename, func.ST_X(DBCPTTable.geom), func.ST_Y(DBCPTTable.geom)
+        ).all()
+        if len(rows) == 0:
+            return {}
+
+        filenames, xs, ys = zip(*rows)
+        codes, chainages, offsets = get_routes().locate(xs, ys, max_distance=max_distance)
+        return {
+            filename: (code, chainage, offset)
+            for filename, code, chainage, offset in zip(filenames, codes, chainages, offsets)
+        }
+
     def check_cpts(self):
         # create a logfile for the errors
         logfile = open(LOG_FILES['cpts'], 'a+')
@@ -173,9 +292,38 @@ class DBInput():
         logfile.close()
 
 
+def add_missing_columns(engine):
+    """Add the columns that are missing in the tables of an existing database
+
+    create_all only creates the tables that do not exist, the columns that were
+    added to a table later (like manifest, storefile and rowgroup of the
+    crosssections) are added with ALTER TABLE ... ADD COLUMN.
+
+    Args:
+        engine (Engine): the database engine
+
+    Returns:
+        List[str]: the added columns as table.column
+    """
+    inspector = inspect(engine)
+    added = []
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    columntype = column.type.compile(dialect=engine.dialect)
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {columntype}"))
+                    added.append(f"{table.name}.{column.name}")
+    return added
+
+
 if __name__=="__main__":
     engine = create_engine(DB_INPUT_URL)
     Base.metadata.create_all(engine)
+    # existing databases get the columns that were added later
+    for column in add_missing_columns(engine):
+        print(f"Added column {column}")
 
     db = DBInput()
     db.check_cpts()
@@ -0,0 +1,264 @@
+import json
+import math
+import numpy as np
+
+from pathlib import Path
+from pydantic.dataclasses import dataclass
+from typing import List, Tuple
+
+from mlas_waternet.gis.routes import Route
+from mlas_waternet.gis.tiles import (
+    Tile,
+    Tileset,
+    TileType,
+    TileInterpolation,
+    TileBoundary,
+    TileResolution,
+    TileShape,
+    TILES_CATALOG_DTYPE,
+)
+
+
+def get_corridor_mosaic_filename(path: str, levee_code: str, tile_type: TileType) -> Path:
+    """Get the filename of the header of the corridor mosaic of a levee
+
+    Args:
+        path (str): directory of the corridor mosaics
+        levee_code (str): code of the levee
+        tile_type (TileType): type of the tiles
+
+    Returns:
+        Path: filename of the header, the data is stored next to it with the .raw extension
+    """
+    return Path(path) / f"{levee_code}_{tile_type.name.lower()}.json"
+
+
+def get_corridor_sources(route: Route, tileset: Tileset, margin: float, part_length: float = 250.0) -> List[dict]:
+    """Get the tile files that the corridor mosaic of a route is cut from
+
+    Args:
+        route (Route): the route
+        tileset (Tileset): the tileset the mosaic is cut from
+        margin (float): distance around the route
+        part_length (float): maximum length of a route part
+
+    Returns:
+        List[dict]: filename, modification time, size and boundary of the tile files
+    """
+    indices = set()
+    for _, (xmin, ymin, xmax, ymax) in route.get_corridor_boxes(margin, part_length):
+        indices.update(tileset.get_tile_indices(xmin, xmax, ymin, ymax))
+
+    result = []
+    for i in sorted(indices):
+        row, tile = tileset._catalog[i], tileset.tiles[i]
+        result.append(
+            {
+                "filename": str(row["filename"]),
+                "mtime": float(row["mtime"]),
+                "size": int(row["size"]),
+                "left": float(tile.boundary.left),
+                "right": float(tile.boundary.right),
+                "bottom": float(tile.boundary.bottom),
+                "top": float(tile.boundary.top),
+            }
+        )
+    return result
+
+
+def create_corridor_mosaic(
+    route: Route, tileset: Tileset, margin: float, filename: str, part_length: float = 250.0
+) -> Path:
+    """Cut the corridor around a route from the tiles and store it as a mosaic
+
+    The route is split in parts of at most part_length, the bounding box of 
+    each part (with the given margin) is cut from the tileset on the grid of
+    the tileset. All parts are written to a single raw float32 file (no data is
+    stored as np.nan) and a json header with the georeference of the parts is
+    written to the given filename. The header also has the hash of the route and
+    the tile files the mosaic is cut from (see get_corridor_tileset).
+
+    Args:
+        route (Route): the route
+        tileset (Tileset): the tileset to cut the data from
+        margin (float): distance around the route to store
+        filename (str): filename of the header
+        part_length (float): maximum length of a route part
+
+    Returns:
+        Path: filename of the header
+    """
+    headerfile = Path(filename)
+    rawfile = headerfile.with_suffix(".raw")
+    headerfile.parent.mkdir(parents=True, exist_ok=True)
+    ox, oy, dx, dy = tileset.get_grid()
+
+    parts = []
+    offset = 0
+    with open(rawfile, "wb") as f:
+        for _, (xmin, ymin, xmax, ymax) in route.get_corridor_boxes(margin, part_length):
+            # start at an even row and column, rounding half to even (see Tile.get_values) 
+            # then gives the same cells as the tileset for points halfway two cells
+            c1, c2 = 2 * math.floor((xmin - ox) / dx / 2), math.ceil((xmax - ox) / dx)
+            r1, r2 = 2 * math.floor((oy - ymax) / dy / 2), math.ceil((oy - ymin) / dy)
+            xs = ox + np.arange(c1, c2 + 1) * dx
+            ys = oy - np.arange(r1, r2 + 1) * dy
+            data = tileset.sample(
+                np.broadcast_to(xs[None, :], (len(ys), len(xs))),
+                np.broadcast_to(ys[:, None], (len(ys), len(xs))),
+                interpolation=TileInterpolation.NEAREST,
+            ).astype(np.float32)
+            f.write(data.tobytes())
+            parts.append(
+                {
+                    "left": float(xs[0]),
+                    "top": float(ys[0]),
+                    "columns": len(xs),
+                    "rows": len(ys),
+                    "offset": offset,
+                }
+            )
+            offset += data.nbytes
+
+    header = {
+        "levee_code": route.name,
+        "tile_type": int(tileset.tile_type),
+        "margin": margin,
+        "part_length": part_length,
+        "route_hash": route.get_hash(),
+        "sources": get_corridor_sources(route, tileset, margin, part_length),
+        "resolution_x": dx,
+        "resolution_y": dy,
+        "dtype": "float32",
+        "parts": parts,
+    }
+    with open(headerfile, "w") as f:
+        json.dump(header, f, indent=2)
+
+    return headerfile
+
+
+@dataclass
+class CorridorTileset(Tileset):
+    """A tileset based on a corridor mosaic (see create_corridor_mosaic)
+
+    Each part of the mosaic is a memory mapped tile, the tile directory is not
+    used at all. Note that points outside of the corridor have no data.
+
+    Args:
+        filename (str): filename of the header of the corridor mosaic
+    """
+
+    filename: str = ""
+
+    def __post_init_post_parse__(self):
+        """Called after validation, reads the header and memory maps the parts"""
+        headerfile = Path(self.filename)
+        with open(headerfile) as f:
+            header = json.load(f)
+
+        self.tile_type = TileType(header["tile_type"])
+        self._sources = header.get("sources")
+        self._tilesdir = str(headerfile.parent)
+        self._tiles = {}
+        self._given_tiles = []
+
+        rawfile = headerfile.with_suffix(".raw")
+        dx, dy = header["resolution_x"], header["resolution_y"]
+        parts = header["parts"]
+        catalog = np.zeros(len(parts), dtype=TILES_CATALOG_DTYPE)
+        stat = rawfile.stat()
+        for i, part in enumerate(parts):
+            # the catalog stores the bounds of the raster like rasterio does
+            row = catalog[i]
+            row["filename"] = rawfile.name
+            row["mtime"], row["size"] = stat.st_mtime, stat.st_size
+            row["resolution_x"], row["resolution_y"] = dx, dy
+            row["left"] = part["left"] + dx / 2.0
+            row["right"] = part["left"] + (part["columns"] + 0.5) * dx
+            row["top"] = part["top"] - dy / 2.0
+            row["bottom"] = part["top"] - (part["rows"] + 0.5) * dy
+            row["columns"], row["rows"] = part["columns"], part["rows"]
+            row["nodata"] = np.nan
+
+            self._tiles[i] = Tile(
+                filename=str(rawfile),
+                tile_type=self.tile_type,
+                boundary=TileBoundary(
+                    left=part["left"],
+                    right=part["left"] + part["columns"] * dx,
+                    bottom=part["top"] - part["rows"] * dy,
+                    top=part["top"],
+                ),
+                resolution=TileResolution(x=dx, y=dy),
+                shape=TileShape(columns=part["columns"], rows=part["rows"]),
+                nodata=np.nan,
+                data=np.memmap(
+                    rawfile,
+                    dtype=header["dtype"],
+                    mode="r",
+                    offset=part["offset"],
+                    shape=(part["rows"], part["columns"]),
+                ),
+            )
+
+        self._set_catalog(catalog)
+
+    def get_tile_sources(self, left: float, right: float, bottom: float, top: float) -> List[Tuple[str, float, int]]:
+        """Get the source tiles of the mosaic that intersect with the given area
+
+        These are the tile files the mosaic was cut from (see get_corridor_sources),
+        so a change of the source tiles is seen even though the mosaic itself did
+        not change.
+
+        Args:
+            left (float): left boundary of the area
+            right (float): right boundary of the area
+            bottom (float): bottom boundary of the area
+            top (float): top boundary of the area
+
+        Returns:
+            List[Tuple[str, float, int]]: filename, modification time and size of the tile files
+        """
+        if self._sources is None:  # mosaic created without the sources in the header
+            return super().get_tile_sources(left, right, bottom, top)
+        return [
+            (source["filename"], source["mtime"], source["size"])
+            for source in self._sources
+            if source["left"] <= right and source["right"] >= left and source["bottom"] <= top and source["top"] >= bottom
+        ]
+
+
+def get_corridor_tileset(
+    route: Route, tile_type: TileType, margin: float, path: str, rebuild: bool = False
+) -> CorridorTileset:
+    """Get the corridor tileset of a route, the corridor mosaic is created if it is not available
+
+    The corridor mosaic is created again if the route or the tile files it
+    was cut from have changed.
+
+    Args:
+        route (Route): the route
+        tile_type (TileType): type of the tiles
+        margin (float): distance around the route that is needed
+        path (str): directory of the corridor mosaics
+        rebuild (bool): recreate the corridor mosaic even if it is available
+
+    Returns:
+        CorridorTileset: the corridor tileset
+    """
+    headerfile = get_corridor_mosaic_filename(path, route.name, tile_type)
+    tileset = Tileset(tile_type=tile_type)
+    if not rebuild and headerfile.is_file():
+        with open(headerfile) as f:
+            header = json.load(f)
+        if (
+            header["margin"] >= margin
+            and header.get("route_hash") == route.get_hash()
+            and header.get("sources")
+            == get_corridor_sources(route, tileset, header["margin"], header.get("part_length", 250.0))
+        ):
+            return CorridorTileset(filename=str(headerfile))
+
+    create_corridor_mosaic(route, tileset, margin, headerfile)
+    return CorridorTileset(filename=str(headerfile))
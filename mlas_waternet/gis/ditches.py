@@ -0,0 +1,231 @@
+import json
+import math
+import numpy as np
+
+from pathlib import Path
+from typing import List, Tuple
+from rasterio.features import shapes
+from rasterio.transform import from_origin
+from shapely import wkt
+from shapely.geometry import LineString, Point, Polygon, shape
+from shapely.ops import unary_union
+from shapely.strtree import STRtree
+
+from mlas_waternet.gis.routes import Route
+from mlas_waternet.gis.tiles import Tileset, TileInterpolation
+
+
+class DitchIndex:
+    """The ditches along a levee as polygons in a spatial index
+
+    The ditch raster is mostly no data, instead of sampling it along every
+    crosssection the connected cells with data are turned into polygons once
+    (see create_ditch_index). The crosssections are intersected with the
+    polygons and the ditch raster is only sampled at the points of the
+    crosssection inside a ditch, so the ditches keep their local levels.
+
+    Args:
+        polygons (List[Polygon]): the ditch polygons
+        margin (float): distance around the route that was searched for ditches
+        route_hash (str): hash of the route the ditches were searched along (see Route.get_hash)
+        sources (List[list]): the ditch tile files the polygons are created from (see get_ditch_sources)
+    """
+
+    def __init__(self, polygons: List[Polygon], margin: float = 0.0, route_hash: str = None, sources: List[list] = None):
+        self.polygons = list(polygons)
+        self.margin = margin
+        self.route_hash = route_hash
+        self.sources = sources
+        self._tree = STRtree(self.polygons)
+
+    def __reduce__(self):
+        """Pickle the polygons, the spatial index is built again when unpickled"""
+        return (self.__class__, (self.polygons, self.margin, self.route_hash, self.sources))
+
+    def _query(self, geometry) -> List[int]:
+        """Get the indices of the polygons whose bounding box intersects with the geometry"""
+        if len(self.polygons) == 0:
+            return []
+        result = self._tree.query(geometry)
+        # shapely 2 returns the indices, shapely 1 the geometries
+        if len(result) > 0 and not isinstance(result[0], (int, np.integer)):
+            ids = {id(polygon): i for i, polygon in enumerate(self.polygons)}
+            return sorted(ids[id(polygon)] for polygon in result)
+        return sorted(int(i) for i in result)
+
+    def query(
+        self, start: Tuple[float, float], end: Tuple[float, float], tolerance: float = 0.0
+    ) -> List[Tuple[float, float]]:
+        """Get the ditches along the line from start to end
+
+        Args:
+            start (Tuple[float, float]): x, y of the start of the line
+            end (Tuple[float, float]): x, y of the end of the line
+            tolerance (float): also get the ditches within this distance of the line, the intervals are widened by this distance
+
+        Returns:
+            List[Tuple[float, float]]: distance from start where the line enters and leaves the ditch, sorted on distance
+        """
+        line = LineString([start, end])
+        geometry = line.buffer(tolerance) if tolerance > 0 else line
+        result = []
+        for i in self._query(geometry):
+            intersection = geometry.intersection(self.polygons[i])
+            for part in getattr(intersection, "geoms", [intersection]):
+                if part.is_empty or (tolerance == 0 and part.length == 0):
+                    continue
+                coords = part.exterior.coords if hasattr(part, "exterior") else part.coords
+                ls = [line.project(Point(c)) for c in coords]
+                result.append((min(ls) - tolerance, max(ls) + tolerance))
+        return sorted(result)
+
+    def save(self, filename: str) -> None:
+        """Write the ditches to a json file
+
+        Args:
+            filename (str): the filename
+        """
+        with open(filename, "w") as f:
+            json.dump(
+                {
+                    "margin": self.margin,
+                    "route_hash": self.route_hash,
+                    "sources": self.sources,
+                    "polygons": [polygon.wkt for polygon in self.polygons],
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, filename: str) -> "DitchIndex":
+        """Read the ditches from a json file (see save)
+
+        Args:
+            filename (str): the filename
+
+        Returns:
+            DitchIndex: the ditch index
+        """
+        with open(filename) as f:
+            data = json.load(f)
+        return cls(
+            [wkt.loads(s) for s in data["polygons"]], data["margin"], data.get("route_hash"), data.get("sources")
+        )
+
+
+def get_ditch_sources(route: Route, tileset: Tileset, margin: float, part_length: float = 250.0) -> List[list]:
+    """Get the ditch tile files in the corridor around a route
+
+    Args:
+        route (Route): the route
+        tileset (Tileset): the ditch tiles
+        margin (float): distance around the route
+        part_length (float): maximum length of a route part
+
+    Returns:
+        List[list]: filename, modification time and size of the tile files (lists so they compare equal after a json round trip)
+    """
+    sources = set()
+    for _, (xmin, ymin, xmax, ymax) in route.get_corridor_boxes(margin, part_length):
+        sources.update(tileset.get_tile_sources(xmin, xmax, ymin, ymax))
+    return [list(source) for source in sorted(sources)]
+
+
+def create_ditch_index(route: Route, tileset: Tileset, margin: float, part_length: float = 250.0) -> DitchIndex:
+    """Find the ditches in the corridor around a route
+
+    The route is split in parts of at most part_length, the bounding box of each
+    part (with the given margin) is cut from the tileset on the grid of the
+    tileset. The connected cells with data of each part become polygons, the
+    polygons of all parts are merged so a ditch that crosses the edge of a part
+    is a single polygon. The cell of a grid point covers the area that is
+    closest to that point, like the nearest lookup of the tileset.
+
+    Args:
+        route (Route): the route
+        tileset (Tileset): the ditch tiles
+        margin (float): distance around the route to search for ditches
+        part_length (float): maximum length of a route part
+
+    Returns:
+        DitchIndex: the ditches
+    """
+    route_hash = route.get_hash()
+    sources = get_ditch_sources(route, tileset, margin, part_length)
+    try:
+        ox, oy, dx, dy = tileset.get_grid()
+    except IndexError:  # no tiles
+        return DitchIndex([], margin, route_hash, sources)
+
+    polygons = []
+    for _, (xmin, ymin, xmax, ymax) in route.get_corridor_boxes(margin, part_length):
+        c1, c2 = math.floor((xmin - ox) / dx), math.ceil((xmax - ox) / dx)
+        r1, r2 = math.floor((oy - ymax) / dy), math.ceil((oy - ymin) / dy)
+        xs = ox + np.arange(c1, c2 + 1) * dx
+        ys = oy - np.arange(r1, r2 + 1) * dy
+        data = tileset.sample(
+            np.broadcast_to(xs[None, :], (len(ys), len(xs))),
+            np.broadcast_to(ys[:, None], (len(ys), len(xs))),
+            interpolation=TileInterpolation.NEAREST,
+        )
+        valid = ~np.isnan(data)
+        if not np.any(valid):
+            continue
+
+        transform = from_origin(xs[0] - dx / 2, ys[0] + dy / 2, dx, dy)
+        polygons += [
+            shape(geometry)
+            for geometry, _ in shapes(valid.astype(np.uint8), mask=valid, transform=transform)
+        ]
+
+    if len(polygons) == 0:
+        return DitchIndex([], margin, route_hash, sources)
+
+    # merge the polygons of overlapping parts
+    merged = unary_union(polygons)
+    return DitchIndex(list(getattr(merged, "geoms", [merged])), margin, route_hash, sources)
+
+
+def get_ditch_index_filename(path: str, levee_code: str) -> Path:
+    """Get the filename of the ditch index of a levee
+
+    Args:
+        path (str): directory of the ditch indices
+        levee_code (str): code of the levee
+
+    Returns:
+        Path: the filename
+    """
+    return Path(path) / f"{levee_code}_ditches.json"
+
+
+def get_ditch_index(
+    route: Route, tileset: Tileset, margin: float, path: str, rebuild: bool = False
+) -> DitchIndex:
+    """Get the ditch index of a route, the ditch index is created if it is not available or out of date
+
+    Args:
+        route (Route): the route
+        tileset (Tileset): the ditch tiles
+        margin (float): distance around the route that is needed
+        path (str): directory of the ditch indices
+        rebuild (bool): recreate the ditch index even if it is available
+
+    Returns:
+        DitchIndex: the ditch index
+    """
+    filename = get_ditch_index_filename(path, route.name)
+    if not rebuild and filename.is_file():
+        index = DitchIndex.load(filename)
+        # the index is only valid for the same route and the same ditch tiles
+        if (
+            index.margin >= margin
+            and index.route_hash == route.get_hash()
+            and index.sources == get_ditch_sources(route, tileset, index.margin)
+        ):
+            return index
+
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    index = create_ditch_index(route, tileset, margin)
+    index.save(filename)
+    return index
@@ -0,0 +1,103 @@
+import numpy as np
+from pydantic.dataclasses import dataclass
+
+from mlas_waternet.gis.tiles import Tileset
+
+
+MOSAIC_WINDOWSIZE = 2048  # maximum number of rows and columns of a single window read
+
+
+@dataclass
+class VirtualMosaicTileset(Tileset):
+    """A tileset that presents all tiles as one raster on the grid of the tileset
+
+    Instead of looking up each point in the tiles, the window of the raster that
+    covers the points is read at once (see read_window) and the points are 
+    taken from that window. A profile line that spans multiple tiles therefore
+    costs a single read. If tiles overlap the first tile with data for a cell 
+    is used so cells without data in one tile are filled by the other tiles.
+
+    The tiles are expected to share the grid of the first tile (see Tileset.get_grid).
+    """
+
+    def read_window(self, row_off: int, column_off: int, rows: int, columns: int) -> np.ndarray:
+        """Read a window of the mosaic
+
+        Args:
+            row_off (int): first row of the window on the grid of the tileset
+            column_off (int): first column of the window on the grid of the tileset
+            rows (int): number of rows
+            columns (int): number of columns
+
+        Returns:
+            np.ndarray: z values of the window, np.nan if no data
+        """
+        result = np.full((rows, columns), np.nan)
+        ox, oy, dx, dy = self.get_grid()
+        for i in self.get_tile_indices(
+            ox + column_off * dx,
+            ox + (column_off + columns - 1) * dx,
+            oy - (row_off + rows - 1) * dy,
+            oy - row_off * dy,
+        ):
+            tile = self._get_tile(i)
+            tile_row_off = int(round((oy - tile.boundary.top) / dy))
+            tile_column_off = int(round((tile.boundary.left - ox) / dx))
+            r1 = max(row_off, tile_row_off)
+            r2 = min(row_off + rows, tile_row_off + tile.shape.rows)
+            c1 = max(column_off, tile_column_off)
+            c2 = min(column_off + columns, tile_column_off + tile.shape.columns)
+            if r1 >= r2 or c1 >= c2:
+                continue
+
+            window = result[r1 - row_off : r2 - row_off, c1 - column_off : c2 - column_off]
+            nodata = np.isnan(window)
+            if not np.any(nodata):
+                continue
+            values = tile.read_window(
+                r1 - tile_row_off, r2 - tile_row_off, c1 - tile_column_off, c2 - tile_column_off
+            )
+            window[nodata] = values[nodata]
+
+        return result
+
+    def _sample_nearest(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """Get the z values of the nearest cells at the given x,y coordinates
+
+        All points are taken from one window if the points fit in MOSAIC_WINDOWSIZE 
+        rows and columns, else the points are grouped in windows of that size.
+        """
+        xs = np.asarray(xs, dtype=float)
+        ys = np.asarray(ys, dtype=float)
+        result = np.full(xs.shape, np.nan)
+        if len(self._catalog) == 0:
+            return result
+
+        flat_xs, flat_ys, flat_result = xs.ravel(), ys.ravel(), result.ravel()
+        ids = np.flatnonzero(np.isfinite(flat_xs) & np.isfinite(flat_ys))
+        if len(ids) == 0:
+            return result
+
+        ox, oy, dx, dy = self.get_grid()
+        columns = np.round((flat_xs[ids] - ox) / dx).astype(np.int64)
+        rows = np.round((oy - flat_ys[ids]) / dy).astype(np.int64)
+
+        if rows.max() - rows.min() < MOSAIC_WINDOWSIZE and columns.max() - columns.min() < MOSAIC_WINDOWSIZE:
+            groups = [np.arange(len(ids))]
+        else:
+            keys = (rows // MOSAIC_WINDOWSIZE) * (2 ** 32) + columns // MOSAIC_WINDOWSIZE
+            order = np.argsort(keys, kind="stable")
+            splits = np.flatnonzero(np.diff(keys[order])) + 1
+            groups = np.split(order, splits)
+
+        for group in groups:
+            row_off, column_off = rows[group].min(), columns[group].min()
+            window = self.read_window(
+                int(row_off),
+                int(column_off),
+                int(rows[group].max() - row_off + 1),
+                int(columns[group].max() - column_off + 1),
+            )
+            flat_result[ids[group]] = window[rows[group] - row_off, columns[group] - column_off]
+
+        return result
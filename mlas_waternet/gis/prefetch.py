@@ -0,0 +1,98 @@
+import math
+import threading
+from typing import List, Tuple
+
+from mlas_waternet.gis.routes import Route
+from mlas_waternet.gis.tiles import Tileset
+
+
+class TilePrefetcher:
+    """Loads the tile data along the corridor of a route on a background thread
+
+    The route is split in parts of at most part_length meters, the tile data 
+    of the bounding box of each part (with the given margin) is loaded as soon
+    as the part is within lookahead meters of the current chainage. Use 
+    advance to report the chainage that is currently being processed.
+
+    Args:
+        tileset (Tileset): the tileset to load the data from
+        route (Route): the route
+        margin (float): distance around the route that is needed
+        lookahead (float): distance ahead of the current chainage to load
+        part_length (float): maximum length of a route part
+    """
+
+    def __init__(
+        self,
+        tileset: Tileset,
+        route: Route,
+        margin: float,
+        lookahead: float = 250.0,
+        part_length: float = 50.0,
+    ):
+        self.tileset = tileset
+        self.route = route
+        self.margin = margin
+        self.lookahead = lookahead
+        self.part_length = part_length
+        self._chainage = -math.inf
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._thread = None
+        self._parts = self._corridor_parts()
+
+    def _corridor_parts(self) -> List[Tuple[float, List[float]]]:
+        """Get the start chainage and bounding box (left, right, bottom, top) of each part of the route
+
+        No parts are returned if the corridor does not intersect with any tile.
+        """
+        xmin, ymin, xmax, ymax = self.route.get_bounding_box(margin=self.margin)
+        if len(self.tileset.get_tile_indices(xmin, xmax, ymin, ymax)) == 0:
+            return []
+
+        return [
+            (chainage, [bbox[0], bbox[2], bbox[1], bbox[3]])
+            for chainage, bbox in self.route.get_corridor_boxes(self.margin, self.part_length)
+        ]
+
+    def _run(self) -> None:
+        """Background thread, loads the parts in chainage order"""
+        for chainage, bbox in self._parts:
+            with self._condition:
+                while not self._stopped and chainage > self._chainage + self.lookahead:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+            self.tileset.prefetch(*bbox)
+
+    def start(self) -> "TilePrefetcher":
+        """Start loading the tile data on a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def advance(self, chainage: float) -> None:
+        """Report the chainage that is currently being processed
+
+        Args:
+            chainage (float): current chainage
+        """
+        with self._condition:
+            self._chainage = chainage
+            self._condition.notify()
+
+    def stop(self) -> None:
+        """Stop the background thread"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "TilePrefetcher":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
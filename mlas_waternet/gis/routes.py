@@ -1,14 +1,22 @@
+import hashlib
 import math
-from typing import List
+import os
+import threading
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Dict, List, Tuple
 import shapefile
 import dataclasses
+import numpy as np
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from pydantic.dataclasses import dataclass
 
 from mlas.objects.points import ChainagePoint, Point3D
 
 from mlas_waternet.settings import SETTINGS
+from mlas_waternet.const import ROUTES_CACHE_SUFFIX
+from mlas_waternet.helpers import round_values
 
 
 class Route(BaseModel):
@@ -22,6 +30,8 @@ class Route(BaseModel):
     name: str = ""
     chainage_points: List[ChainagePoint] = []
 
+    _arrays: Tuple[np.ndarray, np.ndarray, np.ndarray] = PrivateAttr(default=None)
+
     @property
     def max_chainage(self):
         """Returns the maximum chainage"""
@@ -36,6 +46,36 @@ class Route(BaseModel):
             raise IndexError("No chainage points in this route")
         return self.chainage_points[0].chainage
 
+    @classmethod
+    def from_array(cls, name: str, array: np.ndarray) -> "Route":
+        """Create a route from an array with rows chainage, x, y
+
+        Args:
+            name (str): levee name
+            array (np.ndarray): array with rows chainage, x, y
+
+        Returns:
+            Route: the route
+        """
+        route = cls(
+            name=name,
+            chainage_points=[
+                ChainagePoint(chainage=int(m), point3d=Point3D(x=x, y=y)) for m, x, y in array.tolist()
+            ],
+        )
+        route._arrays = (array[:, 0].copy(), array[:, 1].copy(), array[:, 2].copy())
+        return route
+
+    def _get_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Get the chainages, x and y coordinates of the chainage points as arrays"""
+        if self._arrays is None or len(self._arrays[0]) != len(self.chainage_points):
+            self._arrays = (
+                np.array([p.chainage for p in self.chainage_points], dtype=float),
+                np.array([p.point3d.x for p in self.chainage_points], dtype=float),
+                np.array([p.point3d.y for p in self.chainage_points], dtype=float),
+            )
+        return self._arrays
+
     def xya_at_chainage(self, chainage: int):
         """Return the x and y coordinate and orientation of the given chainage
 
@@ -59,27 +99,90 @@ class Route(BaseModel):
         Todo:
             * check if orientation story above is correct
         """
-        for i in range(1, len(self.chainage_points)):
-            m1, x1, y1 = (
-                self.chainage_points[i - 1].chainage,
-                self.chainage_points[i - 1].point3d.x,
-                self.chainage_points[i - 1].point3d.y,
-            )
-            m2, x2, y2 = (
-                self.chainage_points[i].chainage,
-                self.chainage_points[i].point3d.x,
-                self.chainage_points[i].point3d.y,
+        xs, ys, alphas = self.xya_at_chainages(np.array([chainage]))
+        return float(xs[0]), float(ys[0]), float(alphas[0])
+
+    def xya_at_chainages(self, chainages: np.ndarray, smooth: bool = False):
+        """Return the x and y coordinates and orientations of the given chainages
+
+        See xya_at_chainage for the definition of the orientation. By default the
+        orientation is the orientation of the route segment, if smooth is True
+        the orientation is interpolated between the orientations at the route
+        points (the average of both adjacent segments) so the orientation does 
+        not jump at the route points.
+
+        Args:
+            chainages (np.ndarray): chainages on the route
+            smooth (bool): interpolate the orientation between the route points
+
+        Returns:
+            x (np.ndarray): x-coordinates of the given chainages
+            y (np.ndarray): y-coordinates of the given chainages
+            a (np.ndarray): alpha, orientations of the given chainages
+        """
+        ms, xs, ys = self._get_arrays()
+        chainages = np.asarray(chainages, dtype=float)
+
+        invalid = (chainages < ms[0]) | (chainages > ms[-1]) if len(ms) > 1 else np.ones(chainages.shape, dtype=bool)
+        if np.any(invalid):
+            raise ValueError(
+                f"Unknown chainage {chainages[invalid][0]:g} at route {self.name} with minimum chainage {self.min_chainage} and max chainage {self.max_chainage}"
             )
 
-            if m1 <= chainage <= m2:
-                x = x1 + (chainage - m1) / (m2 - m1) * (x2 - x1)
-                y = y1 + (chainage - m1) / (m2 - m1) * (y2 - y1)
-                alpha = math.atan2((y1 - y2), (x1 - x2))
-                return round(x, 2), round(y, 2), alpha
+        # index of the first route segment that contains the chainage
+        i = np.clip(np.searchsorted(ms, chainages, side="left") - 1, 0, len(ms) - 2)
+        f = (chainages - ms[i]) / (ms[i + 1] - ms[i])
+        x = xs[i] + f * (xs[i + 1] - xs[i])
+        y = ys[i] + f * (ys[i + 1] - ys[i])
+
+        # direction of each segment (pointing to the start of the route)
+        dx, dy = xs[:-1] - xs[1:], ys[:-1] - ys[1:]
+        if not smooth:
+            return round_values(x, 2), round_values(y, 2), np.arctan2(dy[i], dx[i])
+
+        # unit directions at the route points, the average of the adjacent segments
+        dl = np.hypot(dx, dy)
+        dl[dl == 0] = 1.0
+        ux, uy = dx / dl, dy / dl
+        px = np.concatenate([ux[:1], ux[:-1] + ux[1:], ux[-1:]])
+        py = np.concatenate([uy[:1], uy[:-1] + uy[1:], uy[-1:]])
+        reverse = np.hypot(px, py) < 1e-9  # route turns back, use the next segment
+        px[reverse] = np.concatenate([ux, ux[-1:]])[reverse]
+        py[reverse] = np.concatenate([uy, uy[-1:]])[reverse]
+
+        ax = (1 - f) * px[i] + f * px[i + 1]
+        ay = (1 - f) * py[i] + f * py[i + 1]
+        return round_values(x, 2), round_values(y, 2), np.arctan2(ay, ax)
+
+    def get_segment_hashes(self, chainages: np.ndarray) -> List[str]:
+        """Get a hash of the part of the route that determines the location and orientation at the given chainages
+
+        The hash covers the route segment of the chainage and the adjacent
+        segments (used for the smoothed orientation) so it changes if one of
+        these route points is edited or moved to another chainage.
 
-        raise ValueError(
-            f"Unknown chainage {chainage} at route {self.name} with minimum chainage {self.min_chainage} and max chainage {self.max_chainage}"
-        )
+        Args:
+            chainages (np.ndarray): chainages on the route
+
+        Returns:
+            List[str]: the hashes of the given chainages
+        """
+        ms, xs, ys = self._get_arrays()
+        points = np.stack([ms, xs, ys], axis=1)
+        i = np.clip(np.searchsorted(ms, np.asarray(chainages, dtype=float), side="left") - 1, 0, max(len(ms) - 2, 0))
+        return [
+            hashlib.sha1(points[max(j - 1, 0) : j + 3].tobytes()).hexdigest()
+            for j in i.tolist()
+        ]
+
+    def get_hash(self) -> str:
+        """Get a hash of the route points, it changes if any point of the route changes
+
+        Returns:
+            str: the hash
+        """
+        ms, xs, ys = self._get_arrays()
+        return hashlib.sha1(np.stack([ms, xs, ys], axis=1).tobytes()).hexdigest()
 
     def get_bounding_box(self, margin=0.0):
         """Get the bounding box of the route coordinates"""
@@ -100,12 +203,100 @@ class Route(BaseModel):
             result[3] + margin,
         ]
 
+    def get_corridor_boxes(self, margin: float, part_length: float) -> List[Tuple[float, List[float]]]:
+        """Split the route in parts of at most part_length and get the bounding box of each part
+
+        Args:
+            margin (float): distance around the route to add to the bounding boxes
+            part_length (float): maximum length of a part
+
+        Returns:
+            List[Tuple[float, List[float]]]: start chainage and bounding box [xmin, ymin, xmax, ymax] of each part
+        """
+        result = []
+        for p1, p2 in zip(self.chainage_points[:-1], self.chainage_points[1:]):
+            m1, x1, y1 = p1.chainage, p1.point3d.x, p1.point3d.y
+            m2, x2, y2 = p2.chainage, p2.point3d.x, p2.point3d.y
+            num_parts = max(1, math.ceil(math.hypot(x2 - x1, y2 - y1) / part_length))
+            for i in range(num_parts):
+                f1, f2 = i / num_parts, (i + 1) / num_parts
+                xa, ya = x1 + f1 * (x2 - x1), y1 + f1 * (y2 - y1)
+                xb, yb = x1 + f2 * (x2 - x1), y1 + f2 * (y2 - y1)
+                result.append(
+                    (
+                        m1 + f1 * (m2 - m1),
+                        [
+                            min(xa, xb) - margin,
+                            min(ya, yb) - margin,
+                            max(xa, xb) + margin,
+                            max(ya, yb) + margin,
+                        ],
+                    )
+                )
+        return result
+
+
+def _route_array(points: List[Tuple[float, float]]) -> np.ndarray:
+    """Calculate the chainage of the points of a route line
+
+    Points that would get the same (integer) chainage as the previous point are
+    skipped, the chainage is measured from the last point that is kept.
+
+    Args:
+        points (List[Tuple[float, float]]): x, y coordinates of the route line
+
+    Returns:
+        np.ndarray: array with rows chainage, x, y
+    """
+    result = []
+    m = 0
+    for j, (x, y) in enumerate(points):
+        if j == 0:
+            result.append((0, x, y))
+            continue
+
+        m += math.sqrt((result[-1][1] - x) ** 2 + (result[-1][2] - y) ** 2)
+        # avoid entries with same chainage
+        if int(m) != result[-1][0]:
+            result.append((int(m), x, y))
+    return np.array(result, dtype=float).reshape(-1, 3)
+
+
+class _RouteDict(Mapping):
+    """The routes of all levees as a read only dict, the routes are created on first use"""
+
+    def __init__(self, routes: "Routes", loaded: Dict[str, Route] = None):
+        self._routes = routes
+        self._loaded = dict(loaded or {})
+
+    def __getitem__(self, levee_code: str) -> Route:
+        if levee_code not in self._loaded:
+            if levee_code not in self._routes._index:
+                raise KeyError(levee_code)
+            self._loaded[levee_code] = self._routes._load_route(levee_code)
+        return self._loaded[levee_code]
+
+    def __iter__(self):
+        return iter(self._routes._index.keys())
+
+    def __len__(self) -> int:
+        return len(self._routes._index)
+
 
 @dataclass
 class Routes:
     """The Routes class contains all available routes based on the information in
     the given shapefile
 
+    The routes are read on demand. After the first read the routes are cached as
+    numpy arrays (chainage, x, y) in a binary file next to the shapefile (see
+    ROUTES_CACHE_SUFFIX) so reading a single route does not depend on the size 
+    of the shapefile. The cache is rebuilt if the shapefile is changed. Only
+    the levee codes are kept in memory, the cache file is kept open and the
+    arrays of a route are read from it on first use.
+    routes has all routes by levee code, the Route objects are created on
+    first use.
+
     NOTE the shapefile expects the field with the levee codes to be named DWKIDENT
     adjust the code if defined otherwise
 
@@ -117,39 +308,91 @@ class Routes:
     shapefile: str = SETTINGS["shapefile_routes"]
 
     def __post_init_post_parse__(self):
-        """Called after validation, reads the given shapefile"""
+        """Called after validation, reads the index of the given shapefile"""
         try:
-            self._read_from_shapefile()
+            self._read_index()
         except Exception as e:
             raise ValueError(f"Error reading {self.shapefile} with error {e}")
+        self.routes = _RouteDict(self, self.routes)
 
-    def _read_from_shapefile(self):
-        """Reads the shapefile"""
-        shape = shapefile.Reader(self.shapefile)
-                
-        for i in range(len(shape.records())):
-            record = shape.records()[i]
-            geometry = shape.shapes()[i]
-            rt = Route(name=record['DWKIDENT'])
-            
-            m = 0
-            for j in range(len(geometry.points)):
-                pt = geometry.points[j]
-                if j == 0:
-                    rt.chainage_points.append(
-                        ChainagePoint(chainage=0, point3d=Point3D(x=pt[0], y=pt[1]))
-                    )
-                else:
-                    dx = rt.chainage_points[-1].point3d.x - pt[0]
-                    dy = rt.chainage_points[-1].point3d.y - pt[1]
-                    m += math.sqrt(dx ** 2 + dy ** 2)
-                    # avoid entries with same chainage
-                    if not int(m) in [p.chainage for p in rt.chainage_points]:
-                        rt.chainage_points.append(
-                            ChainagePoint(chainage=int(m), point3d=Point3D(x=pt[0], y=pt[1]))
-                        )
-                
-            self.routes[rt.name] = rt
+    def _load_route(self, levee_code: str) -> Route:
+        """Create the route of a levee from the cached arrays"""
+        return Route.from_array(levee_code, self._get_array(levee_code))
+
+    def _get_array(self, levee_code: str) -> np.ndarray:
+        """Read the array (chainage, x, y) of a route from the cache file"""
+        with self._lock:
+            return self._npz[f"route_{self._index[levee_code]}"]
+
+    def close(self) -> None:
+        """Close the cache file"""
+        npz = getattr(self, "_npz", None)
+        if npz is not None:
+            npz.close()
+            self._npz = None
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def _cachefile(self) -> Path:
+        return Path(self.shapefile).with_suffix(ROUTES_CACHE_SUFFIX)
+
+    def _shapefile_mtime(self) -> float:
+        """Get the last modification time of the shapefile (shp and dbf)"""
+        return max(
+            os.path.getmtime(filename)
+            for filename in [Path(self.shapefile).with_suffix(".shp"), Path(self.shapefile).with_suffix(".dbf")]
+            if filename.is_file()
+        )
+
+    def _read_index(self) -> None:
+        """Reads the levee codes from the cache, the cache is (re)built if necessary"""
+        self._lock = threading.Lock()
+        mtime = self._shapefile_mtime()
+        if self._cachefile.is_file() and self._open_cache(mtime):
+            return
+
+        self._read_from_shapefile(mtime)
+        if not self._open_cache(mtime):
+            raise ValueError(f"Could not read the routes cache {self._cachefile}")
+
+    def _open_cache(self, mtime: float) -> bool:
+        """Open the cache file and read the levee codes if the cache belongs to the shapefile
+
+        Args:
+            mtime (float): last modification time of the shapefile
+
+        Returns:
+            bool: True if the cache is valid
+        """
+        try:
+            npz = np.load(self._cachefile)
+        except (OSError, ValueError):  # corrupt cache, rebuild
+            return False
+        try:
+            if float(npz["mtime"]) == mtime:
+                self._index = {str(code): i for i, code in enumerate(npz["codes"])}
+                self._npz = npz
+                return True
+        except (OSError, ValueError, KeyError):  # corrupt or old cache, rebuild
+            pass
+        npz.close()
+        return False
+
+    def _read_from_shapefile(self, mtime: float) -> None:
+        """Reads the shapefile in a single pass and writes the cache"""
+        arrays = {}
+        with shapefile.Reader(self.shapefile) as shape:
+            for shaperecord in shape.iterShapeRecords():
+                arrays[shaperecord.record["DWKIDENT"]] = _route_array(shaperecord.shape.points)
+
+        codes = list(arrays.keys())
+        data = {f"route_{i}": arrays[code] for i, code in enumerate(codes)}
+        tmpfile = self._cachefile.with_suffix(".tmp")
+        with open(tmpfile, "wb") as f:
+            np.savez(f, mtime=np.array(mtime), codes=np.array(codes, dtype=str), **data)
+        os.replace(tmpfile, self._cachefile)
 
     def get_levee_codes(self):
         """Return the available levee codes
@@ -157,7 +400,7 @@ class Routes:
         Returns:
             List[str]: list with levee codes
         """
-        return self.routes.keys()
+        return self._index.keys()
 
     def get_by_levee_code(self, dtcode):
         """Get a route by it's levee code
@@ -168,13 +411,148 @@ class Routes:
         Returns:
             route (Route): the according route
         """
-        if dtcode in self.routes.keys():
-            return self.routes[dtcode]
-        else:
-            return None
+        return self.routes.get(dtcode)
+
+    def _build_segment_index(self, max_distance: float) -> None:
+        """Build a regular grid hash of the segments of all routes
+
+        Each segment is registered in all cells that are within max_distance of 
+        the bounding box of the segment so a point only has to check the segments
+        of its own cell.
+        """
+        ms, xs, ys, route_ids = [], [], [], []
+        codes = list(self._index.keys())
+        for i, code in enumerate(codes):
+            array = self._get_array(code)
+            if len(array) < 2:
+                continue
+            ms.append(array[:, 0])
+            xs.append(array[:, 1])
+            ys.append(array[:, 2])
+            route_ids.append(np.full(len(array), i))
+
+        if len(ms) == 0:
+            self._segments = None
+            return
+
+        ms, xs, ys, route_ids = [np.concatenate(a) for a in [ms, xs, ys, route_ids]]
+        valid = route_ids[:-1] == route_ids[1:]  # no segments between the end and start of two routes
+        segments = {
+            "m1": ms[:-1][valid],
+            "m2": ms[1:][valid],
+            "x1": xs[:-1][valid],
+            "x2": xs[1:][valid],
+            "y1": ys[:-1][valid],
+            "y2": ys[1:][valid],
+            "route": route_ids[:-1][valid],
+        }
+
+        cellsize = max(max_distance, 1.0)
+        c1 = np.floor((np.minimum(segments["x1"], segments["x2"]) - max_distance) / cellsize).astype(np.int64)
+        c2 = np.floor((np.maximum(segments["x1"], segments["x2"]) + max_distance) / cellsize).astype(np.int64)
+        r1 = np.floor((np.minimum(segments["y1"], segments["y2"]) - max_distance) / cellsize).astype(np.int64)
+        r2 = np.floor((np.maximum(segments["y1"], segments["y2"]) + max_distance) / cellsize).astype(np.int64)
+
+        # all (cell, segment) pairs
+        ncolumns, nrows = c2 - c1 + 1, r2 - r1 + 1
+        counts = ncolumns * nrows
+        segment_ids = np.repeat(np.arange(len(counts)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        columns = c1[segment_ids] + k // nrows[segment_ids]
+        rows = r1[segment_ids] + k % nrows[segment_ids]
+        keys = columns * (2 ** 32) + rows
+
+        order = np.lexsort((segment_ids, keys))
+        self._segment_cells, starts = np.unique(keys[order], return_index=True)
+        self._segment_starts = np.append(starts, len(order))
+        self._segment_ids = segment_ids[order]
+        self._segments = segments
+        self._segment_codes = np.array(codes, dtype=object)
+        self._segment_cellsize = cellsize
+        self._segment_max_distance = max_distance
+
+    def locate(self, xs: np.ndarray, ys: np.ndarray, max_distance: float = 100.0):
+        """Find the closest route, chainage and offset of the given points
+
+        The offset is the perpendicular distance to the route, positive on the
+        right (water) side of the route line (see Route.xya_at_chainage).
+
+        Args:
+            xs (np.ndarray): x coordinates of the points
+            ys (np.ndarray): y coordinates of the points
+            max_distance (float): maximum distance between a point and the route
+
+        Returns:
+            codes (np.ndarray): levee codes of the points (None if there is no route within max_distance)
+            chainages (np.ndarray): chainages of the points (np.nan if there is no route within max_distance)
+            offsets (np.ndarray): offsets of the points (np.nan if there is no route within max_distance)
+        """
+        if getattr(self, "_segment_max_distance", None) != max_distance:
+            self._build_segment_index(max_distance)
+
+        xs = np.asarray(xs, dtype=float).ravel()
+        ys = np.asarray(ys, dtype=float).ravel()
+        codes = np.full(len(xs), None, dtype=object)
+        chainages = np.full(len(xs), np.nan)
+        offsets = np.full(len(xs), np.nan)
+        if self._segments is None or len(xs) == 0:
+            return codes, chainages, offsets
+
+        # find the candidate segments of the cell of each point
+        keys = (
+            np.floor(xs / self._segment_cellsize).astype(np.int64) * (2 ** 32)
+            + np.floor(ys / self._segment_cellsize).astype(np.int64)
+        )
+        cells = np.clip(np.searchsorted(self._segment_cells, keys), 0, len(self._segment_cells) - 1)
+        found = self._segment_cells[cells] == keys
+        counts = np.where(found, self._segment_starts[cells + 1] - self._segment_starts[cells], 0)
+        point_ids = np.repeat(np.arange(len(xs)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        segment_ids = self._segment_ids[self._segment_starts[cells][point_ids] + k]
+
+        # project the points on the candidate segments
+        seg = {key: value[segment_ids] for key, value in self._segments.items()}
+        px, py = xs[point_ids], ys[point_ids]
+        dx, dy = seg["x2"] - seg["x1"], seg["y2"] - seg["y1"]
+        dl2 = dx ** 2 + dy ** 2
+        t = np.clip(((px - seg["x1"]) * dx + (py - seg["y1"]) * dy) / np.where(dl2 > 0, dl2, 1.0), 0.0, 1.0)
+        distance = np.hypot(seg["x1"] + t * dx - px, seg["y1"] + t * dy - py)
+
+        # keep the closest segment per point (the first segment on equal distance)
+        order = np.lexsort((segment_ids, distance, point_ids))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = point_ids[order][1:] != point_ids[order][:-1]
+        best = order[first]
+        best = best[distance[best] <= max_distance]
+
+        p = point_ids[best]
+        codes[p] = self._segment_codes[seg["route"][best]]
+        chainages[p] = seg["m1"][best] + t[best] * (seg["m2"][best] - seg["m1"][best])
+        cross = dx[best] * (py[best] - seg["y1"][best]) - dy[best] * (px[best] - seg["x1"][best])
+        offsets[p] = np.where(cross > 0, -1.0, 1.0) * distance[best]
+        return codes, chainages, offsets
+
+
+_ROUTES = {}
+
+
+def get_routes(shapefile: str = None) -> Routes:
+    """Get the routes of the given shapefile, the Routes object is shared
+
+    Args:
+        shapefile (str): filelocation of the shapefile, defaults to SETTINGS["shapefile_routes"]
+
+    Returns:
+        Routes: the routes
+    """
+    if shapefile is None:
+        shapefile = SETTINGS["shapefile_routes"]
+    if shapefile not in _ROUTES:
+        _ROUTES[shapefile] = Routes(shapefile=shapefile)
+    return _ROUTES[shapefile]
 
 
 if __name__ == "__main__":
     rts = Routes()
     print(rts.get_levee_codes())
-    print(rts.routes["A143"].chainage_points)  #  mxy_to_csv('A143.csv')
+    print(rts.get_by_levee_code("A143").chainage_points)  #  mxy_to_csv('A143.csv')
@@ -1,18 +1,33 @@
 from enum import IntEnum
-import os, glob
-import dataclasses
+import os
+import math
+import threading
 import numpy as np
 
+import dataclasses
+
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import fields
+from functools import partial
 from pathlib import Path
-from typing import Tuple
-from pydantic import BaseModel
+from typing import Callable, Dict, Hashable, Tuple
+from pydantic import BaseModel, PrivateAttr
 from pydantic.dataclasses import dataclass
 from pydantic.types import List, Optional
 import rasterio as rio
+from rasterio.windows import Window
 
 from mlas.objects.points import Point3D
 from mlas_waternet.settings import SETTINGS
-from mlas_waternet.const import TILES_INIFILENAME
+from mlas_waternet.const import (
+    TILES_CATALOGFILENAME,
+    TILES_NPYDIRNAME,
+    TILES_WINDOWSIZE,
+    TILES_INT16_SCALE,
+    TILES_INT16_NODATA,
+)
 
 
 class TileType(IntEnum):
@@ -22,6 +37,172 @@ class TileType(IntEnum):
     HYDRAULIC_HEAD = 3
 
 
+class TileAccessMode(IntEnum):
+    FULL = 0  # read the complete tile on first use
+    WINDOWED = 1  # read (and cache) only the blocks of the tile that are used
+    MEMMAP = 2  # memory map a numpy copy of the tile, falls back to WINDOWED for compressed tiles
+
+
+class TileStorage(IntEnum):
+    NATIVE = 0  # the data type of the file
+    FLOAT32 = 1  # 32 bit floats, no data is stored as np.nan
+    INT16 = 2  # 16 bit integers in TILES_INT16_SCALE units (with an offset), no data is stored as TILES_INT16_NODATA
+
+
+class TileInterpolation(IntEnum):
+    NEAREST = 0  # value of the nearest cell
+    BILINEAR = 1  # bilinear interpolation between the 4 surrounding cells
+    CUBIC = 2  # cubic convolution of the 16 surrounding cells, bilinear if one of them has no data
+
+
+class TileCache:
+    """Least recently used cache for decoded tile data with a memory budget
+
+    The cache is shared by all tilesets of the same tile type, see get_tile_cache.
+    Arrays are evicted (least recently used first) as soon as the total size of
+    the cached arrays exceeds the budget.
+
+    Args:
+        max_bytes (int): memory budget in bytes
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.resident_bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, loader: Callable[[], np.ndarray]) -> np.ndarray:
+        """Get the data for the given key, the loader is called if the data is not cached
+
+        Args:
+            key (Hashable): key of the data (like the filename of the tile)
+            loader (Callable[[], np.ndarray]): function that reads the data
+
+        Returns:
+            np.ndarray: the data
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+
+        # load outside the lock so other threads can use the cache in the meantime
+        data = loader()
+
+        with self._lock:
+            if key in self._data:  # loaded by another thread in the meantime
+                self._data.move_to_end(key)
+                return self._data[key]
+            if data.nbytes > self.max_bytes:  # does not fit, do not cache
+                return data
+            self._data[key] = data
+            self.resident_bytes += data.nbytes
+            self._evict()
+        return data
+
+    def _evict(self) -> None:
+        """Remove the least recently used data until the cache fits its budget"""
+        while self.resident_bytes > self.max_bytes and len(self._data) > 0:
+            _, data = self._data.popitem(last=False)
+            self.resident_bytes -= data.nbytes
+            self.evictions += 1
+
+    def resize(self, max_bytes: int) -> None:
+        """Set a new memory budget, data will be evicted if necessary
+
+        Args:
+            max_bytes (int): memory budget in bytes
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self) -> None:
+        """Remove all data from the cache (the counters are not reset)"""
+        with self._lock:
+            self._data.clear()
+            self.resident_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Get the cache counters
+
+        Returns:
+            Dict[str, int]: hits, misses, evictions, resident bytes, max bytes and number of items
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "resident_bytes": self.resident_bytes,
+                "max_bytes": self.max_bytes,
+                "items": len(self._data),
+            }
+
+
+_TILE_CACHES: Dict[TileType, TileCache] = {}
+_TILE_CACHES_LOCK = threading.Lock()
+_MEMMAP_LOCK = threading.Lock()
+
+
+def get_tile_cache(tile_type: TileType) -> TileCache:
+    """Get the tile data cache that is shared by all tilesets of the given tile type
+
+    The memory budget is read from SETTINGS["tile_cache_bytes"], use
+    TileCache.resize to change it at runtime.
+
+    Args:
+        tile_type (TileType): type of the tiles
+
+    Returns:
+        TileCache: the cache for this tile type
+    """
+    with _TILE_CACHES_LOCK:
+        if tile_type not in _TILE_CACHES:
+            _TILE_CACHES[tile_type] = TileCache(max_bytes=SETTINGS["tile_cache_bytes"])
+        return _TILE_CACHES[tile_type]
+
+
+TILES_CATALOG_DTYPE = np.dtype(
+    [
+        ("filename", "U255"),  # relative to the tiles directory
+        ("mtime", "f8"),
+        ("size", "i8"),
+        ("left", "f8"),
+        ("right", "f8"),
+        ("bottom", "f8"),
+        ("top", "f8"),
+        ("resolution_x", "f8"),
+        ("resolution_y", "f8"),
+        ("columns", "i8"),
+        ("rows", "i8"),
+        ("nodata", "f8"),
+    ]
+)
+
+
+def _read_tile_metadata(filename: str) -> Dict[str, float]:
+    """Read the bounds, resolution, shape and nodata value of a tile file (used by the catalog)"""
+    with rio.open(filename) as r:
+        return {
+            "left": r.bounds.left,
+            "right": r.bounds.right,
+            "bottom": r.bounds.bottom,
+            "top": r.bounds.top,
+            "resolution_x": r.res[0],
+            "resolution_y": r.res[1],
+            "columns": r.width,
+            "rows": r.height,
+            "nodata": np.nan if r.nodata is None else r.nodata,
+        }
+
+
 class TileBoundary(BaseModel):
     left: float = 0.0
     right: float = 0.0
@@ -40,7 +221,14 @@ class TileShape(BaseModel):
 
 
 class Tile(BaseModel):
-    """A tile is a geotiff file with x,y,z data"""
+    """A tile is a geotiff file with x,y,z data
+
+    The data is read on demand and kept in the tile cache of the tile type, if
+    data is set the tile will use that data instead of the file. The access mode
+    determines if the complete tile, only the necessary blocks or a memory mapped
+    copy of the tile is used. The storage determines the data type of the data 
+    in memory (and of the memory mapped copy).
+    """
 
     boundary: TileBoundary = TileBoundary()
     resolution: TileResolution = TileResolution()
@@ -48,15 +236,240 @@ class Tile(BaseModel):
     data: np.ndarray = None
     nodata: float = None
     filename: str = ""
+    tile_type: TileType = TileType.AHN3
+    access_mode: TileAccessMode = TileAccessMode.FULL
+    storage: TileStorage = TileStorage.NATIVE
+    storage_offset: float = 0.0  # offset of the values for TileStorage.INT16
+
+    _block_shape: Tuple[int, int] = PrivateAttr(default=None)
+    _memmap: np.ndarray = PrivateAttr(default=None)
+    _compressed: bool = PrivateAttr(default=False)
 
     class Config:
         arbitrary_types_allowed = True  # for np.ndarray
 
-    def _read(self) -> None:
+    def _encode(self, data: np.ndarray) -> np.ndarray:
+        """Convert data as read from the file to the storage type of the tile"""
+        if self.storage == TileStorage.NATIVE:
+            return data
+
+        nodata = np.isnan(data) | (data == self.nodata)
+        if self.storage == TileStorage.FLOAT32:
+            result = data.astype(np.float32)
+            result[nodata] = np.nan
+            return result
+
+        result = np.round((data - self.storage_offset) / TILES_INT16_SCALE)
+        result[nodata] = 0
+        if np.any(np.abs(result) > 32767):
+            raise ValueError(
+                f"The values of {self.filename} do not fit in int16 storage with offset {self.storage_offset}, "
+                f"the values should be within {32767 * TILES_INT16_SCALE} of the offset"
+            )
+        result[nodata] = TILES_INT16_NODATA
+        return result.astype(np.int16)
+
+    def _decode(self, values: np.ndarray) -> np.ndarray:
+        """Convert values in the storage type of the tile to floats, no data is returned as np.nan"""
+        if self.data is not None or self.storage == TileStorage.NATIVE:
+            return values
+
+        result = np.asarray(values, dtype=float)
+        if self.storage == TileStorage.INT16:
+            nodata = result == TILES_INT16_NODATA
+            result = result * TILES_INT16_SCALE + self.storage_offset
+            result[nodata] = np.nan
+        return result
+
+    def _cache_key(self) -> Tuple:
+        """Key of the data of the tile in the tile cache, the data depends on the storage"""
+        if self.storage == TileStorage.INT16:
+            return (self.filename, self.storage, self.storage_offset)
+        return (self.filename, self.storage)
+
+    def _load(self) -> np.ndarray:
         """Read the geotiff file using GDAL, see the README for common GDAL problems"""
-        if self.data is None:
-            r = rio.open(self.filename)
-            self.data = r.read(1, masked=True).data
+        with rio.open(self.filename) as r:
+            return self._encode(r.read(1, masked=True).data)
+
+    def _read(self) -> np.ndarray:
+        """Get the tile data from the tile cache, the file is read if it is not cached"""
+        if self.data is not None:
+            return self.data
+        return get_tile_cache(self.tile_type).get(self._cache_key(), self._load)
+
+    def _get_block_shape(self) -> Tuple[int, int]:
+        """Get the shape of the blocks that are read in windowed mode
+
+        The internal blocks of the raster are used if the raster is tiled, for
+        rasters stored in strips a window of TILES_WINDOWSIZE is used.
+        """
+        if self._block_shape is None:
+            with rio.open(self.filename) as r:
+                block_rows, block_columns = r.block_shapes[0]
+            if block_rows == 1 or block_columns == self.shape.columns:
+                block_rows, block_columns = TILES_WINDOWSIZE, TILES_WINDOWSIZE
+            self._block_shape = (block_rows, block_columns)
+        return self._block_shape
+
+    def _read_block(self, block_row: int, block_column: int) -> np.ndarray:
+        """Get a block of the tile data from the tile cache, the block is read if it is not cached"""
+        block_rows, block_columns = self._get_block_shape()
+
+        def load() -> np.ndarray:
+            window = Window(
+                col_off=block_column * block_columns,
+                row_off=block_row * block_rows,
+                width=min(block_columns, self.shape.columns - block_column * block_columns),
+                height=min(block_rows, self.shape.rows - block_row * block_rows),
+            )
+            with rio.open(self.filename) as r:
+                return self._encode(r.read(1, window=window, masked=True).data)
+
+        return get_tile_cache(self.tile_type).get(self._cache_key() + (block_row, block_column), load)
+
+    def _get_memmap(self) -> np.ndarray:
+        """Get a memory mapped copy of the tile data
+
+        The copy is written to the TILES_NPYDIRNAME subdirectory of the tiles on
+        first use and rewritten if the tile is newer than the copy.
+
+        Returns:
+            np.ndarray: the memory mapped data or None if the tile is compressed
+        """
+        if self._memmap is None and not self._compressed:
+            npyname = f"{Path(self.filename).stem}_{self.storage.name.lower()}.npy"
+            if self.storage == TileStorage.INT16:
+                npyname = f"{Path(self.filename).stem}_{self.storage.name.lower()}_{self.storage_offset:g}.npy"
+            npyfile = Path(self.filename).parent / TILES_NPYDIRNAME / npyname
+            with _MEMMAP_LOCK:
+                if not npyfile.is_file() or npyfile.stat().st_mtime < os.path.getmtime(self.filename):
+                    with rio.open(self.filename) as r:
+                        if r.compression is not None:
+                            self._compressed = True
+                            return None
+                        data = self._encode(r.read(1, masked=True).data)
+                    npyfile.parent.mkdir(exist_ok=True)
+                    # write to a temporary file first, other processes might be reading the copy
+                    tmpfile = npyfile.with_suffix(f".{os.getpid()}.tmp")
+                    with open(tmpfile, "wb") as f:
+                        np.save(f, data)
+                    os.replace(tmpfile, npyfile)
+                self._memmap = np.load(npyfile, mmap_mode="r")
+        return self._memmap
+
+    def prefetch(self, left: float, right: float, bottom: float, top: float) -> None:
+        """Load the data of the tile that is needed for the given area into the tile cache
+
+        Depending on the access mode this reads the complete tile, the blocks
+        that intersect with the area or creates the memory mapped copy.
+
+        Args:
+            left (float): left boundary of the area
+            right (float): right boundary of the area
+            bottom (float): bottom boundary of the area
+            top (float): top boundary of the area
+        """
+        if self.data is not None:
+            return
+        if self.access_mode == TileAccessMode.FULL:
+            self._read()
+            return
+        if self.access_mode == TileAccessMode.MEMMAP and self._get_memmap() is not None:
+            return
+
+        c1 = max(0, math.floor((left - self.boundary.left) / self.resolution.x))
+        c2 = min(self.shape.columns - 1, math.ceil((right - self.boundary.left) / self.resolution.x))
+        r1 = max(0, math.floor((self.boundary.top - top) / self.resolution.y))
+        r2 = min(self.shape.rows - 1, math.ceil((self.boundary.top - bottom) / self.resolution.y))
+        if c1 > c2 or r1 > r2:
+            return
+
+        block_rows, block_columns = self._get_block_shape()
+        for block_row in range(r1 // block_rows, r2 // block_rows + 1):
+            for block_column in range(c1 // block_columns, c2 // block_columns + 1):
+                self._read_block(block_row, block_column)
+
+    def _read_cells(self, rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+        """Get the values of the cells at the given rows and columns using the access mode of the tile"""
+        if self.data is None and self.access_mode == TileAccessMode.MEMMAP:
+            data = self._get_memmap()
+            if data is not None:
+                return self._decode(data[rows, columns])
+
+        if self.data is None and self.access_mode != TileAccessMode.FULL:
+            block_rows, block_columns = self._get_block_shape()
+            brows, bcolumns = rows // block_rows, columns // block_columns
+            keys = brows * (self.shape.columns // block_columns + 1) + bcolumns
+            result = np.empty(len(rows), dtype=float)
+            for key in np.unique(keys):
+                sel = keys == key
+                block = self._read_block(brows[sel][0], bcolumns[sel][0])
+                result[sel] = block[rows[sel] % block_rows, columns[sel] % block_columns]
+            return self._decode(result)
+
+        return self._decode(self._read()[rows, columns])
+
+    def read_window(self, row1: int, row2: int, column1: int, column2: int) -> np.ndarray:
+        """Get the values of the cells in the given rows and columns using the access mode of the tile
+
+        Args:
+            row1 (int): first row
+            row2 (int): last row (exclusive)
+            column1 (int): first column
+            column2 (int): last column (exclusive)
+
+        Returns:
+            np.ndarray: z values of the cells, np.nan if no data
+        """
+        if self.data is None and self.access_mode == TileAccessMode.MEMMAP:
+            data = self._get_memmap()
+            if data is not None:
+                return self._to_float(self._decode(data[row1:row2, column1:column2]))
+
+        if self.data is None and self.access_mode != TileAccessMode.FULL:
+            block_rows, block_columns = self._get_block_shape()
+            result = np.empty((row2 - row1, column2 - column1), dtype=float)
+            for block_row in range(row1 // block_rows, (row2 - 1) // block_rows + 1):
+                for block_column in range(column1 // block_columns, (column2 - 1) // block_columns + 1):
+                    block = self._read_block(block_row, block_column)
+                    r1 = max(row1, block_row * block_rows)
+                    r2 = min(row2, (block_row + 1) * block_rows)
+                    c1 = max(column1, block_column * block_columns)
+                    c2 = min(column2, (block_column + 1) * block_columns)
+                    result[r1 - row1 : r2 - row1, c1 - column1 : c2 - column1] = block[
+                        r1 - block_row * block_rows : r2 - block_row * block_rows,
+                        c1 - block_column * block_columns : c2 - block_column * block_columns,
+                    ]
+            return self._to_float(self._decode(result))
+
+        return self._to_float(self._decode(self._read()[row1:row2, column1:column2]))
+
+    def _to_float(self, values: np.ndarray) -> np.ndarray:
+        """Convert decoded values to a float array with np.nan for no data"""
+        result = np.array(values, dtype=float)
+        result[result == self.nodata] = np.nan
+        return result
+
+    def get_values(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """Get the z values at the given x,y coordinates
+
+        Args:
+            xs (np.ndarray): x coordinates of the points
+            ys (np.ndarray): y coordinates of the points
+
+        Returns:
+            np.ndarray: z coordinates of the points, np.nan if outside the tile or no data
+        """
+        result = np.full(len(xs), np.nan)
+        columns = np.round((xs - self.boundary.left) / self.resolution.x).astype(np.int64)
+        rows = np.round((self.boundary.top - ys) / self.resolution.y).astype(np.int64)
+        valid = (columns >= 0) & (columns < self.shape.columns) & (rows >= 0) & (rows < self.shape.rows)
+        if np.any(valid):
+            z = np.asarray(self._read_cells(rows[valid], columns[valid]), dtype=float)
+            z[z == self.nodata] = np.nan
+            result[valid] = z
+        return result
 
     def get_z(self, x: float, y: float) -> float:
         """Get the z value at the given x,y coordinates
@@ -66,24 +479,124 @@ class Tile(BaseModel):
             y (float): y coordinate of the point
 
         Returns:
-            x (float): z coordinate of the point or np.nan
+            x (float): z coordinate of the point or None
         """
-        self._read()
-        dx = x - self.boundary.left
-        dy = self.boundary.top - y
-
-        idx = int(round(dx / self.resolution.x))
-        if idx < 0 or idx >= self.shape.columns:
+        z = self.get_values(np.array([x], dtype=float), np.array([y], dtype=float))[0]
+        if np.isnan(z):
             return None
+        return z
 
-        idy = int(round(dy / self.resolution.y))
-        if idy < 0 or idy >= self.shape.rows:
-            return None
 
-        z = self.data[idy, idx]
-        if z == self.nodata:
-            return None
-        return z
+def get_tiles_directory(tile_type: TileType) -> str:
+    """Get the directory with the tile files of a tile type (see SETTINGS)
+
+    Args:
+        tile_type (TileType): type of the tiles
+
+    Returns:
+        str: the directory
+    """
+    if tile_type == TileType.AHN3:
+        return SETTINGS["filepath_ahn3_geotiff"]
+    elif tile_type == TileType.WATERBOTTOM:
+        return SETTINGS["filepath_waterbodem"]
+    elif tile_type == TileType.DITCHES:
+        return SETTINGS["filepath_ditches"]
+    elif tile_type == TileType.HYDRAULIC_HEAD:
+        return SETTINGS["filepath_hydraulic_head"]
+    raise ValueError(f"Unknown tile type {tile_type}")
+
+
+def _update_catalog(tilesdir: str, map_function: Callable = map) -> np.ndarray:
+    """Read the catalog of a tile directory and update it if the tile files have changed
+
+    Args:
+        tilesdir (str): the tile directory
+        map_function (Callable): map function used to read the metadata of new tile files
+
+    Returns:
+        np.ndarray: the catalog
+    """
+    catalogfile = Path(tilesdir) / TILES_CATALOGFILENAME
+    catalog = np.zeros(0, dtype=TILES_CATALOG_DTYPE)
+    if catalogfile.is_file():
+        try:
+            catalog = np.load(catalogfile)
+        except (OSError, ValueError):  # corrupt or old catalog, rebuild
+            pass
+    if catalog.dtype != TILES_CATALOG_DTYPE:
+        catalog = np.zeros(0, dtype=TILES_CATALOG_DTYPE)
+
+    # find the tile files and compare them with the catalog
+    files = {}
+    for extension in [".tif", ".img"]:
+        with os.scandir(tilesdir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(extension):
+                    stat = entry.stat()
+                    files[entry.name] = (stat.st_mtime, stat.st_size)
+        if len(files) > 0:
+            break
+
+    known = {
+        row["filename"]: i
+        for i, row in enumerate(catalog)
+        if files.get(row["filename"]) == (row["mtime"], row["size"])
+    }
+    keep = sorted(known.values())
+    new_files = [f for f in sorted(files.keys()) if f not in known]
+
+    if len(keep) < len(catalog) or len(new_files) > 0:
+        new_rows = np.zeros(len(new_files), dtype=TILES_CATALOG_DTYPE)
+        metadata = map_function(_read_tile_metadata, [str(Path(tilesdir) / f) for f in new_files])
+        for row, filename, meta in zip(new_rows, new_files, metadata):
+            row["filename"] = filename
+            row["mtime"], row["size"] = files[filename]
+            for key, value in meta.items():
+                row[key] = value
+
+        catalog = np.concatenate([catalog[keep], new_rows])
+        # a temporary file per process so an interrupted write or another process will not corrupt the catalog
+        tmpfile = catalogfile.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmpfile, "wb") as f:
+            np.save(f, catalog)
+        os.replace(tmpfile, catalogfile)
+
+    return catalog
+
+
+def update_tile_catalog(tile_type: TileType, workers: int = None) -> None:
+    """Create or update the catalog of the tiles of a tile type with a pool of processes
+
+    A Tileset updates the catalog itself but reads the metadata of new tile
+    files one by one, use this function before the first use of a large tile
+    directory.
+
+    Args:
+        tile_type (TileType): type of the tiles
+        workers (int): number of processes, defaults to the number of processors
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        _update_catalog(get_tiles_directory(tile_type), partial(executor.map, chunksize=64))
+
+
+class _TileList(Sequence):
+    """The tiles of a tileset as a read only list, the tile objects are created on first use"""
+
+    def __init__(self, tileset: "Tileset"):
+        self._tileset = tileset
+
+    def __len__(self) -> int:
+        return len(self._tileset._catalog)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("tile index out of range")
+        return self._tileset._get_tile(i)
 
 
 @dataclass
@@ -92,84 +605,357 @@ class Tileset:
     memory because of the size the tileset will load the tiles if they are 
     necessary.
     
-    The tile files will be preprocessed on first sight to create an ini file 
-    to quickly find the bounding boxes.
+    The tile files will be preprocessed on first sight to create a catalog 
+    (a numpy structured array) to quickly find the bounding boxes. The catalog
+    is updated if tile files are added, removed or changed. The bounding boxes
+    are stored in a regular grid hash so finding the tiles for a point does not
+    depend on the number of tiles.
+
+    Interpolation assumes that all tiles share the same grid (like AHN3), the
+    neighbouring cells are looked up in the tileset so interpolation also works
+    across the edges of the tiles.
+
+    Tiles that are passed to the tileset are used before the tiles of the tile
+    directory. After initialization tiles is the list of all tiles.
     """
 
     tiles: List[Tile] = dataclasses.field(default_factory=list)
     tile_type: TileType = TileType.AHN3
+    access_mode: TileAccessMode = TileAccessMode.FULL
+    interpolation: TileInterpolation = TileInterpolation.NEAREST
+    storage: TileStorage = TileStorage.NATIVE
+    storage_offset: float = 0.0
 
     def __post_init_post_parse__(self):
-        """Called after validation, sets up the tiles and ini file if needed"""
-        if self.tile_type == TileType.AHN3:
-            self._tilesdir = SETTINGS["filepath_ahn3_geotiff"]
-        elif self.tile_type == TileType.WATERBOTTOM:
-            self._tilesdir = SETTINGS["filepath_waterbodem"]
-        elif self.tile_type == TileType.DITCHES:
-            self._tilesdir = SETTINGS["filepath_ditches"]
-        elif self.tile_type == TileType.HYDRAULIC_HEAD:
-            self._tilesdir = SETTINGS["filepath_hydraulic_head"]
-        else:
-            raise ValueError(f"Unknown tile type {self.tile_type}")
-
-        self._inifile = Path(self._tilesdir) / TILES_INIFILENAME
+        """Called after validation, sets up the tiles and catalog file if needed"""
+        self._tilesdir = get_tiles_directory(self.tile_type)
+        self._tiles = {}
+        self._given_tiles = list(self.tiles)
         self._initialize_available_data()
 
+    def __reduce__(self):
+        """Pickle the tileset by its arguments, the catalog and tiles are set up again when unpickled"""
+        kwargs = {f.name: getattr(self, f.name) for f in fields(self)}
+        kwargs["tiles"] = getattr(self, "_given_tiles", [])
+        return (partial(self.__class__, **kwargs), ())
+
     def _initialize_available_data(self) -> None:
-        """Checks if an ini file is available / valid"""
-        if os.path.isfile(self._inifile):
-            self._read_ini()
-        else:
-            self._setup_ini()
-
-    def _setup_ini(self) -> None:
-        """Generates an ini file of the tiles"""
-        fout = open(self._inifile, "w")
-
-        files = glob.glob(self._tilesdir + "/*.tif")
-
-        if len(files) == 0:
-            files = glob.glob(self._tilesdir + "/*.img")
-
-        fout.write("file;left;right;bottom;top;resolution_x;resolution_y;rows;columns;no_data\n")
-        for file in files:
-            r = rio.open(file)
-            fout.write(
-                "{};{};{};{};{};{};{};{};{};{}\n".format(
-                    file,
-                    r.bounds.left,
-                    r.bounds.right,
-                    r.bounds.bottom,
-                    r.bounds.top,
-                    r.res[1],
-                    r.res[0],
-                    r.meta["width"],
-                    r.meta["height"],
-                    r.meta["nodata"],
-                )
+        """Reads the catalog and updates it if the tile files have changed, the tiles given to the tileset come first"""
+        catalog = _update_catalog(self._tilesdir)
+        if len(self._given_tiles) > 0:
+            given = np.zeros(len(self._given_tiles), dtype=TILES_CATALOG_DTYPE)
+            for i, (row, tile) in enumerate(zip(given, self._given_tiles)):
+                row["filename"] = tile.filename
+                if os.path.isfile(tile.filename):
+                    stat = os.stat(tile.filename)
+                    row["mtime"], row["size"] = stat.st_mtime, stat.st_size
+                # the catalog stores the bounds of the raster like rasterio does
+                row["resolution_x"], row["resolution_y"] = tile.resolution.x, tile.resolution.y
+                row["left"] = tile.boundary.left + tile.resolution.x / 2.0
+                row["right"] = tile.boundary.right + tile.resolution.x / 2.0
+                row["bottom"] = tile.boundary.bottom - tile.resolution.y / 2.0
+                row["top"] = tile.boundary.top - tile.resolution.y / 2.0
+                row["columns"], row["rows"] = tile.shape.columns, tile.shape.rows
+                row["nodata"] = np.nan if tile.nodata is None else tile.nodata
+                self._tiles[i] = tile
+            catalog = np.concatenate([given, catalog])
+        self._set_catalog(catalog)
+
+    def _set_catalog(self, catalog: np.ndarray) -> None:
+        """Use the given catalog, builds the index and the list of tiles"""
+        self._catalog = catalog
+        self._build_index()
+        self.tiles = _TileList(self)
+
+    def _get_tile(self, i: int) -> Tile:
+        """Get the tile with the given index in the catalog, the tile object is created on first use"""
+        tile = self._tiles.get(i)
+        if tile is None:
+            row = self._catalog[i]
+            resolution = TileResolution(x=row["resolution_x"], y=row["resolution_y"])
+            tile = Tile(
+                filename=str(Path(self._tilesdir) / row["filename"]),
+                tile_type=self.tile_type,
+                access_mode=self.access_mode,
+                storage=self.storage,
+                storage_offset=self.storage_offset,
+                resolution=resolution,
+                boundary=TileBoundary(
+                    left=row["left"] - resolution.x / 2.0,
+                    right=row["right"] - resolution.x / 2.0,
+                    bottom=row["bottom"] + resolution.y / 2.0,
+                    top=row["top"] + resolution.y / 2.0,
+                ),
+                shape=TileShape(columns=row["columns"], rows=row["rows"]),
+                nodata=row["nodata"],
+            )
+            self._tiles[i] = tile
+        return tile
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        """Get the key of the grid cell that contains the given x,y coordinates"""
+        return (math.floor(x / self._cellsize), math.floor(y / self._cellsize))
+
+    def _build_index(self) -> None:
+        """Build a regular grid hash of the tiles for fast lookup
+
+        The cell size is the size of the largest tile so each tile is registered
+        in at most four cells. The tile indices per cell are kept in the order of
+        the catalog so the lookup order is the same as scanning all tiles.
+        """
+        c = self._catalog
+        rx, ry = c["resolution_x"] / 2.0, c["resolution_y"] / 2.0
+        self._bounds = np.stack(
+            [c["left"] - rx, c["right"] - rx, c["bottom"] + ry, c["top"] + ry], axis=1
+        )  # left, right, bottom, top in the same convention as Tile.boundary
+        self._index = {}
+        self._cellsize = 1.0
+        if len(c) == 0:
+            return
+
+        self._cellsize = float(
+            max(
+                np.max(self._bounds[:, 1] - self._bounds[:, 0]),
+                np.max(self._bounds[:, 3] - self._bounds[:, 2]),
+            )
+        )
+        if self._cellsize <= 0:
+            self._cellsize = 1.0
+
+        c1 = np.floor(self._bounds[:, 0] / self._cellsize).astype(np.int64)
+        c2 = np.floor(self._bounds[:, 1] / self._cellsize).astype(np.int64)
+        r1 = np.floor(self._bounds[:, 2] / self._cellsize).astype(np.int64)
+        r2 = np.floor(self._bounds[:, 3] / self._cellsize).astype(np.int64)
+        for i, (cmin, cmax, rmin, rmax) in enumerate(zip(c1.tolist(), c2.tolist(), r1.tolist(), r2.tolist())):
+            for column in range(cmin, cmax + 1):
+                for row in range(rmin, rmax + 1):
+                    self._index.setdefault((column, row), []).append(i)
+
+    def get_tile_indices(self, left: float, right: float, bottom: float, top: float) -> List[int]:
+        """Get the indices of the tiles that intersect with the given area
+
+        Args:
+            left (float): left boundary of the area
+            right (float): right boundary of the area
+            bottom (float): bottom boundary of the area
+            top (float): top boundary of the area
+
+        Returns:
+            List[int]: indices of the tiles in order of the tileset
+        """
+        c1, r1 = self._cell(left, bottom)
+        c2, r2 = self._cell(right, top)
+        candidates = set()
+        for column in range(c1, c2 + 1):
+            for row in range(r1, r2 + 1):
+                candidates.update(self._index.get((column, row), []))
+
+        result = []
+        for i in sorted(candidates):
+            tleft, tright, tbottom, ttop = self._bounds[i]
+            if tleft <= right and left <= tright and tbottom <= top and bottom <= ttop:
+                result.append(i)
+        return result
+
+    def prefetch(self, left: float, right: float, bottom: float, top: float) -> None:
+        """Load the tile data that is needed for the given area into the tile cache
+
+        Args:
+            left (float): left boundary of the area
+            right (float): right boundary of the area
+            bottom (float): bottom boundary of the area
+            top (float): top boundary of the area
+        """
+        for i in self.get_tile_indices(left, right, bottom, top):
+            self._get_tile(i).prefetch(left, right, bottom, top)
+
+    def get_tile_sources(self, left: float, right: float, bottom: float, top: float) -> List[Tuple[str, float, int]]:
+        """Get the files of the tiles that intersect with the given area
+
+        Args:
+            left (float): left boundary of the area
+            right (float): right boundary of the area
+            bottom (float): bottom boundary of the area
+            top (float): top boundary of the area
+
+        Returns:
+            List[Tuple[str, float, int]]: filename, modification time and size of the tile files
+        """
+        return [
+            (str(self._catalog[i]["filename"]), float(self._catalog[i]["mtime"]), int(self._catalog[i]["size"]))
+            for i in self.get_tile_indices(left, right, bottom, top)
+        ]
+
+    def get_tile_ids(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """Get the index of the first tile that contains each of the given x,y coordinates
+
+        Args:
+            xs (np.ndarray): x coordinates of the points
+            ys (np.ndarray): y coordinates of the points
+
+        Returns:
+            np.ndarray: indices of the tiles in the tileset, -1 for points outside of the tiles
+        """
+        result = np.full(len(xs), -1, dtype=np.int64)
+        for k, (x, y) in enumerate(zip(np.asarray(xs, dtype=float).tolist(), np.asarray(ys, dtype=float).tolist())):
+            for i in self._index.get(self._cell(x, y), []):
+                left, right, bottom, top = self._bounds[i]
+                if left <= x <= right and bottom <= y <= top:
+                    result[k] = i
+                    break
+        return result
+
+    def get_tiles(self, x: float, y: float) -> List[Tile]:
+        """Get the tiles that contain the given x,y coordinates
+
+        Args:
+            x (float): x coordinate of the point
+            y (float): y coordinate of the point
+
+        Returns:
+            List[Tile]: the tiles containing the point in order of the tileset
+        """
+        result = []
+        for i in self._index.get(self._cell(x, y), []):
+            left, right, bottom, top = self._bounds[i]
+            if left <= x <= right and bottom <= y <= top:
+                result.append(self._get_tile(i))
+        return result
+
+    def get_grid(self) -> Tuple[float, float, float, float]:
+        """Get the grid of the cell centers of the tileset
+
+        Cell (row, column) of the grid is located at (x0 + column * dx, y0 - row * dy),
+        all tiles are expected to share the grid of the first tile.
+
+        Returns:
+            Tuple[float, float, float, float]: x0, y0, dx, dy
+        """
+        if len(self._catalog) == 0:
+            raise IndexError("No tiles in this tileset")
+        tile = self._get_tile(0)
+        return tile.boundary.left, tile.boundary.top, tile.resolution.x, tile.resolution.y
+
+    def sample(self, xs: np.ndarray, ys: np.ndarray, interpolation: TileInterpolation = None) -> np.ndarray:
+        """Get the z values at the given x,y coordinates
+
+        Args:
+            xs (np.ndarray): x coordinates of the points
+            ys (np.ndarray): y coordinates of the points
+            interpolation (TileInterpolation): interpolation to use, defaults to the interpolation of the tileset
+
+        Returns:
+            np.ndarray: z coordinates of the points (np.nan if not available)
+        """
+        if interpolation is None:
+            interpolation = self.interpolation
+        if interpolation == TileInterpolation.NEAREST:
+            return self._sample_nearest(xs, ys)
+        return self._sample_interpolated(xs, ys, cubic=interpolation == TileInterpolation.CUBIC)
+
+    def _sample_interpolated(self, xs: np.ndarray, ys: np.ndarray, cubic: bool = False) -> np.ndarray:
+        """Get the bilinear or cubic interpolated z values at the given x,y coordinates
+
+        The values of the surrounding cells are found with a nearest lookup at the
+        cell centers. If the nearest cell has no data the result is np.nan, for
+        bilinear interpolation other cells without data are left out and the
+        weights of the remaining cells are scaled. Cubic interpolation falls back
+        to bilinear interpolation if one of the 16 cells has no data.
+        """
+        xs = np.asarray(xs, dtype=float)
+        ys = np.asarray(ys, dtype=float)
+        if len(self._catalog) == 0:
+            return np.full(xs.shape, np.nan)
+
+        ox, oy, rx, ry = self.get_grid()
+        fx = ((xs - ox) / rx).ravel()
+        fy = ((oy - ys) / ry).ravel()
+        ix, iy = np.floor(fx), np.floor(fy)
+        tx, ty = fx - ix, fy - iy
+
+        # bilinear, columns are the 4 surrounding cells
+        dix = np.array([0, 1, 0, 1])
+        diy = np.array([0, 0, 1, 1])
+        z = self._sample_nearest(
+            ox + (ix[:, None] + dix) * rx, oy - (iy[:, None] + diy) * ry
+        )
+        w = np.stack([(1 - tx) * (1 - ty), tx * (1 - ty), (1 - tx) * ty, tx * ty], axis=1)
+        # points without coordinates (np.nan) have no data in any of the cells
+        corner = np.round(np.nan_to_num(tx)).astype(np.int64) + 2 * np.round(np.nan_to_num(ty)).astype(np.int64)
+        nearest = z[np.arange(len(fx)), corner]
+        w = np.where(np.isnan(z), 0.0, w)
+        wsum = w.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result = np.nansum(w * z, axis=1) / wsum
+        result[np.isnan(nearest) | (wsum == 0)] = np.nan
+
+        if cubic:
+            # cubic convolution (Keys, a=-0.5), columns are the 16 surrounding cells
+            offsets = np.arange(-1, 3)
+            # rows (axis 1) are the y offsets and columns (axis 2) the x offsets of the 4x4 block
+            gx, gy = np.broadcast_arrays(
+                ox + (ix[:, None, None] + offsets[None, None, :]) * rx,
+                oy - (iy[:, None, None] + offsets[None, :, None]) * ry,
             )
-        fout.close()
-        self._read_ini()
-
-    def _read_ini(self) -> None:
-        """Read the ini file for fast access"""
-        fin = open(self._inifile)
-        lines = fin.readlines()
-        fin.close()
-        for line in lines[1:]:
-            args = [s.strip() for s in line.split(";")]
-            tile = Tile()
-            tile.filename = args[0]
-            tile.resolution.x = float(args[5])
-            tile.resolution.y = float(args[6])
-            tile.boundary.left = float(args[1]) - tile.resolution.x / 2.0
-            tile.boundary.right = float(args[2]) - tile.resolution.x / 2.0
-            tile.boundary.bottom = float(args[3]) + tile.resolution.y / 2.0
-            tile.boundary.top = float(args[4]) + tile.resolution.y / 2.0
-            tile.shape.columns = int(args[7])
-            tile.shape.rows = int(args[8])
-            tile.nodata = float(args[9])
-            self.tiles.append(tile)
+            z = self._sample_nearest(gx, gy)
+            wx, wy = self._cubic_weights(tx), self._cubic_weights(ty)
+            values = np.einsum("nij,ni,nj->n", z, wy, wx)
+            complete = ~np.isnan(z).any(axis=(1, 2))
+            result[complete] = values[complete]
+
+        return result.reshape(xs.shape)
+
+    @staticmethod
+    def _cubic_weights(t: np.ndarray) -> np.ndarray:
+        """Weights of the cells at offsets -1, 0, 1, 2 for cubic convolution"""
+        t2, t3 = t * t, t * t * t
+        return np.stack(
+            [
+                -0.5 * t3 + t2 - 0.5 * t,
+                1.5 * t3 - 2.5 * t2 + 1.0,
+                -1.5 * t3 + 2.0 * t2 + 0.5 * t,
+                0.5 * t3 - 0.5 * t2,
+            ],
+            axis=1,
+        )
+
+    def _sample_nearest(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """Get the z values of the nearest cells at the given x,y coordinates
+
+        The points are grouped per grid cell and per tile so each tile is indexed
+        only once. If a tile has no data for a point the next tile containing the
+        point is used.
+        """
+        xs = np.asarray(xs, dtype=float)
+        ys = np.asarray(ys, dtype=float)
+        result = np.full(xs.shape, np.nan)
+        if len(self._index) == 0:
+            return result
+
+        flat_xs, flat_ys, flat_result = xs.ravel(), ys.ravel(), result.ravel()
+        ids = np.flatnonzero(np.isfinite(flat_xs) & np.isfinite(flat_ys))
+        if len(ids) == 0:
+            return result
+
+        columns = np.floor(flat_xs[ids] / self._cellsize).astype(np.int64)
+        rows = np.floor(flat_ys[ids] / self._cellsize).astype(np.int64)
+        cells, inverse = np.unique(np.stack([columns, rows], axis=1), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        order = np.argsort(inverse, kind="stable")
+        splits = np.cumsum(np.bincount(inverse, minlength=len(cells)))[:-1]
+
+        for (column, row), cell_ids in zip(cells, np.split(ids[order], splits)):
+            for i in self._index.get((int(column), int(row)), []):
+                todo = cell_ids[np.isnan(flat_result[cell_ids])]
+                if len(todo) == 0:
+                    break
+                left, right, bottom, top = self._bounds[i]
+                x, y = flat_xs[todo], flat_ys[todo]
+                inside = (left <= x) & (x <= right) & (bottom <= y) & (y <= top)
+                if np.any(inside):
+                    flat_result[todo[inside]] = self._get_tile(i).get_values(x[inside], y[inside])
+
+        return flat_result.reshape(xs.shape)
 
     def get_point3d(self, x: float, y: float) -> Point3D:
         """Generate a point at x, y and fill in the z based on the tile data
@@ -181,16 +967,8 @@ class Tileset:
         Returns:
             Point3D: point with the z coordinate filled in (or np.nan if not available)
         """
-        for tile in self.tiles:
-            if (
-                tile.boundary.left <= x <= tile.boundary.right
-                and tile.boundary.bottom <= y <= tile.boundary.top
-            ):
-                z = tile.get_z(x, y)
-                if z is not None:
-                    return Point3D(x=x, y=y, z=z)
-        return Point3D(x=x, y=y, z=np.nan)
-
+        z = self.sample(np.array([x]), np.array([y]))[0]
+        return Point3D(x=x, y=y, z=z)
 
 if __name__ == "__main__":
     ts = Tileset(tile_type=TileType.HYDRAULIC_HEAD)
@@ -0,0 +1,119 @@
+import numpy as np
+
+from typing import List, Tuple
+
+
+def rdp_mask(l: np.ndarray, z: np.ndarray, epsilon: float, counts: np.ndarray = None) -> np.ndarray:
+    """Ramer-Douglas-Peucker simplification of a batch of lines
+
+    Each row of l and z is a line, only the first counts[i] points of row i are
+    used. Instead of recursing per line all segments of all lines are split at
+    once, a segment is split at the point with the largest perpendicular distance
+    (the first one if there are more) if that distance is larger than epsilon.
+    The result is the same as simplifying each line on its own.
+
+    Args:
+        l (np.ndarray): (lines x points) matrix with the l coordinates
+        z (np.ndarray): (lines x points) matrix with the z coordinates
+        epsilon (float): maximum distance of the removed points to the simplified line
+        counts (np.ndarray): number of points per line, defaults to all points
+
+    Returns:
+        np.ndarray: (lines x points) boolean matrix, True for the points to keep
+    """
+    l = np.atleast_2d(np.asarray(l, dtype=float))
+    z = np.atleast_2d(np.asarray(z, dtype=float))
+    n, m = l.shape
+    if counts is None:
+        counts = np.full(n, m)
+    counts = np.asarray(counts, dtype=np.int64)
+
+    rows = np.arange(n)
+    columns = np.arange(m)
+    valid = columns < counts[:, None]
+    keep = np.zeros((n, m), dtype=bool)
+    keep[rows[counts > 0], 0] = True
+    keep[rows[counts > 0], counts[counts > 0] - 1] = True
+
+    while True:
+        # the kept points before and after each point are the ends of its segment
+        a = np.maximum.accumulate(np.where(keep, columns, 0), axis=1)
+        b = np.minimum.accumulate(np.where(keep, columns, m - 1)[:, ::-1], axis=1)[:, ::-1]
+        la, za = np.take_along_axis(l, a, axis=1), np.take_along_axis(z, a, axis=1)
+        lb, zb = np.take_along_axis(l, b, axis=1), np.take_along_axis(z, b, axis=1)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            length = np.hypot(lb - la, zb - za)
+            d = np.where(
+                length > 0,
+                np.abs((lb - la) * (za - z) - (la - l) * (zb - za)) / length,
+                np.hypot(l - la, z - za),
+            )
+        d[~valid | keep | np.isnan(d)] = -np.inf
+
+        # the largest distance per segment, segments are contiguous in the flattened matrix
+        segments = (rows[:, None] * m + a).ravel()
+        d = d.ravel()
+        starts = np.flatnonzero(np.r_[True, segments[1:] != segments[:-1]])
+        dmax = np.repeat(np.maximum.reduceat(d, starts), np.diff(np.r_[starts, len(d)]))
+
+        candidates = np.flatnonzero((d == dmax) & (d > epsilon))
+        if len(candidates) == 0:
+            return keep
+
+        # first point with the largest distance of each segment
+        _, first = np.unique(segments[candidates], return_index=True)
+        keep.ravel()[candidates[first]] = True
+
+
+def valid_runs(z: np.ndarray, counts: np.ndarray = None) -> List[List[Tuple[int, int]]]:
+    """Find the runs of consecutive values that are not np.nan in a batch of lines
+
+    Each row of z is a line, only the first counts[i] values of row i are used.
+
+    Args:
+        z (np.ndarray): (lines x points) matrix with the values
+        counts (np.ndarray): number of points per line, defaults to all points
+
+    Returns:
+        List[List[Tuple[int, int]]]: per line the start and end (exclusive) index of each run
+    """
+    z = np.atleast_2d(np.asarray(z, dtype=float))
+    n, m = z.shape
+    valid = ~np.isnan(z)
+    if counts is not None:
+        valid &= np.arange(m) < np.asarray(counts)[:, None]
+
+    # a run starts where the padded mask goes from False to True and ends where it goes back
+    edges = np.diff(np.pad(valid, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+
+    result = [[] for _ in range(n)]
+    for row, start, end in zip(rows.tolist(), starts.tolist(), ends.tolist()):
+        result[row].append((start, end))
+    return result
+
+
+def round_values(values: np.ndarray, ndigits: int = 2) -> np.ndarray:
+    """Round the values like the builtin round does
+
+    np.round scales the values by 10 ** ndigits before rounding so a value just
+    below a half, for example 479927.27499999997, can be rounded up where round
+    rounds it down. Only the values close to a half are rounded with round.
+
+    Args:
+        values (np.ndarray): the values
+        ndigits (int): number of decimals
+
+    Returns:
+        np.ndarray: the rounded values
+    """
+    values = np.asarray(values, dtype=float)
+    scaled = values * 10.0 ** ndigits
+    result = np.array(np.round(values, ndigits))
+    with np.errstate(invalid="ignore"):
+        near_half = np.abs(scaled - np.floor(scaled) - 0.5) <= 1e-9 * np.maximum(np.abs(scaled), 1.0)
+    if np.any(near_half):
+        result[near_half] = [round(value, ndigits) for value in values[near_half].tolist()]
+    return result
@@ -0,0 +1,205 @@
+import queue
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+
+_DONE = object()  # sentinel that tells a worker that its input is exhausted
+
+
+class Stage:
+    """A stage of a pipeline
+
+    The function is called with each item of the previous stage, its result is
+    passed to the next stage. If the function returns None the item is dropped.
+    If batch_size is set the function is called with lists of at most batch_size
+    items (the last list of each worker can be shorter) and returns a list with
+    the results of the items.
+
+    Args:
+        name (str): name of the stage (used in error messages)
+        function (Callable[[Any], Any]): the function of the stage
+        workers (int): number of items that are handled at the same time
+        processes (bool): run the function in worker processes instead of threads, use this for
+            CPU-bound stages like matplotlib plotting (the function and the items need to be picklable)
+        batch_size (int): optional, call the function with lists of items instead of single items
+    """
+
+    def __init__(
+        self,
+        name: str,
+        function: Callable[[Any], Any],
+        workers: int = 1,
+        processes: bool = False,
+        batch_size: int = None,
+    ):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.processes = processes
+        self.batch_size = batch_size
+
+
+class Pipeline:
+    """A pipeline of stages connected by bounded queues
+
+    Each stage has its own worker threads, so all stages work at the same time
+    and the throughput is set by the slowest stage. A full queue blocks the
+    previous stage (backpressure) so the number of items in the pipeline is
+    limited by queue_size. If a stage raises an exception the pipeline stops
+    and the exception is raised by run. A pipeline can be run again, but not
+    by two threads at the same time.
+
+    Args:
+        stages (List[Stage]): the stages in order
+        queue_size (int): maximum number of items waiting in front of each stage
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = 16):
+        self.stages = stages
+        self.queue_size = queue_size
+        self._error: Optional[Tuple[str, BaseException]] = None
+        self._failed = threading.Event()
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _put(self, q: queue.Queue, item: Any) -> bool:
+        """Put an item in a queue, gives up (returns False) if the pipeline failed"""
+        while not self._failed.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q: queue.Queue) -> Any:
+        """Get an item from a queue, returns _DONE if the pipeline failed"""
+        while not self._failed.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def _fail(self, name: str, error: BaseException) -> None:
+        """Stop the pipeline, the first error is raised by run"""
+        with self._lock:
+            if not self._failed.is_set():
+                self._error = (name, error)
+                self._failed.set()
+
+    def _feed(self, source: Iterable[Any], q: queue.Queue) -> None:
+        """Thread that puts the items of the source in the queue of the first stage"""
+        try:
+            for item in source:
+                if not self._put(q, item):
+                    return
+        except BaseException as e:
+            self._fail("source", e)
+        finally:
+            # stops a generator that is left early, like CrosssectionCreator.iter_execute
+            if hasattr(source, "close"):
+                source.close()
+
+    def _call(self, stage: Stage, executor: ProcessPoolExecutor, item: Any) -> Any:
+        """Call the function of a stage in this thread or in the executor"""
+        if executor is not None:
+            return executor.submit(stage.function, item).result()
+        return stage.function(item)
+
+    def _emit(self, result: Any, q_out: Optional[queue.Queue]) -> bool:
+        """Pass a result to the next stage, returns False if the pipeline failed"""
+        if result is None:
+            return True
+        if q_out is None:
+            with self._lock:
+                self._count += 1
+            return True
+        return self._put(q_out, result)
+
+    def _work(
+        self, stage: Stage, executor: ProcessPoolExecutor, q_in: queue.Queue, q_out: Optional[queue.Queue]
+    ) -> None:
+        """Worker thread of a stage"""
+        batch = []
+        while True:
+            item = self._get(q_in)
+            if item is not _DONE:
+                if stage.batch_size is None:
+                    batch = [item]
+                else:
+                    batch.append(item)
+                    if len(batch) < stage.batch_size:
+                        continue
+            elif len(batch) == 0 or self._failed.is_set():
+                return
+
+            try:
+                if stage.batch_size is None:
+                    results = [self._call(stage, executor, batch[0])]
+                else:
+                    results = self._call(stage, executor, batch)
+            except BaseException as e:
+                self._fail(stage.name, e)
+                return
+            batch = []
+
+            for result in results:
+                if not self._emit(result, q_out):
+                    return
+            if item is _DONE:
+                return
+
+    def run(self, source: Iterable[Any]) -> int:
+        """Pass all items of the source through the stages
+
+        Args:
+            source (Iterable[Any]): the items for the first stage
+
+        Returns:
+            int: the number of items that came out of the last stage
+        """
+        # the state of a previous run
+        self._error = None
+        self._failed.clear()
+        self._count = 0
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        executors = [
+            ProcessPoolExecutor(max_workers=stage.workers) if stage.processes else None for stage in self.stages
+        ]
+
+        try:
+            feeder = threading.Thread(target=self._feed, args=(source, queues[0]), daemon=True)
+            feeder.start()
+            threads = []
+            for i, stage in enumerate(self.stages):
+                q_out = queues[i + 1] if i + 1 < len(self.stages) else None
+                threads.append(
+                    [
+                        threading.Thread(target=self._work, args=(stage, executors[i], queues[i], q_out), daemon=True)
+                        for _ in range(stage.workers)
+                    ]
+                )
+                for thread in threads[-1]:
+                    thread.start()
+
+            # a stage is done if the previous stage is done and its queue is empty
+            feeder.join()
+            for i, stage_threads in enumerate(threads):
+                for _ in stage_threads:
+                    self._put(queues[i], _DONE)
+                for thread in stage_threads:
+                    thread.join()
+        finally:
+            self._failed.set()  # stops the threads that are still waiting
+            for executor in executors:
+                if executor is not None:
+                    executor.shutdown(wait=True)
+
+        if self._error is not None:
+            name, error = self._error
+            raise RuntimeError(f"Error in pipeline stage '{name}': {error}") from error
+        return self._count
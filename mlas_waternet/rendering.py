@@ -0,0 +1,249 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from enum import IntEnum
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from mlas.objects.crosssection import Crosssection
+
+from mlas_waternet import thumbnails
+
+
+class PlotType(IntEnum):
+    CROSSSECTION = 0
+    STBU = 1
+
+
+class RenderMode(IntEnum):
+    FIGURE = 0  # matplotlib figures
+    THUMBNAIL = 1  # small images drawn with numpy, see thumbnails.py
+
+
+PLOT_FIGSIZE = (20, 10)  # size of the figures in inches
+PLOT_DPI = 100
+PLOT_PNG_COMPRESSLEVEL = 1  # zlib level of the png files, encoding at the default level takes half of the render time
+
+
+# the template figures of a render process, see _get_template
+_TEMPLATES: Dict[PlotType, dict] = {}
+
+
+def _lines_to_xy(lines: List[List[Tuple[float, float]]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Join lines into one x, y array separated by np.nan so they can be drawn by one artist"""
+    if len(lines) == 0:
+        return np.zeros(0), np.zeros(0)
+    points = []
+    for line in lines:
+        points += list(line) + [(np.nan, np.nan)]
+    xy = np.array(points[:-1], dtype=float).reshape(-1, 2)
+    return xy[:, 0], xy[:, 1]
+
+
+def _get_template(plot_type: PlotType) -> dict:
+    """Get the template figure of the plot type, the figure is created on first use in this process
+
+    The figure is drawn on an Agg canvas without pyplot so no global matplotlib
+    state (or gui backend) is involved. The artists of the template are updated
+    for each plot instead of creating a new figure.
+    """
+    template = _TEMPLATES.get(plot_type)
+    if template is not None:
+        return template
+
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=PLOT_FIGSIZE, dpi=PLOT_DPI)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.grid(which="both")
+    fig.subplots_adjust(left=0.04, right=0.99, bottom=0.05, top=0.95)
+
+    template = {"figure": fig, "axes": ax, "patches": []}
+    if plot_type == PlotType.STBU:
+        template["profile"] = ax.plot([], [], "k--", zorder=3)[0]
+        template["leveeline"] = ax.plot([], [], "k", zorder=3)[0]
+        template["minline"] = ax.plot([], [], "g--", zorder=3)[0]
+    else:
+        # the crosssection figures are plotted by mlas, see _plot_crosssection
+        raise ValueError(f"No template for plot type {plot_type}")
+
+    _TEMPLATES[plot_type] = template
+    return template
+
+
+def _set_rectangles(template: dict, rectangles: List[Tuple[float, float, float, float, str]]) -> None:
+    """Show the given rectangles (x, y, width, height, facecolor) with the patches of the template"""
+    from matplotlib.patches import Rectangle
+
+    patches = template["patches"]
+    while len(patches) < len(rectangles):
+        patches.append(template["axes"].add_patch(Rectangle((0, 0), 0, 0, fill=True, visible=False)))
+    for patch, (x, y, width, height, facecolor) in zip(patches, rectangles):
+        patch.set_bounds(x, y, width, height)
+        patch.set_facecolor(facecolor)
+        patch.set_visible(True)
+    for patch in patches[len(rectangles):]:
+        patch.set_visible(False)
+
+
+def _render(plot_type: PlotType, data: dict, filename: str) -> str:
+    """Render a plot with the template of the plot type and save it as png (runs in a render process)"""
+    template = _get_template(plot_type)
+    ax = template["axes"]
+
+    if plot_type == PlotType.STBU:
+        template["profile"].set_data(data["l"], data["z"])
+        template["leveeline"].set_data(*_lines_to_xy([data["leveeline"]]))
+        template["minline"].set_data(*_lines_to_xy([data["minline"]]))
+        template["minline"].set_color("g" if data["result"] else "r")
+
+    _set_rectangles(template, data.get("rectangles", []))
+    ax.set_title(data.get("title", ""))
+    ax.relim(visible_only=True)
+    ax.autoscale_view()
+
+    Path(filename).parent.mkdir(parents=True, exist_ok=True)
+    template["figure"].savefig(filename, pil_kwargs={"compress_level": PLOT_PNG_COMPRESSLEVEL})
+    return str(filename)
+
+
+def _initialize_worker() -> None:
+    """Initializer of the render processes, Crosssection.plot uses pyplot so select the non interactive backend"""
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def _plot_crosssection(crosssection: Crosssection, filepath: str) -> str:
+    """Plot a crosssection with Crosssection.plot and return the filename (runs in a render process)"""
+    return str(Path(crosssection.plot(filepath=filepath)).resolve())
+
+
+def _render_thumbnail(plot_type: PlotType, data: dict, filename: str) -> str:
+    """Draw the thumbnail of a plot and save it as png (runs in a render process)"""
+    if plot_type == PlotType.CROSSSECTION:
+        return thumbnails.render_crosssection(data, filename)
+    elif plot_type == PlotType.STBU:
+        return thumbnails.render_stbu(data, filename)
+    raise ValueError(f"Unknown plot type {plot_type}")
+
+
+class RenderService:
+    """Renders the plots in a pool of processes with reusable template figures
+
+    Creating a matplotlib figure for each plot takes most of the time of a
+    plot, each render process keeps a template figure for the STBU plots and
+    only updates the data of the lines and patches. Only the plot data is sent to
+    the processes. Use as a context manager or call close when done.
+
+    The crosssection figures are plotted with Crosssection.plot of mlas in the
+    render processes, so they keep the file names and the look of the mlas plots.
+    The render processes use the Agg backend of matplotlib.
+
+    In thumbnail mode the plots are small images that are drawn directly with
+    numpy (see thumbnails.py) which is much faster than matplotlib, use it if
+    the plots are only needed to check the results.
+
+    Args:
+        workers (int): number of render processes
+        mode (RenderMode): render matplotlib figures or thumbnails
+    """
+
+    def __init__(self, workers: int = 2, mode: RenderMode = RenderMode.FIGURE):
+        self.workers = workers
+        self.mode = mode
+        self._executor = ProcessPoolExecutor(max_workers=workers, initializer=_initialize_worker)
+
+    def __enter__(self) -> "RenderService":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Wait for the pending plots and stop the render processes"""
+        self._executor.shutdown(wait=True)
+
+    def submit(self, plot_type: PlotType, data: dict, filename: str) -> Future:
+        """Render a plot
+
+        Args:
+            plot_type (PlotType): the type of plot
+            data (dict): the data of the plot (see render_crosssection and render_stbu)
+            filename (str): the png file to write
+
+        Returns:
+            Future: the future of the filename of the plot
+        """
+        render = _render_thumbnail if self.mode == RenderMode.THUMBNAIL else _render
+        return self._executor.submit(render, plot_type, data, str(filename))
+
+    def render_crosssection(self, crosssection: Crosssection, filepath: str) -> Future:
+        """Plot a crosssection with its ditches and waterbottoms
+
+        Args:
+            crosssection (Crosssection): the crosssection
+            filepath (str): the directory of the plots
+
+        Returns:
+            Future: the future of the filename of the plot
+        """
+        if self.mode == RenderMode.FIGURE:
+            return self._executor.submit(_plot_crosssection, crosssection, str(filepath))
+
+        data = {
+            "title": f"{crosssection.levee_code} chainage {crosssection.levee_chainage}",
+            "l": [p.l for p in crosssection.points],
+            "z": [p.z for p in crosssection.points],
+            "reference_point": [crosssection.reference_point.l, crosssection.reference_point.z],
+            "ditches": [[(p.x, p.z) for p in ditch] for ditch in crosssection.ditches],
+            "waterbottoms": [[(p.x, p.z) for p in waterbottom] for waterbottom in crosssection.waterbottoms],
+        }
+        return self.submit(PlotType.CROSSSECTION, data, get_plot_filename(filepath, crosssection))
+
+    def render_stbu(
+        self,
+        crosssection: Crosssection,
+        leveeline: List[Tuple[float, float]],
+        minline: List[Tuple[float, float]],
+        result: bool,
+        rectangles: List[Tuple[float, float, float, float, str]],
+        filename: str,
+    ) -> Future:
+        """Plot the simple STBU assessment of a crosssection
+
+        Args:
+            crosssection (Crosssection): the crosssection
+            leveeline (List[Tuple[float, float]]): the checked part of the crosssection
+            minline (List[Tuple[float, float]]): the minimum line
+            result (bool): result of the check, the minimum line is green if True and red if False
+            rectangles (List[Tuple[float, float, float, float, str]]): soil layers as x, y, width, height and color
+            filename (str): the png file to write
+
+        Returns:
+            Future: the future of the filename of the plot
+        """
+        data = {
+            "l": [p.l for p in crosssection.points],
+            "z": [p.z for p in crosssection.points],
+            "leveeline": leveeline,
+            "minline": minline,
+            "result": result,
+            "rectangles": rectangles,
+        }
+        return self.submit(PlotType.STBU, data, filename)
+
+
+def get_plot_filename(filepath: str, crosssection: Crosssection) -> Path:
+    """Get the filename of the thumbnail of a crosssection
+
+    Args:
+        filepath (str): the directory of the plots
+        crosssection (Crosssection): the crosssection
+
+    Returns:
+        Path: the filename
+    """
+    return Path(filepath).resolve() / f"{crosssection.levee_code}_{crosssection.levee_chainage:05d}.png"
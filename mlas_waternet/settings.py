@@ -5,7 +5,8 @@ SETTINGS = {
     "filepath_waterbodem":"C:/Users/brein/Documents/Waternet/Toetsing2024/Input/rasterbestanden/boezembodem",
     "filepath_hydraulic_head":"C:/Users/brein/Documents/Waternet/Toetsing2024/Input/rasterbestanden/stijghoogte",
     "cpt_path":"C:/Users/brein/Documents/Waternet/Toetsing2024/Input/grondonderzoek/sonderingen",
-    "project_path":"C:/Users/brein/Documents/Waternet/Toetsing2024/Projecten"
+    "project_path":"C:/Users/brein/Documents/Waternet/Toetsing2024/Projecten",
+    "tile_cache_bytes":2 * 1024 ** 3 # memory budget for the decoded tiles per tile type
 }
 
 INPUT_DATABASE_TABLES = {
@@ -14,9 +15,13 @@ INPUT_DATABASE_TABLES = {
 
 OUTPUT_PATHS = {
     "crosssections_json":"C:/Users/brein/Documents/Waternet/Toetsing2024/output/crosssections/json",  
+    "crosssections_store":"C:/Users/brein/Documents/Waternet/Toetsing2024/output/crosssections/store",
     "crosssection_plots":"C:/Users/brein/Documents/Waternet/Toetsing2024/output/crosssections/plots",
     "crosssection_shapes":"C:/Users/brein/Documents/Waternet/Toetsing2024/output/crosssections/gis",
-    "stbu_simple_assessment":"C:/Users/brein/Documents/Waternet/Toetsing2024/output/stbu/simple"
+    "stbu_simple_assessment":"C:/Users/brein/Documents/Waternet/Toetsing2024/output/stbu/simple",
+    "corridor_mosaics":"C:/Users/brein/Documents/Waternet/Toetsing2024/output/corridors",
+    "ditch_indices":"C:/Users/brein/Documents/Waternet/Toetsing2024/output/ditches",
+    "batch_checkpoints":"C:/Users/brein/Documents/Waternet/Toetsing2024/output/crosssections/checkpoints"
 }
 
 LOG_FILES = {
@@ -4,8 +4,6 @@ import math
 from shapely.geometry import LineString
 from tqdm import tqdm
 
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
 from pathlib import Path
 
 from mlas.objects.cpt import CPT
@@ -16,6 +14,7 @@ from mlas.settings import SOILCOLORS
 
 from mlas_waternet.dataproviders.inputdatabase import DBInput
 from mlas_waternet.settings import OUTPUT_PATHS
+from mlas_waternet.rendering import RenderMode, RenderService
 
 class STBUSimple_Input(BaseModel):
     chainage_start: int = 0
@@ -43,6 +42,8 @@ class STBUSimpleAssessment(BaseModel):
     log_path: str    
 
     db: DBInput = None
+    render_workers: int = 2 # number of processes that render the plots
+    render_mode: RenderMode = RenderMode.FIGURE # use RenderMode.THUMBNAIL for fast small plots
 
     def _find_closest_cpt(self, point: Point3D):
         dlmin = 1e9
@@ -56,13 +57,16 @@ class STBUSimpleAssessment(BaseModel):
         return result
 
 
-    def _handle_stbu_input(self, stbu_input: STBUSimple_Input) -> None:
+    def _handle_stbu_input(self, stbu_input: STBUSimple_Input, render_service: RenderService) -> None:
         # get all crosssections that are part of the stbu input definition
         crosssections = [crs for crs in self.db.get_crosssections(self.levee_code) if \
             crs.levee_chainage >= stbu_input.chainage_start and crs.levee_chainage <= stbu_input.chainage_end]
 
-        # handle each crosssection
+        # handle each crosssection, the results are stored as soon as their plot is written
+        pending = []
         for crosssection in tqdm(crosssections):
+            pending = self._store_results(pending)
+
             # get the closest cpt
             cpt = self._find_closest_cpt(crosssection.reference_point)
             if cpt is None:
@@ -108,55 +112,51 @@ class STBUSimpleAssessment(BaseModel):
             stbr.result = not minline.intersects(leveeline)
             
 
-            if stbr.result == False:
-                color = 'r--'
-            else:
-                color = 'g--'     
-
-            # create visual output           
-            fig = plt.figure(figsize=(20, 10))
-            ax = fig.add_subplot()
-
-            ax.grid(which="both")
-
-            # plot the crosssection (dashed)
-            ax.plot([p.l for p in crosssection.points], [p.z for p in crosssection.points], 'k--')
-            # and the line we are checking
-            ax.plot([p[0] for p in levee_line_points], [p[1] for p in levee_line_points], 'k')
-            # plot the minimum line
-            ax.plot(xs, zs, color)
-
-            # plot the soilprofile
-            for soillayer in soillayers:
-                facecolor = SOILCOLORS[soillayer.soil_code]
-                ax.add_patch(
-                    patches.Rectangle(
-                        (0, soillayer.z_bottom),
-                        crosssection.reference_point.l,
-                        soillayer.height,
-                        fill=True,
-                        facecolor=facecolor,
-                    )
-                )           
-
-            plt.tight_layout()
-            
-            # save 
+            # create visual output in the render processes
             filename = f"{crosssection.levee_code}_{crosssection.levee_chainage:05d}.png"
             path = Path(self.plots_path).resolve() / filename
             stbr.logfile = ""
             stbr.imgfile = str(path)
-            plt.savefig(path)
-            plt.close()
-
-            # add to database
-            self.db.add_stbusimple(stbr)
+            future = render_service.render_stbu(
+                crosssection,
+                leveeline=levee_line_points,
+                minline=list(zip(xs, zs)),
+                result=stbr.result,
+                rectangles=[
+                    (0, soillayer.z_bottom, crosssection.reference_point.l, soillayer.height, SOILCOLORS[soillayer.soil_code])
+                    for soillayer in soillayers
+                ],
+                filename=path,
+            )
+            pending.append((stbr, future))
+
+        self._store_results(pending, wait=True)
+
+    def _store_results(self, pending: list, wait: bool = False) -> list:
+        """Add the results whose plot is written to the database
+
+        Args:
+            pending (list): the results with the future of their plot
+            wait (bool): wait for the plots that are not written yet
+
+        Returns:
+            list: the results whose plot is not written yet
+        """
+        remaining = []
+        for stbr, future in pending:
+            if wait or future.done():
+                future.result()
+                self.db.add_stbusimple(stbr)
+            else:
+                remaining.append((stbr, future))
+        return remaining
 
 
     def execute(self) -> None:
         if self.db is None: self.db = DBInput()
-        for stbu_input in self.stbu_inputs:
-            self._handle_stbu_input(stbu_input)
+        with RenderService(workers=self.render_workers, mode=self.render_mode) as render_service:
+            for stbu_input in self.stbu_inputs:
+                self._handle_stbu_input(stbu_input, render_service)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,242 @@
+import struct
+import zlib
+import numpy as np
+
+from pathlib import Path
+from typing import List, Tuple, Union
+
+
+THUMBNAIL_WIDTH = 400  # pixels
+THUMBNAIL_HEIGHT = 200  # pixels
+THUMBNAIL_MARGIN = 4  # pixels between the data and the edge of the image
+THUMBNAIL_PNG_COMPRESSLEVEL = 6
+
+Color = Union[str, Tuple[float, float, float]]
+
+COLORS = {
+    "k": (0, 0, 0),
+    "r": (220, 0, 0),
+    "g": (0, 160, 0),
+    "b": (0, 0, 220),
+    "c": (0, 190, 190),
+    "w": (255, 255, 255),
+    "grey": (220, 220, 220),
+}
+
+
+def to_rgb(color: Color) -> Tuple[int, int, int]:
+    """Convert a color to 8 bit rgb
+
+    Args:
+        color (Color): one of COLORS, a hex string (#rrggbb), rgb floats (0..1) or any matplotlib color if matplotlib is available
+
+    Returns:
+        Tuple[int, int, int]: the rgb values
+    """
+    if isinstance(color, str):
+        if color in COLORS:
+            return COLORS[color]
+        if color.startswith("#") and len(color) == 7:
+            return tuple(int(color[i : i + 2], 16) for i in (1, 3, 5))
+        from matplotlib.colors import to_rgb as mpl_to_rgb
+
+        color = mpl_to_rgb(color)
+    return tuple(int(round(255 * c)) for c in color[:3])
+
+
+def write_png(filename: str, image: np.ndarray, compress_level: int = THUMBNAIL_PNG_COMPRESSLEVEL) -> None:
+    """Write an rgb image as png
+
+    Args:
+        filename (str): the filename
+        image (np.ndarray): (height x width x 3) uint8 image
+        compress_level (int): zlib compression level
+    """
+    height, width, _ = image.shape
+    # every row starts with the filter type (0, none)
+    raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    raw[:, 1:] = image.reshape(height, width * 3)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    with open(filename, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw.tobytes(), compress_level)))
+        f.write(chunk(b"IEND", b""))
+
+
+class Thumbnail:
+    """A small rgb image with world coordinates to draw lines and rectangles in
+
+    Args:
+        xmin (float): world coordinate of the left side
+        xmax (float): world coordinate of the right side
+        ymin (float): world coordinate of the bottom
+        ymax (float): world coordinate of the top
+        width (int): width in pixels
+        height (int): height in pixels
+    """
+
+    def __init__(
+        self,
+        xmin: float,
+        xmax: float,
+        ymin: float,
+        ymax: float,
+        width: int = THUMBNAIL_WIDTH,
+        height: int = THUMBNAIL_HEIGHT,
+    ):
+        self.image = np.full((height, width, 3), 255, dtype=np.uint8)
+        self.width, self.height = width, height
+        self._x0, self._y0 = xmin, ymin
+        self._sx = (width - 1 - 2 * THUMBNAIL_MARGIN) / max(xmax - xmin, 1e-9)
+        self._sy = (height - 1 - 2 * THUMBNAIL_MARGIN) / max(ymax - ymin, 1e-9)
+
+    def _to_pixels(self, xs: np.ndarray, ys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Convert world coordinates to (float) pixel columns and rows"""
+        columns = THUMBNAIL_MARGIN + (np.asarray(xs, dtype=float) - self._x0) * self._sx
+        rows = self.height - 1 - THUMBNAIL_MARGIN - (np.asarray(ys, dtype=float) - self._y0) * self._sy
+        return columns, rows
+
+    def _set(self, columns: np.ndarray, rows: np.ndarray, color: Color) -> None:
+        """Set the color of the given pixels, pixels outside of the image are skipped"""
+        columns = np.round(columns).astype(np.int64)
+        rows = np.round(rows).astype(np.int64)
+        inside = (columns >= 0) & (columns < self.width) & (rows >= 0) & (rows < self.height)
+        self.image[rows[inside], columns[inside]] = to_rgb(color)
+
+    def rectangle(self, x: float, y: float, width: float, height: float, color: Color) -> None:
+        """Fill a rectangle
+
+        Args:
+            x (float): left side of the rectangle
+            y (float): bottom of the rectangle
+            width (float): width of the rectangle
+            height (float): height of the rectangle
+            color (Color): fill color
+        """
+        (c1, c2), (r2, r1) = self._to_pixels([x, x + width], [y, y + height])
+        c1, c2 = sorted((int(np.clip(round(c1), 0, self.width)), int(np.clip(round(c2) + 1, 0, self.width))))
+        r1, r2 = sorted((int(np.clip(round(r1), 0, self.height)), int(np.clip(round(r2) + 1, 0, self.height))))
+        self.image[r1:r2, c1:c2] = to_rgb(color)
+
+    def polyline(self, xs: List[float], ys: List[float], color: Color, dash: int = 0) -> None:
+        """Draw a line through the given points, np.nan values break the line
+
+        All segments are drawn at once, each segment is sampled at every pixel
+        along its longest direction.
+
+        Args:
+            xs (List[float]): x coordinates of the points
+            ys (List[float]): y coordinates of the points
+            color (Color): line color
+            dash (int): length of the dashes in pixels, 0 for a solid line
+        """
+        columns, rows = self._to_pixels(xs, ys)
+        if len(columns) == 0:
+            return
+        if len(columns) == 1:
+            self._set(columns, rows, color)
+            return
+
+        c1, c2, r1, r2 = columns[:-1], columns[1:], rows[:-1], rows[1:]
+        valid = np.isfinite(c1) & np.isfinite(c2) & np.isfinite(r1) & np.isfinite(r2)
+        c1, c2, r1, r2 = c1[valid], c2[valid], r1[valid], r2[valid]
+        steps = np.ceil(np.maximum(np.abs(c2 - c1), np.abs(r2 - r1))).astype(np.int64) + 1
+        # limit the number of samples for segments far outside of the image
+        steps = np.minimum(steps, 4 * (self.width + self.height))
+
+        segment = np.repeat(np.arange(len(steps)), steps)
+        t = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / np.maximum(steps[segment] - 1, 1)
+        line_columns = c1[segment] + t * (c2 - c1)[segment]
+        line_rows = r1[segment] + t * (r2 - r1)[segment]
+        if dash > 0:
+            on = (np.arange(len(t)) // dash) % 2 == 0
+            line_columns, line_rows = line_columns[on], line_rows[on]
+        self._set(line_columns, line_rows, color)
+
+    def points(self, xs: List[float], ys: List[float], color: Color, radius: int = 2) -> None:
+        """Draw square markers at the given points
+
+        Args:
+            xs (List[float]): x coordinates of the points
+            ys (List[float]): y coordinates of the points
+            color (Color): marker color
+            radius (int): half the size of the markers in pixels
+        """
+        columns, rows = self._to_pixels(xs, ys)
+        dc, dr = np.meshgrid(np.arange(-radius, radius + 1), np.arange(-radius, radius + 1))
+        self._set((columns[:, None] + dc.ravel()).ravel(), (rows[:, None] + dr.ravel()).ravel(), color)
+
+    def save(self, filename: str) -> str:
+        """Write the thumbnail as png
+
+        Args:
+            filename (str): the filename
+
+        Returns:
+            str: the filename
+        """
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        write_png(filename, self.image)
+        return str(filename)
+
+
+def _get_extent(lines: List[Tuple[List[float], List[float]]], rectangles: List[Tuple[float, float, float, float, Color]]):
+    """Get the extent (xmin, xmax, ymin, ymax) of the lines and rectangles with 5% extra space"""
+    xs = [np.asarray(x, dtype=float) for x, _ in lines]
+    ys = [np.asarray(y, dtype=float) for _, y in lines]
+    for x, y, width, height, _ in rectangles:
+        xs.append(np.array([x, x + width], dtype=float))
+        ys.append(np.array([y, y + height], dtype=float))
+    xs = np.concatenate(xs) if len(xs) > 0 else np.zeros(0)
+    ys = np.concatenate(ys) if len(ys) > 0 else np.zeros(0)
+    xs, ys = xs[np.isfinite(xs)], ys[np.isfinite(ys)]
+    if len(xs) == 0 or len(ys) == 0:
+        return 0.0, 1.0, 0.0, 1.0
+    dx = max(xs.max() - xs.min(), 1.0) * 0.05
+    dy = max(ys.max() - ys.min(), 1.0) * 0.05
+    return xs.min() - dx, xs.max() + dx, ys.min() - dy, ys.max() + dy
+
+
+def _joined(lines: List[List[Tuple[float, float]]]) -> Tuple[List[float], List[float]]:
+    """Join lines into one x, y list separated by np.nan"""
+    xs, ys = [], []
+    for line in lines:
+        for x, y in line:
+            xs.append(x)
+            ys.append(y)
+        xs.append(np.nan)
+        ys.append(np.nan)
+    return xs, ys
+
+
+def render_crosssection(data: dict, filename: str) -> str:
+    """Draw the thumbnail of a crosssection (see rendering.RenderService.render_crosssection for the data)"""
+    profile = (data["l"], data["z"])
+    ditches = _joined(data["ditches"])
+    waterbottoms = _joined(data["waterbottoms"])
+
+    thumbnail = Thumbnail(*_get_extent([profile, ditches, waterbottoms], []))
+    thumbnail.polyline(*waterbottoms, "c")
+    thumbnail.polyline(*ditches, "b")
+    thumbnail.polyline(*profile, "k")
+    thumbnail.points(data["reference_point"][:1], data["reference_point"][1:], "r")
+    return thumbnail.save(filename)
+
+
+def render_stbu(data: dict, filename: str) -> str:
+    """Draw the thumbnail of a simple STBU assessment (see rendering.RenderService.render_stbu for the data)"""
+    profile = (data["l"], data["z"])
+    leveeline = _joined([data["leveeline"]])
+    minline = _joined([data["minline"]])
+
+    thumbnail = Thumbnail(*_get_extent([profile, leveeline, minline], data["rectangles"]))
+    for x, y, width, height, color in data["rectangles"]:
+        thumbnail.rectangle(x, y, width, height, color)
+    thumbnail.polyline(*profile, "k", dash=4)
+    thumbnail.polyline(*leveeline, "k")
+    thumbnail.polyline(*minline, "g" if data["result"] else "r", dash=4)
+    return thumbnail.save(filename)
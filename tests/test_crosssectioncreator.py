@@ -0,0 +1,148 @@
+import json
+import math
+
+import numpy as np
+import pytest
+import rasterio as rio
+import shapefile
+from rasterio.transform import from_origin
+
+from mlas.objects.crosssection import Crosssection
+from mlas.objects.points import Point3D, PointType
+
+from mlas_waternet.creators.crosssectioncreator import CrosssectionCreator
+from mlas_waternet.dataproviders.heightdataprovider import HeightDataProvider
+from mlas_waternet.gis.routes import get_routes
+from mlas_waternet.gis.tiles import TileInterpolation, TileType
+from mlas_waternet.settings import SETTINGS
+
+
+LEFT, TOP, RESOLUTION, SIZE = 120000.0, 480300.0, 0.5, 400
+NODATA = -9999.0
+ROUTE = [(120040.123, 480150.456), (120080.789, 480161.012), (120120.345, 480149.678), (120160.901, 480170.234)]
+
+
+@pytest.fixture
+def levee(tmp_path, monkeypatch):
+    """A route over one tile with height data, the tile has a few areas without data"""
+    rng = np.random.default_rng(4)
+    rows, columns = np.mgrid[0:SIZE, 0:SIZE]
+    data = np.sin(columns / 9.0) * 1.5 + np.cos(rows / 13.0) + rng.normal(0, 0.05, (SIZE, SIZE))
+    data[rng.random((SIZE, SIZE)) < 0.05] = NODATA
+    data[275:285, 150:165] = NODATA  # no data at the reference points of a few crosssections
+    with rio.open(
+        tmp_path / "ahn.tif",
+        "w",
+        driver="GTiff",
+        height=SIZE,
+        width=SIZE,
+        count=1,
+        dtype="float32",
+        crs="EPSG:28992",
+        transform=from_origin(LEFT, TOP, RESOLUTION, RESOLUTION),
+        nodata=NODATA,
+    ) as f:
+        f.write(data.astype(np.float32), 1)
+
+    filename = str(tmp_path / "routes")
+    with shapefile.Writer(filename, shapeType=shapefile.POLYLINE) as w:
+        w.field("DWKIDENT", "C")
+        w.line([[list(p) for p in ROUTE]])
+        w.record("A001")
+
+    monkeypatch.setitem(SETTINGS, "filepath_ahn3_geotiff", str(tmp_path))
+    monkeypatch.setitem(SETTINGS, "shapefile_routes", filename + ".shp")
+    return get_routes().get_by_levee_code("A001")
+
+
+def reference_crosssection(route, height_data_provider, chainage, left, right, spacing, rdp_epsilon):
+    """Create a crosssection one point at a time with the builtin round"""
+    points = [(p.chainage, p.point3d.x, p.point3d.y) for p in route.chainage_points]
+    (m1, x1, y1), (m2, x2, y2) = next((p1, p2) for p1, p2 in zip(points[:-1], points[1:]) if p1[0] <= chainage <= p2[0])
+    x = round(x1 + (chainage - m1) / (m2 - m1) * (x2 - x1), 2)
+    y = round(y1 + (chainage - m1) / (m2 - m1) * (y2 - y1), 2)
+    alpha = math.atan2(y1 - y2, x1 - x2)
+
+    xl = round(x + left * math.cos(alpha - math.radians(90)), 2)
+    yl = round(y + left * math.sin(alpha - math.radians(90)), 2)
+    xr = round(x + right * math.cos(alpha + math.radians(90)), 2)
+    yr = round(y + right * math.sin(alpha + math.radians(90)), 2)
+
+    points = []
+    dl = math.sqrt(pow(xl - xr, 2) + pow(yl - yr, 2))
+    for l in np.arange(0, dl + spacing * 0.99, spacing):
+        xp = round(xl + (l / dl) * (xr - xl), 2)
+        yp = round(yl + (l / dl) * (yr - yl), 2)
+        points.append(Point3D(x=xp, y=yp, z=round(height_data_provider.get_z(xp, yp), 2)))
+    for p in points:
+        p.l = round(math.sqrt(math.pow(p.x - points[0].x, 2) + math.pow(p.y - points[0].y, 2)), 2)
+
+    refpoint = Point3D(x=x, y=y, z=round(height_data_provider.get_z(x, y), 2), l=left, point_type=PointType.REFERENCEPOINT)
+    points = sorted([p for p in points if abs(p.l - refpoint.l) > 0.1] + [refpoint], key=lambda p: p.l)
+    points = [p for i, p in enumerate(points) if i in (0, len(points) - 1) or p is refpoint or not np.isnan(p.z)]
+    if np.isnan(points[0].z):
+        points[0].z = points[1].z
+    if np.isnan(points[-1].z):
+        points[-1].z = points[-2].z
+    i = points.index(refpoint)
+    if np.isnan(refpoint.z) and 0 < i < len(points) - 1:
+        p1, p2 = points[i - 1], points[i + 1]
+        refpoint.z = round(p1.z + (refpoint.l - p1.l) / (p2.l - p1.l) * (p2.z - p1.z), 2)
+
+    crosssection = Crosssection(levee_code=route.name, levee_chainage=chainage, points=points, reference_point=refpoint)
+    if rdp_epsilon > 0:
+        crosssection.rdp(rdp_epsilon)
+    return crosssection
+
+
+def _as_tuple(crosssection):
+    # np.nan is not equal to itself, the reference point can stay without z
+    def value(v):
+        return None if np.isnan(v) else float(v)
+
+    return (
+        crosssection.levee_chainage,
+        [(value(p.x), value(p.y), value(p.z), value(p.l), p.point_type) for p in crosssection.points],
+        (value(crosssection.reference_point.z), value(crosssection.reference_point.l)),
+    )
+
+
+@pytest.mark.parametrize("interpolation", [TileInterpolation.NEAREST, TileInterpolation.BILINEAR])
+@pytest.mark.parametrize("left, right", [(20, 50), (35, 10)])
+def test_batches_give_the_same_crosssections_as_one_at_a_time(levee, interpolation, left, right):
+    height_data_provider = HeightDataProvider(tile_type=TileType.AHN3, interpolation=interpolation)
+    creator = CrosssectionCreator(
+        levee_code="A001",
+        height_data_provider=height_data_provider,
+        left_from_refpoint=left,
+        right_from_refpoint=right,
+        center_to_center_distance_chainage=2,
+        batch_size=17,
+        prefetch=False,
+    )
+    result = creator.execute()
+
+    chainages = list(range(levee.min_chainage, levee.max_chainage, 2))
+    assert [crs.levee_chainage for crs in result] == chainages
+    expected = [
+        reference_crosssection(levee, height_data_provider, chainage, left, right, 0.5, creator.rdp_epsilon)
+        for chainage in chainages
+    ]
+    assert [_as_tuple(crs) for crs in result] == [_as_tuple(crs) for crs in expected]
+
+
+def test_manifests_change_with_the_kind_of_tileset(levee):
+    manifests = [
+        CrosssectionCreator(
+            levee_code="A001",
+            height_data_provider=HeightDataProvider(tile_type=TileType.AHN3, virtual_mosaic=virtual_mosaic),
+        ).get_manifests([10, 20])
+        for virtual_mosaic in [False, False, True]
+    ]
+    assert manifests[0] == manifests[1]
+    assert manifests[0][10] != manifests[2][10] and manifests[0][20] != manifests[2][20]
+    assert json.loads(manifests[2][10])["parameters"]["tilesets"]["tiles"] == {
+        "kind": "VirtualMosaicTileset",
+        "virtual_mosaic": True,
+        "corridor_mosaic": False,
+    }
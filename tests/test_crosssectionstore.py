@@ -0,0 +1,67 @@
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from mlas.objects.crosssection import Crosssection
+from mlas.objects.points import Point2D, Point3D, PointType
+
+from mlas_waternet.dataproviders.crosssectionstore import STORE_ROW_GROUP_SIZE, CrosssectionStore
+
+
+def _crosssection(chainage):
+    points = [Point3D(x=1000.0 + l, y=2000.0 + chainage, z=0.01 * l * chainage, l=l) for l in range(0, 40, 2)]
+    reference_point = Point3D(x=1015.0, y=2000.0 + chainage, z=1.5, l=15.0, point_type=PointType.REFERENCEPOINT)
+    points = sorted(points + [reference_point], key=lambda p: p.l)
+    crosssection = Crosssection(
+        levee_code="A001", levee_chainage=chainage, points=points, reference_point=reference_point
+    )
+    if chainage % 3 == 0:
+        crosssection.add_ditch([Point2D(x=30.0, z=-1.0), Point2D(x=30.5, z=-1.2)])
+    if chainage % 5 == 0:
+        crosssection.add_waterbottom([Point2D(x=38.0, z=-3.0)])
+    return crosssection
+
+
+def _as_tuple(crosssection):
+    return (
+        crosssection.levee_code,
+        crosssection.levee_chainage,
+        [(p.l, p.x, p.y, p.z, p.point_type) for p in crosssection.points],
+        (crosssection.reference_point.l, crosssection.reference_point.z, crosssection.reference_point.point_type),
+        [[(p.x, p.z) for p in ditch] for ditch in crosssection.ditches],
+        [[(p.x, p.z) for p in waterbottom] for waterbottom in crosssection.waterbottoms],
+    )
+
+
+def test_write_and_read(tmp_path):
+    store = CrosssectionStore(str(tmp_path))
+    crosssections = [_crosssection(chainage) for chainage in range(250, 0, -1)]  # not in chainage order
+    locations = store.write(crosssections)
+
+    assert len({filename for filename, _ in locations}) == 1
+    assert max(rowgroup for _, rowgroup in locations) == (len(crosssections) - 1) // STORE_ROW_GROUP_SIZE
+
+    expected = {crs.levee_chainage: _as_tuple(crs) for crs in crosssections}
+    assert [_as_tuple(crs) for crs in store.read("A001")] == [expected[c] for c in sorted(expected)]
+    assert [crs.levee_chainage for crs in store.read("A001", 100, 110)] == list(range(100, 111))
+
+    # reading the row groups of a file gives the crosssections at those locations
+    filename, rowgroup = locations[0]
+    result = store.read_row_groups(filename, [rowgroup])
+    assert crosssections[0].levee_chainage in [crs.levee_chainage for crs in result]
+
+
+def test_newest_version_and_remove_unreferenced(tmp_path):
+    store = CrosssectionStore(str(tmp_path))
+    (old_file, _), = store.write([_crosssection(1)])
+    (other_file, _), = store.write([_crosssection(2)])
+    newer = _crosssection(1)
+    newer.reference_point.z = 9.0
+    (new_file, _), = store.write([newer])
+
+    assert [crs.reference_point.z for crs in store.read("A001")] == [9.0, 1.5]
+    assert store.remove_unreferenced("A001", [new_file, other_file]) == 1
+    remaining = {Path(p).name for p in store.get_levee_path("A001").iterdir()}
+    assert remaining == {Path(new_file).name, Path(other_file).name}
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from mlas_waternet.helpers import rdp_mask, round_values, valid_runs
+
+
+def reference_rdp(l, z, epsilon):
+    """Recursive Ramer-Douglas-Peucker of a single line, returns the indices of the kept points"""
+    def simplify(start, end):
+        la, za, lb, zb = l[start], z[start], l[end], z[end]
+        length = np.hypot(lb - la, zb - za)
+        dmax, imax = -1.0, None
+        for i in range(start + 1, end):
+            if length > 0:
+                d = abs((lb - la) * (za - z[i]) - (la - l[i]) * (zb - za)) / length
+            else:
+                d = np.hypot(l[i] - la, z[i] - za)
+            if d > dmax:
+                dmax, imax = d, i
+        if imax is None or dmax <= epsilon:
+            return [start]
+        return simplify(start, imax) + simplify(imax, end)
+
+    if len(l) == 0:
+        return []
+    if len(l) == 1:
+        return [0]
+    return simplify(0, len(l) - 1) + [len(l) - 1]
+
+
+@pytest.mark.parametrize("epsilon", [0.0, 0.05, 0.2, 1.0])
+def test_rdp_mask_matches_reference(epsilon):
+    rng = np.random.default_rng(1)
+    n, m = 50, 80
+    l = np.cumsum(rng.random((n, m)) + 0.1, axis=1)
+    z = np.cumsum(rng.normal(0, 0.3, (n, m)), axis=1)
+    z[:, 10:20] = 1.0  # collinear points
+    counts = rng.integers(0, m + 1, n)
+    counts[:3] = [0, 1, 2]
+
+    keep = rdp_mask(l, z, epsilon, counts)
+    assert not keep[np.arange(m) >= counts[:, None]].any()
+    for row in range(n):
+        count = counts[row]
+        expected = reference_rdp(l[row, :count], z[row, :count], epsilon)
+        assert np.flatnonzero(keep[row]).tolist() == expected
+
+
+def test_rdp_mask_single_line():
+    l = np.array([0.0, 1.0, 2.0, 3.0, 4.0])
+    z = np.array([0.0, 0.0, 1.0, 0.0, 0.0])
+    assert rdp_mask(l, z, 0.1).tolist() == [[True, True, True, True, True]]
+    assert rdp_mask(l, z, 2.0).tolist() == [[True, False, False, False, True]]
+
+
+def test_valid_runs():
+    z = np.array(
+        [
+            [np.nan, 1.0, 2.0, np.nan, 3.0, 4.0],
+            [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+            [np.nan] * 6,
+            [1.0, np.nan, 1.0, 1.0, 1.0, 1.0],
+        ]
+    )
+    assert valid_runs(z) == [[(1, 3), (4, 6)], [(0, 6)], [], [(0, 1), (2, 6)]]
+    # only the first counts values of each line are used
+    assert valid_runs(z, np.array([5, 2, 6, 0])) == [[(1, 3), (4, 5)], [(0, 2)], [], []]
+    assert valid_runs(np.array([1.0, np.nan, 2.0])) == [[(0, 1), (2, 3)]]
+
+
+def test_round_values_rounds_like_round():
+    rng = np.random.default_rng(3)
+    values = np.concatenate([rng.uniform(-1e6, 1e6, 10000), np.arange(-2000, 2000) / 200, [479927.27499999997]])
+    values = np.concatenate([values, np.nextafter(values, -np.inf), np.nextafter(values, np.inf)])
+    assert round_values(values, 2).tolist() == [round(v, 2) for v in values.tolist()]
+    assert round_values(values, 1).tolist() == [round(v, 1) for v in values.tolist()]
+    assert round_values(479927.27499999997, 2) == 479927.27
+    assert np.isnan(round_values(np.array([np.nan]), 2)[0])
@@ -0,0 +1,114 @@
+import math
+import os
+import numpy as np
+import pytest
+import shapefile
+
+from mlas_waternet.gis.routes import Routes, _route_array
+
+
+ROUTES = {
+    "A001": [(1000.0, 2000.0), (1100.0, 2000.0), (1150.0, 2050.0), (1150.0, 2200.0), (1393.217, 2457.093)],
+    "A002": [(1000.0, 1900.0), (1300.0, 1910.0)],
+    "C001": [(120000.125, 479927.27499999997), (120100.0, 479927.27499999997)],  # y is just below a half cent
+    "B001": [(5000.0, 5000.0), (5000.3, 5000.2), (5040.0, 5030.0)],  # second point gets the same chainage
+}
+
+
+@pytest.fixture
+def routes_shapefile(tmp_path):
+    filename = str(tmp_path / "routes")
+    with shapefile.Writer(filename, shapeType=shapefile.POLYLINE) as w:
+        w.field("DWKIDENT", "C")
+        for code, points in ROUTES.items():
+            w.line([[list(p) for p in points]])
+            w.record(code)
+    return filename + ".shp"
+
+
+def test_routes(routes_shapefile):
+    for _ in range(2):  # the second time the routes are read from the cache
+        routes = Routes(shapefile=routes_shapefile)
+        assert sorted(routes.get_levee_codes()) == sorted(ROUTES.keys())
+        assert sorted(routes.routes.keys()) == sorted(ROUTES.keys())
+        assert routes.get_by_levee_code("X999") is None
+
+        route = routes.get_by_levee_code("B001")
+        expected = _route_array(ROUTES["B001"])
+        assert len(expected) == 2
+        assert [(p.chainage, p.point3d.x, p.point3d.y) for p in route.chainage_points] == [
+            tuple(row) for row in expected.tolist()
+        ]
+        assert route.max_chainage == 50
+
+
+def reference_locate(x, y, max_distance):
+    """Check all segments of all routes"""
+    best = (np.inf, None, np.nan, np.nan)
+    for code, points in ROUTES.items():
+        array = _route_array(points)
+        for (m1, x1, y1), (m2, x2, y2) in zip(array[:-1], array[1:]):
+            dx, dy = x2 - x1, y2 - y1
+            t = min(max(((x - x1) * dx + (y - y1) * dy) / (dx * dx + dy * dy), 0.0), 1.0)
+            distance = np.hypot(x1 + t * dx - x, y1 + t * dy - y)
+            if distance < best[0]:
+                side = -1.0 if dx * (y - y1) - dy * (x - x1) > 0 else 1.0
+                best = (distance, code, m1 + t * (m2 - m1), side * distance)
+    if best[0] > max_distance:
+        return None, np.nan, np.nan
+    return best[1], best[2], best[3]
+
+
+def test_locate(routes_shapefile):
+    routes = Routes(shapefile=routes_shapefile)
+    rng = np.random.default_rng(2)
+    xs = np.concatenate([rng.uniform(950, 1250, 500), rng.uniform(4990, 5050, 100)])
+    ys = np.concatenate([rng.uniform(1850, 2250, 500), rng.uniform(4990, 5040, 100)])
+    for max_distance in [10.0, 100.0]:
+        codes, chainages, offsets = routes.locate(xs, ys, max_distance=max_distance)
+        for x, y, code, chainage, offset in zip(xs, ys, codes, chainages, offsets):
+            expected = reference_locate(x, y, max_distance)
+            assert code == expected[0]
+            np.testing.assert_allclose([chainage, offset], expected[1:], atol=1e-9)
+
+
+def test_locate_offset_is_positive_on_the_right_side(routes_shapefile):
+    routes = Routes(shapefile=routes_shapefile)
+    codes, chainages, offsets = routes.locate(np.array([1050.0, 1050.0]), np.array([1995.0, 2005.0]))
+    assert codes.tolist() == ["A001", "A001"]
+    np.testing.assert_allclose(chainages, [50.0, 50.0])
+    np.testing.assert_allclose(offsets, [5.0, -5.0])
+
+
+def test_cache_is_rebuilt_when_the_shapefile_changes(routes_shapefile):
+    routes = Routes(shapefile=routes_shapefile)
+    assert "D001" not in routes.get_levee_codes()
+    routes.close()
+
+    filename = routes_shapefile[:-4]
+    with shapefile.Writer(filename, shapeType=shapefile.POLYLINE) as w:
+        w.field("DWKIDENT", "C")
+        w.line([[[0.0, 0.0], [30.0, 40.0]]])
+        w.record("D001")
+    mtime = os.path.getmtime(routes_shapefile) + 10
+    os.utime(routes_shapefile, (mtime, mtime))
+
+    routes = Routes(shapefile=routes_shapefile)
+    assert list(routes.get_levee_codes()) == ["D001"]
+    assert routes.get_by_levee_code("D001").max_chainage == 50
+
+
+@pytest.mark.parametrize("levee_code", ["A001", "C001"])
+def test_xya_at_chainages_rounds_like_round(routes_shapefile, levee_code):
+    route = Routes(shapefile=routes_shapefile).get_by_levee_code(levee_code)
+    points = _route_array(ROUTES[levee_code]).tolist()
+    chainages = np.arange(0, route.max_chainage + 1)
+    xs, ys, alphas = route.xya_at_chainages(chainages)
+    for chainage, x, y, alpha in zip(chainages.tolist(), xs.tolist(), ys.tolist(), alphas.tolist()):
+        # the first segment that contains the chainage
+        (m1, x1, y1), (m2, x2, y2) = next(
+            (p1, p2) for p1, p2 in zip(points[:-1], points[1:]) if p1[0] <= chainage <= p2[0]
+        )
+        assert x == round(x1 + (chainage - m1) / (m2 - m1) * (x2 - x1), 2)
+        assert y == round(y1 + (chainage - m1) / (m2 - m1) * (y2 - y1), 2)
+        assert alpha == math.atan2(y1 - y2, x1 - x2)
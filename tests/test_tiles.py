@@ -0,0 +1,179 @@
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.transform import from_origin
+
+from mlas_waternet.gis.tiles import Tileset, TileInterpolation, TileType
+from mlas_waternet.settings import SETTINGS
+
+
+LEFT, TOP, RESOLUTION, SIZE = 120000.0, 481000.0, 0.5, 40
+NODATA = -9999.0
+
+
+def _write_tile(filename, data, left, top):
+    with rio.open(
+        filename,
+        "w",
+        driver="GTiff",
+        height=data.shape[0],
+        width=data.shape[1],
+        count=1,
+        dtype="float32",
+        crs="EPSG:28992",
+        transform=from_origin(left, top, RESOLUTION, RESOLUTION),
+        nodata=NODATA,
+    ) as f:
+        f.write(data.astype(np.float32), 1)
+
+
+@pytest.fixture
+def grid(tmp_path, monkeypatch):
+    """Two tiles next to each other with a smooth surface and a few cells without data
+
+    Returns the tileset directory and the data of both tiles as one array with
+    np.nan for no data.
+    """
+    rows, columns = np.mgrid[0:SIZE, 0 : 2 * SIZE]
+    data = np.sin(columns / 5.0) * 2.0 + np.cos(rows / 7.0) + 0.01 * columns * rows
+    data = data.astype(np.float32).astype(float)
+    data[10, 10] = np.nan
+    data[25, 30:33] = np.nan
+
+    tiledata = np.where(np.isnan(data), NODATA, data)
+    _write_tile(tmp_path / "left.tif", tiledata[:, :SIZE], LEFT, TOP)
+    _write_tile(tmp_path / "right.tif", tiledata[:, SIZE:], LEFT + SIZE * RESOLUTION, TOP)
+    monkeypatch.setitem(SETTINGS, "filepath_hydraulic_head", str(tmp_path))
+    return data
+
+
+def _cell(data, row, column):
+    if 0 <= row < data.shape[0] and 0 <= column < data.shape[1]:
+        return data[row, column]
+    return np.nan
+
+
+# like the tile catalog the center of the first cell is half a cell left of and above the raster bounds
+X0, Y0 = LEFT - RESOLUTION / 2.0, TOP + RESOLUTION / 2.0
+
+
+def _fractions(x, y):
+    """The position of a point in cells, relative to the center of the first cell"""
+    return (x - X0) / RESOLUTION, (Y0 - y) / RESOLUTION
+
+
+def _keys(t):
+    """Keys cubic convolution kernel (a=-0.5)"""
+    t = abs(t)
+    if t <= 1:
+        return 1.5 * t ** 3 - 2.5 * t ** 2 + 1
+    if t < 2:
+        return -0.5 * t ** 3 + 2.5 * t ** 2 - 4 * t + 2
+    return 0.0
+
+
+def reference_nearest(data, x, y):
+    fx, fy = _fractions(x, y)
+    return _cell(data, int(np.floor(fy + 0.5)), int(np.floor(fx + 0.5)))
+
+
+def reference_bilinear(data, x, y):
+    fx, fy = _fractions(x, y)
+    ix, iy = int(np.floor(fx)), int(np.floor(fy))
+    tx, ty = fx - ix, fy - iy
+    if np.isnan(reference_nearest(data, x, y)):
+        return np.nan
+    total, weights = 0.0, 0.0
+    for dy, wy in ((0, 1 - ty), (1, ty)):
+        for dx, wx in ((0, 1 - tx), (1, tx)):
+            z = _cell(data, iy + dy, ix + dx)
+            if not np.isnan(z):
+                total += wx * wy * z
+                weights += wx * wy
+    return total / weights if weights > 0 else np.nan
+
+
+def _block(data, x, y):
+    """The 4x4 cells around a point"""
+    fx, fy = _fractions(x, y)
+    ix, iy = int(np.floor(fx)), int(np.floor(fy))
+    return np.array([[_cell(data, iy + dy, ix + dx) for dx in range(-1, 3)] for dy in range(-1, 3)])
+
+
+def reference_cubic(data, x, y):
+    fx, fy = _fractions(x, y)
+    ix, iy = int(np.floor(fx)), int(np.floor(fy))
+    block = _block(data, x, y)
+    if np.isnan(block).any():
+        return reference_bilinear(data, x, y)
+    wx = np.array([_keys(fx - (ix + dx)) for dx in range(-1, 3)])
+    wy = np.array([_keys(fy - (iy + dy)) for dy in range(-1, 3)])
+    return float(wy @ block @ wx)
+
+
+def _points(n=2000, seed=0):
+    """Random points inside the tiles, away from the outer edges"""
+    rng = np.random.default_rng(seed)
+    xs = LEFT + RESOLUTION * (2 + rng.random(n) * (2 * SIZE - 4))
+    ys = TOP - RESOLUTION * (2 + rng.random(n) * (SIZE - 4))
+    return xs, ys
+
+
+@pytest.mark.parametrize(
+    "interpolation, reference",
+    [
+        (TileInterpolation.NEAREST, reference_nearest),
+        (TileInterpolation.BILINEAR, reference_bilinear),
+        (TileInterpolation.CUBIC, reference_cubic),
+    ],
+)
+def test_sample_matches_reference(grid, interpolation, reference):
+    xs, ys = _points()
+    if interpolation == TileInterpolation.NEAREST:
+        # the nearest cell of the last half cell of a tile is in the next tile, like the tile
+        # lookup has always done the tileset has no data there, the interpolations are not affected
+        fx, _ = _fractions(xs, ys)
+        keep = ~((fx > SIZE - 0.5) & (fx < SIZE))
+        xs, ys = xs[keep], ys[keep]
+    tileset = Tileset(tile_type=TileType.HYDRAULIC_HEAD, interpolation=interpolation)
+    result = tileset.sample(xs, ys)
+    expected = np.array([reference(grid, x, y) for x, y in zip(xs, ys)])
+
+    np.testing.assert_array_equal(np.isnan(result), np.isnan(expected))
+    np.testing.assert_allclose(result, expected, atol=1e-6, equal_nan=True)
+
+
+def test_cubic_falls_back_to_bilinear_next_to_no_data(grid):
+    # points around the cells without data, part of their 4x4 block has no data
+    fx, fy = np.meshgrid(np.linspace(27.0, 36.0, 37), np.linspace(22.0, 28.0, 25))
+    xs = X0 + fx.ravel() * RESOLUTION
+    ys = Y0 - fy.ravel() * RESOLUTION
+    cubic = Tileset(tile_type=TileType.HYDRAULIC_HEAD, interpolation=TileInterpolation.CUBIC).sample(xs, ys)
+    bilinear = Tileset(tile_type=TileType.HYDRAULIC_HEAD, interpolation=TileInterpolation.BILINEAR).sample(xs, ys)
+
+    incomplete = np.array([np.isnan(_block(grid, x, y)).any() for x, y in zip(xs, ys)])
+    assert incomplete.any() and not incomplete.all()
+    np.testing.assert_array_equal(np.isnan(cubic), np.isnan(bilinear))
+    np.testing.assert_allclose(cubic[incomplete], bilinear[incomplete], atol=1e-6, equal_nan=True)
+
+
+def test_sample_keeps_the_shape_and_handles_missing_coordinates(grid):
+    xs, ys = _points(12)
+    xs[3] = np.nan
+    for interpolation in TileInterpolation:
+        tileset = Tileset(tile_type=TileType.HYDRAULIC_HEAD, interpolation=interpolation)
+        result = tileset.sample(xs.reshape(3, 4), ys.reshape(3, 4))
+        assert result.shape == (3, 4)
+        assert np.isnan(result[0, 3])
+        assert not np.isnan(result.ravel()[[0, 1, 2]]).any()
+
+
+def test_cell_centers_give_the_cell_values(grid):
+    rows, columns = np.mgrid[2 : SIZE - 2, 2 : 2 * SIZE - 2]
+    xs = X0 + columns.ravel() * RESOLUTION
+    ys = Y0 - rows.ravel() * RESOLUTION
+    expected = grid[rows.ravel(), columns.ravel()]
+    for interpolation in TileInterpolation:
+        tileset = Tileset(tile_type=TileType.HYDRAULIC_HEAD, interpolation=interpolation)
+        valid = ~np.isnan(expected)
+        np.testing.assert_allclose(tileset.sample(xs, ys)[valid], expected[valid], atol=1e-6)